@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'KhaboBackend.settings')
+# Route the read endpoints to the async views, see ASYNC_VIEWS in settings.py
+os.environ.setdefault('KHABO_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -84,6 +85,24 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+# The recipe details are kept here under their version, the versions themselves are
+# in the database (recipe_visualizer/recipe_cache.py) so a cache per process is safe.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
+# Seconds a rendered recipe stays cached, a new version replaces it anyway
+RECIPE_CACHE_TIMEOUT = 60 * 60 * 24
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -129,6 +148,19 @@ STATICFILES_DIRS = [BASE_DIR / 'static',]
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'uploads'
 
+# Uploads are stored once per content under MEDIA_ROOT/blobs/, see recipe_visualizer/storage.py.
+# Whatever serves MEDIA_URL in production should send
+# "Cache-Control: public, max-age=31536000, immutable" for blobs/ and variants/blobs/.
+# https://docs.djangoproject.com/en/4.2/ref/settings/#storages
+STORAGES = {
+    'default': {
+        'BACKEND': 'recipe_visualizer.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
@@ -136,8 +168,73 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'DEFAULT_PAGINATION_CLASS': 'recipe_visualizer.pagination.KeysetPagination',
+    'PAGE_SIZE': 20,
 }
 
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Khabo API',
 }
+
+# Full text search used by SearchByDescriptionView. The FTS5 backend needs SQLite,
+# use recipe_visualizer.search.InvertedIndexBackend on other databases.
+SEARCH_BACKEND = 'recipe_visualizer.search.Fts5SearchBackend'
+
+# Class with a stem(word) method applied to the search terms, e.g. 'nltk.stem.PorterStemmer'.
+# The FTS5 backend stems by itself, InvertedIndexBackend needs rebuild_search_index after a change.
+SEARCH_STEMMER = None
+
+# In-process cache of search responses, see recipe_visualizer/search_cache.py. Writes are
+# recorded in the database, so every worker stops serving the entries they affect.
+SEARCH_CACHE = {
+    'MAX_ENTRIES': 1000,
+    'TTL': 300,
+}
+
+# Buffered search hit and open counters, see recipe_visualizer/search_stats.py
+SEARCH_STATS = {
+    'MAX_KEYS': 10000,
+    'FLUSH_INTERVAL': 30,
+}
+
+# Leaderboard of recipes/trending/, rebuilt by the refresh_trending command. Activity counts
+# half as much after HALF_LIFE_HOURS, see recipe_visualizer/trending.py
+TRENDING = {
+    'SIZE': 50,
+    'HALF_LIFE_HOURS': 24,
+}
+
+# Neighbours kept per recipe for recipes/<pk>/similar/, built by the build_similar_recipes command
+SIMILAR_RECIPES = {
+    'NEIGHBOURS': 10,
+}
+
+# recipes/pantry/, see recipe_visualizer/pantry.py. The BITS most used ingredients get a bit in
+# the in-memory index, the staples are ingredients the search assumes every kitchen has.
+PANTRY = {
+    'BITS': 512,
+    'STAPLES': [
+        'salt', 'kosher salt', 'sea salt', 'pepper', 'black pepper', 'water', 'ice',
+        'oil', 'olive oil', 'vegetable oil', 'canola oil', 'sugar',
+    ],
+}
+
+# ingredients/autocomplete/ and tags/autocomplete/, see recipe_visualizer/autocomplete.py. The
+# in-memory completers are rebuilt at most every REFRESH_SECONDS after a change, on a
+# background thread if BACKGROUND is on, the old ones answer meanwhile.
+AUTOCOMPLETE = {
+    'LIMIT': 10,
+    'CACHE_SIZE': 10000,
+    'REFRESH_SECONDS': 60,
+    'BACKGROUND': True,
+}
+
+# Widths of the resized copies made of every uploaded image, see recipe_visualizer/images.py
+IMAGE_VARIANT_WIDTHS = (160, 320, 640)
+IMAGE_VARIANT_QUALITY = 80
+# Render the variants of uploads on a background thread rather than in the request
+IMAGE_VARIANT_BACKGROUND = True
+
+# Serve the read and search endpoints with the async views of recipe_visualizer/async_views.py.
+# asgi.py turns this on, under WSGI every async view would need a thread of its own.
+ASYNC_VIEWS = os.environ.get('KHABO_ASYNC_VIEWS', '') == '1'
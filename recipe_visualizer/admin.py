@@ -5,6 +5,7 @@ from .models import (
     IngredientCategory,
     Brand,
     Ingredient,
+    IngredientAlias,
     Type,
     Recipe,
     RecipeType,
@@ -15,7 +16,8 @@ from .models import (
     Feedback,
     RecipeIngredient,
     Tag,
-    RecipeTag
+    RecipeTag,
+    TrendingRecipe,
 )
 
 # Register your models here.
@@ -24,6 +26,7 @@ admin.site.register(Category)
 admin.site.register(IngredientCategory)
 admin.site.register(Brand)
 admin.site.register(Ingredient)
+admin.site.register(IngredientAlias)
 admin.site.register(Type)
 admin.site.register(Recipe)
 admin.site.register(RecipeType)
@@ -35,3 +38,4 @@ admin.site.register(Feedback)
 admin.site.register(RecipeIngredient)
 admin.site.register(Tag)
 admin.site.register(RecipeTag)
+admin.site.register(TrendingRecipe)
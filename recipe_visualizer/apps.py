@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class RecipeVisualizerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipe_visualizer'
+
+    def ready(self):
+        # Register the signal handlers that keep the search indexes up to date
+        from . import signals  # noqa: F401
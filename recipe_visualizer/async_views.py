@@ -0,0 +1,181 @@
+# Async versions of the hot read endpoints, used instead of the DRF views in views.py
+# when the site runs under ASGI (settings.ASYNC_VIEWS). They answer with the same JSON
+# but wait on the database, cache and search backend without holding a thread.
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.views import View
+from rest_framework.exceptions import APIException
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from .models import Recipe
+from .pagination import KeysetPagination
+from .serializers import RecipeListSerializer, RecipeSerializer, SearchByDescriptionSerializer, SearchByIngredientsSerializer
+from . import recipe_cache, search, search_cache, search_stats, streaming, views
+
+
+class AsyncAPIView(View):
+    """
+    Plain Django async view speaking JSON like the DRF views. Only for endpoints
+    open to anonymous users, it doesn't authenticate.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # Like DRF's APIView, csrf_exempt() itself would hide that the view is async in Django 4.2
+        view.csrf_exempt = True
+        return view
+
+    def dispatch(self, request, *args, **kwargs):
+        return self.handle_exceptions(super().dispatch(request, *args, **kwargs))
+
+    async def handle_exceptions(self, response):
+        # Invalid cursors and request bodies, answered like DRF does
+        try:
+            return await response
+        except APIException as exc:
+            return self.render({'detail': exc.detail}, status=exc.status_code)
+
+    @staticmethod
+    def drf_request(request):
+        # For query_params and parsed request bodies, the ASGI handler has already read the body
+        return Request(request, parsers=[JSONParser(), FormParser(), MultiPartParser()])
+
+    @staticmethod
+    async def get_user_id(request):
+        # The session user of AuthenticationMiddleware, for the search stats. Loading it
+        # queries the database unless the request has no session.
+        return await sync_to_async(lambda: request.user.pk)()
+
+    @staticmethod
+    def render(data, status=200, headers=None):
+        content = JSONRenderer().render(data) if data is not None else b''
+        return HttpResponse(content, status=status, headers=headers, content_type='application/json')
+
+
+class HomePageView(AsyncAPIView):
+    keyset_ordering = ('-rating', '-id')
+
+    async def get(self, request):
+        request = self.drf_request(request)
+        paginator = KeysetPagination()
+        page = await paginator.apaginate_queryset(Recipe.objects.for_list().filter(is_feature=True), request, self)
+        # The rows come with their users, serializing doesn't touch the database
+        serializer = RecipeListSerializer(page, many=True, context={'request': request})
+        return self.render(paginator.get_paginated_response(serializer.data).data)
+
+
+class TrendingRecipesView(AsyncAPIView):
+    async def get(self, request):
+        request = self.drf_request(request)
+        recipes = [recipe async for recipe in Recipe.objects.for_list().filter(trending__isnull=False).order_by('trending__rank')]
+        serializer = RecipeListSerializer(recipes, many=True, context={'request': request})
+        return self.render({'results': serializer.data})
+
+
+class RecipeListView(AsyncAPIView):
+    keyset_ordering = ('-id',)
+
+    async def get(self, request):
+        request = self.drf_request(request)
+        fmt = streaming.stream_format(request)
+        if fmt:
+            queryset = Recipe.objects.for_list().order_by(*self.keyset_ordering)
+            return streaming.astream_response(queryset, RecipeListSerializer, {'request': request}, fmt)
+        paginator = KeysetPagination()
+        page = await paginator.apaginate_queryset(Recipe.objects.for_list(), request, self)
+        serializer = RecipeListSerializer(page, many=True, context={'request': request})
+        return self.render(paginator.get_paginated_response(serializer.data).data)
+
+
+class RecipeDetailsView(AsyncAPIView):
+    async def get(self, request, pk):
+        version = await recipe_cache.aget_version(pk)
+        if version is None:
+            return self.render({'detail': 'Not found.'}, status=404)
+        headers = recipe_cache.headers(pk, version)
+        search_stats.counters.record_open(await self.get_user_id(request), pk)
+
+        # The client's copy is current, answer from the version alone
+        if recipe_cache.not_modified(request, pk, version):
+            return self.render(None, status=304, headers=headers)
+
+        base_url = request.build_absolute_uri('/')
+        data = await recipe_cache.aget_payload(pk, version, base_url)
+        if data is None:
+            try:
+                # aget() runs the prefetches of for_detail() too
+                recipe = await Recipe.objects.for_detail().aget(pk=pk)
+            except Recipe.DoesNotExist:
+                return self.render({'detail': 'Not found.'}, status=404)
+            data = RecipeSerializer(recipe, context={'request': self.drf_request(request)}).data
+            await recipe_cache.aset_payload(pk, version, base_url, data)
+        return self.render(data, headers=headers)
+
+
+class SearchByIngredientsView(AsyncAPIView):
+    async def post(self, request):
+        user_id = await self.get_user_id(request)
+        request = self.drf_request(request)
+        serializer = SearchByIngredientsSerializer(data=request.data)
+        if not serializer.is_valid():
+            return self.render(serializer.errors, status=400)
+        ingredient_names = serializer.validated_data['ingredients']
+        match = serializer.validated_data['match']
+
+        # Repeated searches are answered from the cache until a write affects them
+        cache_key = views.ingredient_search_key(request, ingredient_names, match)
+        data = await search_cache.results.aget(cache_key)
+        if data is not None:
+            views.record_search_hits(user_id, data)
+            return self.render(data)
+        generation = await search_cache.results.ageneration()
+
+        paginator = KeysetPagination()
+        # Resolving the names and loading the page query the database and may build the ingredient index
+        groups, ranking, recipes_by_id = await sync_to_async(views.rank_by_ingredients)(paginator, request, ingredient_names, match)
+        data, tags = views.ingredient_search_response(paginator, request, recipes_by_id, groups, ranking, match)
+        search_cache.results.set(cache_key, data, tags, generation)
+        views.record_search_hits(user_id, data)
+        return self.render(data)
+
+
+class SearchByDescriptionView(AsyncAPIView):
+    keyset_ordering = ('-id',)
+
+    async def post(self, request):
+        user_id = await self.get_user_id(request)
+        request = self.drf_request(request)
+        serializer = SearchByDescriptionSerializer(data=request.data)
+        if not serializer.is_valid():
+            return self.render(serializer.errors, status=400)
+        description = serializer.validated_data['description']
+
+        # Repeated searches are answered from the cache until a write affects them
+        cache_key = views.description_search_key(request, description)
+        data = await search_cache.results.aget(cache_key)
+        if data is not None:
+            views.record_search_hits(user_id, data)
+            return self.render(data)
+        generation = await search_cache.results.ageneration()
+
+        paginator = KeysetPagination()
+        # The search backends run raw SQL, which has no async interface
+        hits = await sync_to_async(search.get_backend().search)(description)
+        if hits is None:
+            # Nothing but stop words, list every recipe
+            recipes = await paginator.apaginate_queryset(Recipe.objects.for_list().filter(is_valid=True), request, self)
+        else:
+            # The recipes are loaded while filling the page, until it has enough valid ones
+            recipes_by_id = {}
+            hits = await sync_to_async(paginator.paginate_sequence)(
+                hits, lambda hit: (-hit.score, -hit.recipe_id), request, views.load_recipes(recipes_by_id, lambda hit: hit.recipe_id),
+            )
+            recipes = [recipes_by_id[hit.recipe_id] for hit in hits]
+
+        snippets = await sync_to_async(views.page_snippets)(description, hits)
+        data, tags = views.description_search_response(paginator, request, description, hits, recipes, snippets)
+        search_cache.results.set(cache_key, data, tags, generation)
+        views.record_search_hits(user_id, data)
+        return self.render(data)
@@ -0,0 +1,180 @@
+import bisect
+import heapq
+import logging
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.db.models import Count
+from .models import Ingredient, Tag
+
+logger = logging.getLogger(__name__)
+
+# Prefixes this short match a large part of the keys, their answers are computed by build()
+PRECOMPUTED_LENGTH = 2
+
+# Sorts after every character a name can continue with
+END = '\U0010ffff'
+
+
+def get_options():
+    options = getattr(settings, 'AUTOCOMPLETE', {})
+    return (
+        options.get('LIMIT', 10), options.get('CACHE_SIZE', 10000), options.get('REFRESH_SECONDS', 60),
+        options.get('BACKGROUND', True),
+    )
+
+
+def normalize(text):
+    return ' '.join(text.lower().split())
+
+
+class Completer:
+    """
+    Names starting with a prefix, most used first.
+
+    Every word start of every name is a key of one sorted list, so the keys of a
+    prefix are found with two bisects wherever it starts in the name, 'sug' finds
+    'brown sugar'. The names are numbered by use, the best completions are the
+    lowest numbers among those keys. Answers to the short prefixes are computed
+    up front, the others are kept in an LRU cache.
+    """
+
+    def __init__(self, entries, limit=10, cache_size=10000):
+        # [(id, name, uses)], one entry per name, the most used wins
+        self.limit = limit
+        self.cache_size = cache_size
+        self.entries = []
+        seen = set()
+        for entry in sorted(entries, key=lambda entry: (-entry[2], normalize(entry[1]), entry[0])):
+            name = normalize(entry[1])
+            if name and name not in seen:
+                seen.add(name)
+                self.entries.append((entry[0], entry[1]))
+
+        keys = []
+        for number, (pk, name) in enumerate(self.entries):
+            words = normalize(name).split(' ')
+            for start in range(len(words)):
+                keys.append((' '.join(words[start:]), number))
+        keys.sort()
+        self.keys = [key for key, number in keys]
+        self.numbers = [number for key, number in keys]
+
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.precomputed = {}
+        for prefix in {key[:length] for key in self.keys for length in range(1, PRECOMPUTED_LENGTH + 1)}:
+            self.precomputed[prefix] = self._lookup(prefix)
+        self.built_at = time.monotonic()
+        self.changed = False
+
+    def _lookup(self, prefix):
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_right(self.keys, prefix + END, start)
+        numbers = heapq.nsmallest(self.limit, set(self.numbers[start:end]))
+        return [self.entries[number] for number in numbers]
+
+    def complete(self, text):
+        """
+        [(id, name)] of the most used names with a word starting with text.
+        """
+        prefix = normalize(text)
+        if not prefix:
+            return []
+        if len(prefix) <= PRECOMPUTED_LENGTH:
+            return self.precomputed.get(prefix, [])
+        with self.lock:
+            if prefix in self.cache:
+                self.cache.move_to_end(prefix)
+                return self.cache[prefix]
+        results = self._lookup(prefix)
+        with self.lock:
+            self.cache[prefix] = results
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return results
+
+
+def load(kind):
+    """
+    (id, name, number of recipes using it) of every ingredient or tag.
+    """
+    if kind == 'ingredients':
+        queryset = Ingredient.objects.annotate(uses=Count('recipeingredient'))
+    else:
+        queryset = Tag.objects.annotate(uses=Count('recipetag'))
+    return list(queryset.order_by().values_list('id', 'name', 'uses'))
+
+
+_completers = {}
+# Kinds being rebuilt, and the number of changes so far, both under _build_lock
+_building = set()
+_generation = 0
+_build_lock = threading.Lock()
+_first_build_lock = threading.Lock()
+
+
+def build(kind):
+    """
+    Build a completer aside and swap it in, the old one serves meanwhile. A change
+    made while the names were loading may be missing, then it is due for a refresh.
+    """
+    limit, cache_size, refresh, background = get_options()
+    with _build_lock:
+        generation = _generation
+    try:
+        completer = Completer(load(kind), limit=limit, cache_size=cache_size)
+        with _build_lock:
+            completer.changed = generation != _generation
+            _completers[kind] = completer
+    finally:
+        with _build_lock:
+            _building.discard(kind)
+    return completer
+
+
+def _rebuild(kind):
+    try:
+        build(kind)
+    except DatabaseError:
+        logger.exception('Could not rebuild the %s completer', kind)
+    finally:
+        # This thread has its own connection, don't keep it past CONN_MAX_AGE
+        close_old_connections()
+
+
+def get_completer(kind):
+    """
+    The process-wide completer of 'ingredients' or 'tags'. The first request builds
+    it, after that it is rebuilt at most every REFRESH_SECONDS once names or recipes
+    changed, on a background thread unless BACKGROUND is off.
+    """
+    limit, cache_size, refresh, background = get_options()
+    completer = _completers.get(kind)
+    if completer is None:
+        # Nothing to serve yet, the first requests wait for one build
+        with _first_build_lock:
+            completer = _completers.get(kind)
+            if completer is None:
+                completer = build(kind)
+        return completer
+    if completer.changed and time.monotonic() - completer.built_at > refresh:
+        with _build_lock:
+            start = kind not in _building
+            _building.add(kind)
+        if start and background:
+            threading.Thread(target=_rebuild, args=(kind,), name=f'autocomplete-{kind}', daemon=True).start()
+        elif start:
+            completer = build(kind)
+    return completer
+
+
+def vocabulary_changed():
+    # New names and new uses, the completers pick them up on their next refresh
+    global _generation
+    with _build_lock:
+        _generation += 1
+        for completer in _completers.values():
+            completer.changed = True
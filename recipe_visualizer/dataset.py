@@ -0,0 +1,121 @@
+# Streaming parser of the scraped recipe CSV (final_dataset.csv). It doesn't import
+# Django so the worker processes start quickly.
+import ast
+import csv
+import io
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+LIST_COLUMNS = ('ingredients', 'quantities', 'tags', 'steps')
+
+
+def parse_list(text):
+    """
+    Parse a stringified Python list such as "['a', 'b']" without going through
+    ast.literal_eval when JSON can read it.
+    """
+    try:
+        value = json.loads(text)
+    except ValueError:
+        # Single quoted items only become JSON if no item has quotes or escapes of its own
+        if '"' in text or '\\' in text:
+            value = ast.literal_eval(text)
+        else:
+            try:
+                value = json.loads(text.replace("'", '"'))
+            except ValueError:
+                value = ast.literal_eval(text)
+    if not isinstance(value, list):
+        raise ValueError(f'Expected a list, got {text[:50]!r}')
+    return value
+
+
+def parse_record(row):
+    record = dict(row)
+    for column in LIST_COLUMNS:
+        record[column] = parse_list(row[column])
+    return record
+
+
+def read_header(path):
+    """
+    Return the column names and the byte offset of the first record.
+    """
+    with open(path, 'rb') as file:
+        line = file.readline()
+    return next(csv.reader([line.decode('utf-8')])), len(line)
+
+
+def record_boundary(data):
+    """
+    Offset just past the last newline of data that isn't inside a quoted field, or None.
+    Escaped quotes are doubled in CSV, so an even number of quotes before a
+    newline means it ends a record.
+    """
+    position = data.rfind(b'\n')
+    while position != -1:
+        if data.count(b'"', 0, position) % 2 == 0:
+            return position + 1
+        position = data.rfind(b'\n', 0, position)
+    return None
+
+
+def find_chunks(path, start, chunk_bytes):
+    """
+    Yield (start, end) byte ranges of about chunk_bytes holding whole records.
+    """
+    with open(path, 'rb') as file:
+        file.seek(start)
+        pending = b''
+        while True:
+            block = file.read(chunk_bytes)
+            if not block:
+                if pending.strip():
+                    yield start, start + len(pending)
+                return
+            pending += block
+            cut = record_boundary(pending)
+            if cut:
+                yield start, start + cut
+                start += cut
+                pending = pending[cut:]
+
+
+def parse_chunk(path, start, end, fieldnames):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        text = file.read(end - start).decode('utf-8')
+    reader = csv.DictReader(io.StringIO(text, newline=''), fieldnames=fieldnames)
+    return [parse_record(row) for row in reader]
+
+
+def stream_records(path, start=None, chunk_bytes=1 << 20, workers=None):
+    """
+    Yield (end_offset, records) for consecutive chunks of the file, in file order.
+    end_offset is where a resumed import should start once the records are saved.
+    """
+    fieldnames, data_start = read_header(path)
+    if start is None:
+        start = data_start
+    chunks = find_chunks(path, start, chunk_bytes)
+
+    if workers == 1:
+        for chunk_start, chunk_end in chunks:
+            yield chunk_end, parse_chunk(path, chunk_start, chunk_end, fieldnames)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # At most two chunks per worker are parsed ahead of the writer
+        max_in_flight = 2 * workers
+        in_flight = deque()
+        for chunk_start, chunk_end in chunks:
+            in_flight.append((chunk_end, executor.submit(parse_chunk, path, chunk_start, chunk_end, fieldnames)))
+            if len(in_flight) >= max_in_flight:
+                chunk_end, future = in_flight.popleft()
+                yield chunk_end, future.result()
+        while in_flight:
+            chunk_end, future = in_flight.popleft()
+            yield chunk_end, future.result()
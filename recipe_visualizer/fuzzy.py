@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from rapidfuzz import fuzz, process
+from .models import Ingredient
+
+GRAM_SIZE = 3
+
+# Only the best candidates by shared n-grams are scored with rapidfuzz
+MAX_CANDIDATES = 50
+
+
+def ngrams(text):
+    padded = f' {text} '
+    return {padded[i:i + GRAM_SIZE] for i in range(len(padded) - GRAM_SIZE + 1)}
+
+
+class IngredientMatcher:
+    """
+    Typo tolerant lookup of Ingredient names.
+
+    An n-gram index narrows the vocabulary down to a few candidates per term,
+    only those are scored with rapidfuzz.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.names = {}
+        self.postings = {}
+        self.built_at = None
+
+    def build(self):
+        names = {}
+        postings = {}
+        for ingredient_id, name in Ingredient.objects.values_list('id', 'name').iterator(chunk_size=5000):
+            name = name.strip().lower()
+            names[ingredient_id] = name
+            for gram in ngrams(name):
+                postings.setdefault(gram, set()).add(ingredient_id)
+
+        with self.lock:
+            self.names = names
+            self.postings = postings
+            self.built_at = time.monotonic()
+
+    def add(self, ingredient_id, name):
+        self.remove(ingredient_id)
+        name = name.strip().lower()
+        with self.lock:
+            self.names[ingredient_id] = name
+            for gram in ngrams(name):
+                self.postings.setdefault(gram, set()).add(ingredient_id)
+
+    def remove(self, ingredient_id):
+        with self.lock:
+            name = self.names.pop(ingredient_id, None)
+            if name is None:
+                return
+            for gram in ngrams(name):
+                ingredient_ids = self.postings.get(gram)
+                if ingredient_ids is not None:
+                    ingredient_ids.discard(ingredient_id)
+                    if not ingredient_ids:
+                        del self.postings[gram]
+
+    def match(self, term, limit=5, score_cutoff=None):
+        """
+        Return (ingredient_id, name, score) of the ingredients closest to term, best first.
+        """
+        if score_cutoff is None:
+            score_cutoff = getattr(settings, 'FUZZY_MATCH_CUTOFF', 80)
+        term = term.strip().lower()
+        grams = ngrams(term)
+
+        with self.lock:
+            shared = Counter()
+            for gram in grams:
+                shared.update(self.postings.get(gram, ()))
+            # A name sharing less than a third of the grams can't reach the cutoff
+            minimum = max(1, len(grams) // 3)
+            candidates = [ingredient_id for ingredient_id, count in shared.most_common(MAX_CANDIDATES) if count >= minimum]
+            names = [self.names[ingredient_id] for ingredient_id in candidates]
+
+        matches = process.extract(term, names, scorer=fuzz.ratio, score_cutoff=score_cutoff, limit=limit)
+        return [(candidates[position], name, score) for name, score, position in matches]
+
+
+_matcher = IngredientMatcher()
+_build_lock = threading.Lock()
+
+
+def get_matcher():
+    """
+    The process-wide matcher, rebuilt like the ingredient index after INGREDIENT_INDEX_TTL seconds.
+    """
+    ttl = getattr(settings, 'INGREDIENT_INDEX_TTL', 300)
+    if _matcher.built_at is None or time.monotonic() - _matcher.built_at > ttl:
+        with _build_lock:
+            if _matcher.built_at is None or time.monotonic() - _matcher.built_at > ttl:
+                _matcher.build()
+    return _matcher
+
+
+def ingredient_saved(ingredient):
+    if _matcher.built_at is not None:
+        _matcher.add(ingredient.pk, ingredient.name)
+
+
+def ingredient_deleted(ingredient):
+    if _matcher.built_at is not None:
+        _matcher.remove(ingredient.pk)
@@ -0,0 +1,243 @@
+import logging
+import os
+import queue
+import threading
+from PIL import Image as PILImage, ImageOps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from .models import Recipe
+from . import recipe_cache
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = 'variants'
+
+
+def get_widths():
+    return tuple(getattr(settings, 'IMAGE_VARIANT_WIDTHS', (160, 320, 640)))
+
+
+def storage_name(name):
+    # Recipes imported on Windows were saved as recipe_images\\x-min.png
+    return name.replace('\\', '/')
+
+
+def variants_dir(name):
+    # uploads/recipe_images/a.png -> variants/recipe_images/a/
+    return f'{VARIANTS_DIR}/{os.path.splitext(storage_name(name))[0]}'
+
+
+def render_variants(source_path, target_dir, widths, quality=80):
+    """
+    Write a WebP and a JPEG (PNG if the image has transparency) copy of the image
+    for every width narrower than it, plus a full width WebP. Returns
+    {width: {format: file name}}. Doesn't touch Django, so it runs in worker processes.
+    """
+    with PILImage.open(source_path) as original:
+        original = ImageOps.exif_transpose(original)
+        has_alpha = original.mode in ('RGBA', 'LA') or 'transparency' in original.info
+        original = original.convert('RGBA' if has_alpha else 'RGB')
+        fallback = 'png' if has_alpha else 'jpg'
+
+        os.makedirs(target_dir, exist_ok=True)
+        variants = {}
+        for width in sorted({w for w in widths if w < original.width} | {original.width}):
+            height = max(1, round(original.height * width / original.width))
+            image = original if width == original.width else original.resize((width, height), PILImage.LANCZOS)
+            formats = ('webp',) if width == original.width else ('webp', fallback)
+            for extension in formats:
+                file_name = f'{width}.{extension}'
+                if extension == 'webp':
+                    image.save(os.path.join(target_dir, file_name), 'WEBP', quality=quality, method=4)
+                elif extension == 'jpg':
+                    image.save(os.path.join(target_dir, file_name), 'JPEG', quality=quality, optimize=True, progressive=True)
+                else:
+                    image.save(os.path.join(target_dir, file_name), 'PNG', optimize=True)
+                variants.setdefault(width, {})[extension] = file_name
+        return variants
+
+
+def render_job(job):
+    """
+    render_variants for a process pool, (name, source path, target dir, widths, quality) -> (name, variants or None).
+    """
+    name, source_path, target_dir, widths, quality = job
+    try:
+        return name, render_variants(source_path, target_dir, widths, quality)
+    except (OSError, PILImage.DecompressionBombError):
+        return name, None
+
+
+def _cache_key(name):
+    return f'image-variants:{name}'
+
+
+def generate(name, force=False):
+    """
+    Render the variants of a stored image unless they exist, and remember them.
+    """
+    if not name:
+        return {}
+    if not force:
+        variants = get_variants(name)
+        if variants:
+            return variants
+    name, files = render_job(make_job(name))
+    if files is None:
+        # Missing or unreadable files keep serving the original only
+        return {}
+    return remember(name, files)
+
+
+def make_job(name):
+    return (
+        name,
+        default_storage.path(storage_name(name)),
+        default_storage.path(variants_dir(name)),
+        get_widths(),
+        getattr(settings, 'IMAGE_VARIANT_QUALITY', 80),
+    )
+
+
+def remember(name, files):
+    """
+    Cache the variants render_variants wrote for a stored image.
+    """
+    variants = {
+        width: {extension: f'{variants_dir(name)}/{file_name}' for extension, file_name in formats.items()}
+        for width, formats in files.items()
+    }
+    cache.set(_cache_key(name), variants, timeout=None)
+    return variants
+
+
+def recipes_using(names):
+    """
+    Ids of the recipes whose details show one of the images, as the recipe's,
+    a step's or the author's.
+    """
+    recipe_ids = set()
+    names = list(names)
+    for start in range(0, len(names), 500):
+        batch = names[start:start + 500]
+        recipe_ids.update(Recipe.objects.filter(
+            Q(recipe_image__in=batch) | Q(steps__step_images__image__image_path__in=batch) | Q(user__image_path__in=batch)
+        ).order_by().values_list('pk', flat=True).distinct())
+    return recipe_ids
+
+
+def generate_and_refresh(name):
+    generate(name)
+    # The details cached since the upload have no variants, they are made again
+    # once the files exist
+    recipe_cache.bump_versions(recipes_using([name]))
+
+
+class Renderer:
+    """
+    Renders the variants of new uploads on a background thread, one at a time,
+    so the request that saved them doesn't wait on Pillow.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def submit(self, name):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='image-variants', daemon=True)
+                self.thread.start()
+        self.queue.put(name)
+
+    def _run(self):
+        try:
+            while True:
+                name = self.queue.get()
+                try:
+                    generate_and_refresh(name)
+                except Exception:
+                    # A broken upload or a database error mustn't stop the renders queued after it
+                    logger.exception('Could not render the variants of %s', name)
+                finally:
+                    # This thread has its own connection, don't keep it past CONN_MAX_AGE
+                    close_old_connections()
+        finally:
+            # The next submit() starts another thread for what is left in the queue
+            with self.lock:
+                self.thread = None
+
+
+renderer = Renderer()
+
+
+def generate_on_commit(name):
+    """
+    Render the variants of a new upload once the transaction that saved it commits,
+    in the background unless IMAGE_VARIANT_BACKGROUND is off.
+    """
+    if not name:
+        return
+    if getattr(settings, 'IMAGE_VARIANT_BACKGROUND', True):
+        transaction.on_commit(lambda: renderer.submit(name))
+    else:
+        transaction.on_commit(lambda: generate_and_refresh(name))
+
+
+def get_variants(name):
+    """
+    {width: {format: name}} of the rendered variants of a stored image, read from
+    the variants directory the first time and cached.
+    """
+    variants = cache.get(_cache_key(name))
+    if variants is not None:
+        return variants
+    try:
+        directories, files = default_storage.listdir(variants_dir(name))
+    except FileNotFoundError:
+        files = []
+    variants = {}
+    for file_name in files:
+        width, extension = os.path.splitext(file_name)
+        if width.isdigit():
+            variants.setdefault(int(width), {})[extension.lstrip('.')] = f'{variants_dir(name)}/{file_name}'
+    # Images without variants are looked at again later, the backfill may run in another process
+    cache.set(_cache_key(name), variants, timeout=None if variants else 300)
+    return variants
+
+
+def delete_variants(name):
+    if not name:
+        return
+    for formats in get_variants(name).values():
+        for variant_name in formats.values():
+            default_storage.delete(variant_name)
+    cache.delete(_cache_key(name))
+
+
+def delete_image(field_file):
+    """
+    Delete an image file and its variants. A shared content addressed blob stays,
+    collect_blobs deletes its variants once nothing uses it.
+    """
+    name = field_file.name
+    field_file.delete(save=False)
+    if not default_storage.exists(storage_name(name)):
+        delete_variants(name)
+
+
+def variant_urls(field_file, request):
+    """
+    Absolute URLs of the variants of an image field, {"320": {"webp": url, "jpg": url}, ...}.
+    """
+    if not field_file:
+        return {}
+    build_url = request.build_absolute_uri if request is not None else (lambda url: url)
+    return {
+        str(width): {extension: build_url(default_storage.url(name)) for extension, name in formats.items()}
+        for width, formats in sorted(get_variants(field_file.name).items())
+    }
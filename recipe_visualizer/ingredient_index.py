@@ -0,0 +1,172 @@
+import threading
+import time
+from collections import defaultdict
+from functools import reduce
+from django.conf import settings
+from django.db.models import Q
+from .ingredient_names import canonical_name
+from .models import Ingredient, RecipeIngredient
+from . import fuzzy
+
+
+class IngredientIndex:
+    """
+    In-memory recipe <-> ingredient index built from RecipeIngredient.
+
+    Each ingredient id maps to the set of recipe ids using it, so "recipes with all of X"
+    is a set intersection and coverage ranking never touches the database.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.recipes_by_ingredient = {}
+        self.ingredients_by_recipe = {}
+        self.built_at = None
+
+    def build(self):
+        recipes_by_ingredient = defaultdict(set)
+        ingredients_by_recipe = defaultdict(set)
+        rows = RecipeIngredient.objects.values_list('recipe_id', 'ingredient_id')
+        for recipe_id, ingredient_id in rows.iterator(chunk_size=5000):
+            recipes_by_ingredient[ingredient_id].add(recipe_id)
+            ingredients_by_recipe[recipe_id].add(ingredient_id)
+
+        with self.lock:
+            self.recipes_by_ingredient = dict(recipes_by_ingredient)
+            self.ingredients_by_recipe = dict(ingredients_by_recipe)
+            self.built_at = time.monotonic()
+
+    def update_recipes(self, recipe_ids):
+        """
+        Reload the ingredients of the given recipes, recipes without any are dropped.
+        """
+        recipe_ids = set(recipe_ids)
+        ingredients_by_recipe = defaultdict(set)
+        rows = RecipeIngredient.objects.filter(recipe_id__in=recipe_ids).values_list('recipe_id', 'ingredient_id')
+        for recipe_id, ingredient_id in rows:
+            ingredients_by_recipe[recipe_id].add(ingredient_id)
+
+        with self.lock:
+            for recipe_id in recipe_ids:
+                for ingredient_id in self.ingredients_by_recipe.pop(recipe_id, ()):
+                    recipes = self.recipes_by_ingredient.get(ingredient_id)
+                    if recipes is not None:
+                        recipes.discard(recipe_id)
+                        if not recipes:
+                            del self.recipes_by_ingredient[ingredient_id]
+            for recipe_id, ingredient_ids in ingredients_by_recipe.items():
+                self.ingredients_by_recipe[recipe_id] = ingredient_ids
+                for ingredient_id in ingredient_ids:
+                    self.recipes_by_ingredient.setdefault(ingredient_id, set()).add(recipe_id)
+
+    def _recipes_for(self, ingredient_ids):
+        return reduce(set.union, (self.recipes_by_ingredient.get(i, set()) for i in ingredient_ids), set())
+
+    def recipes_with_all(self, groups):
+        """
+        Ids of the recipes using at least one ingredient of every group.
+        """
+        if not groups:
+            return set()
+        with self.lock:
+            matches = sorted((self._recipes_for(group) for group in groups), key=len)
+        result = matches[0]
+        for recipes in matches[1:]:
+            result &= recipes
+            if not result:
+                break
+        return result
+
+    def rank_by_coverage(self, groups):
+        """
+        Rank the recipes using any of the groups by the fraction of groups they cover,
+        then by the number of their ingredients missing from the groups.
+        Returns (recipe_id, covered, missing) tuples, best match first.
+        """
+        wanted = set().union(*groups)
+        covered = defaultdict(int)
+        with self.lock:
+            for group in groups:
+                for recipe_id in self._recipes_for(group):
+                    covered[recipe_id] += 1
+            ranking = [
+                (recipe_id, count, len(self.ingredients_by_recipe.get(recipe_id, ()) - wanted))
+                for recipe_id, count in covered.items()
+            ]
+        ranking.sort(key=lambda item: (-item[1], item[2], -item[0]))
+        return ranking
+
+
+_index = IngredientIndex()
+_build_lock = threading.Lock()
+
+
+def get_index():
+    """
+    The process-wide index, (re)built on first use and once it is older than
+    INGREDIENT_INDEX_TTL seconds, so writes made by other processes show up eventually.
+    """
+    ttl = getattr(settings, 'INGREDIENT_INDEX_TTL', 300)
+    if _index.built_at is None or time.monotonic() - _index.built_at > ttl:
+        with _build_lock:
+            if _index.built_at is None or time.monotonic() - _index.built_at > ttl:
+                _index.build()
+    return _index
+
+
+def recipes_changed(recipe_ids):
+    # An index that was never built will load the changes when it is
+    if _index.built_at is not None:
+        _index.update_recipes(recipe_ids)
+
+
+def resolve_ingredients(names):
+    """
+    Map each searched name to the ids of the ingredients whose name or description contains it
+    or that it is an alias of, plus the ingredients whose name is a close fuzzy match, so typos
+    still find something.
+    """
+    # Searched like they are stored, 'Eggs' finds 'egg'
+    names = [canonical_name(name) for name in names if name.strip()]
+    if not names:
+        return []
+    # Aliases in the same query, an ingredient comes back once per alias
+    query = Q(aliases__alias__in=names)
+    for name in names:
+        query |= Q(name__icontains=name) | Q(description__icontains=name)
+
+    groups = [set() for name in names]
+    rows = Ingredient.objects.filter(query).values_list('id', 'name', 'description', 'aliases__alias')
+    for ingredient_id, ingredient_name, description, alias in rows:
+        text = f'{ingredient_name} {description or ""}'.lower()
+        for group, name in zip(groups, names):
+            if name in text or name == alias:
+                group.add(ingredient_id)
+
+    matcher = fuzzy.get_matcher()
+    for group, name in zip(groups, names):
+        group.update(ingredient_id for ingredient_id, match, score in matcher.match(name))
+    return groups
+
+
+def resolve_exact(names):
+    """
+    Map each name to the ids of the ingredients it is the name or an alias of, like
+    resolve_ingredients but without substrings, so 'salt' isn't 'unsalted butter'.
+    Only a name matching nothing falls back to the close fuzzy matches.
+    """
+    names = [canonical_name(name) for name in names if name.strip()]
+    if not names:
+        return []
+    groups = {name: set() for name in names}
+    rows = Ingredient.objects.filter(Q(name__in=names) | Q(aliases__alias__in=names)).values_list('id', 'name', 'aliases__alias')
+    for ingredient_id, ingredient_name, alias in rows:
+        for name in (ingredient_name, alias):
+            if name in groups:
+                groups[name].add(ingredient_id)
+
+    matcher = fuzzy.get_matcher()
+    for name, group in groups.items():
+        if not group:
+            group.update(ingredient_id for ingredient_id, match, score in matcher.match(name))
+    return [groups[name] for name in names]
@@ -0,0 +1,94 @@
+import re
+from functools import lru_cache
+
+# Words about the state or the size of an ingredient rather than what it is.
+# 'ground', 'dried' or 'smoked' change the ingredient and are kept.
+QUALIFIERS = frozenset([
+    'large', 'small', 'medium', 'ripe', 'fresh', 'freshly', 'frozen', 'optional',
+    'chopped', 'diced', 'minced', 'sliced', 'grated', 'shredded', 'peeled', 'crushed',
+    'softened', 'melted', 'beaten', 'finely', 'roughly', 'thinly', 'coarsely',
+])
+
+# Leading amounts, 'a pinch of salt' is salt
+AMOUNT = re.compile(r"^(?:an? )?(?:pinch|dash|drizzle|handful|splash|sprinkle) of ")
+
+WORD = re.compile(r"[a-z0-9]+(?:['-][a-z0-9]+)*")
+
+# Plurals the suffix rules get wrong, and words that only look plural
+IRREGULAR = {
+    'leaves': 'leaf',
+    'halves': 'half',
+    'loaves': 'loaf',
+    'chilies': 'chili',
+    'chillies': 'chili',
+    'chilis': 'chili',
+    'chillis': 'chili',
+    'cookies': 'cookie',
+    'brownies': 'brownie',
+    'smoothies': 'smoothie',
+}
+UNCOUNTABLE = frozenset([
+    'molasses', 'hummus', 'couscous', 'asparagus', 'swiss', 'brussels', 'oats', 'grits',
+    'greens', 'bitters', 'schnapps',
+])
+
+# Misspellings and regional names seen in the data, applied to single words,
+# then to whole canonical names
+WORD_ALIASES = {
+    'bakin': 'baking',
+    'choclate': 'chocolate',
+    'chilli': 'chili',
+    'coca': 'cocoa',
+    'mayonaise': 'mayonnaise',
+    'mozarella': 'mozzarella',
+    'mozzerela': 'mozzarella',
+    'mozzerella': 'mozzarella',
+    'tomatoe': 'tomato',
+    'worshershire': 'worcestershire',
+    'zuchinni': 'zucchini',
+    'aubergine': 'eggplant',
+    'courgette': 'zucchini',
+}
+ALIASES = {
+    'icing sugar': 'powdered sugar',
+    "confectioners' sugar": 'powdered sugar',
+    'confectioners sugar': 'powdered sugar',
+    'scallion': 'green onion',
+    'spring onion': 'green onion',
+    'garbanzo bean': 'chickpea',
+    'plan yogurt': 'plain yogurt',
+    'veg oil': 'vegetable oil',
+}
+
+
+def singular(word):
+    if word in IRREGULAR:
+        return IRREGULAR[word]
+    if word in UNCOUNTABLE or len(word) <= 3 or not word.endswith('s'):
+        return word
+    if word.endswith('ies'):
+        return word[:-3] + 'y'
+    if word.endswith(('oes', 'ches', 'shes', 'sses', 'xes', 'zes')):
+        return word[:-2]
+    if word.endswith(('ss', 'us', 'is')):
+        return word
+    return word[:-1]
+
+
+@lru_cache(maxsize=10000)
+def canonical_name(name):
+    """
+    The form Ingredient names are stored and looked up under: lowercase, without
+    qualifiers, notes in parentheses or after a comma, the last word singular and
+    known misspellings fixed. 'Large EGGS (room temperature)' is 'egg'.
+    """
+    text = re.sub(r'\([^)]*\)', ' ', name.lower()).split(',')[0].strip()
+    text = AMOUNT.sub('', text)
+    words = WORD.findall(text)
+    # A name made only of qualifiers is kept, 'fresh' alone is still something
+    words = [word for word in words if word not in QUALIFIERS] or words
+    if not words:
+        return ' '.join(name.lower().split())
+    words[-1] = singular(words[-1])
+    name = ' '.join(WORD_ALIASES.get(word, word) for word in words)
+    return ALIASES.get(name, name)
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Run in a fresh interpreter, so nothing is imported or cached yet. Prints the timings on its last line.
+COLD_START = '''
+import json, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+setup_done = time.perf_counter()
+import recipe_visualizer.views
+import_done = time.perf_counter()
+
+from django.test import RequestFactory
+view = recipe_visualizer.views.SearchByDescriptionView.as_view()
+
+def search():
+    request = RequestFactory().post('/recipes/search_by_description/', {'description': sys.argv[1]}, content_type='application/json')
+    started = time.perf_counter()
+    view(request).render()
+    return time.perf_counter() - started
+
+first = search()
+second = search()
+print(json.dumps({
+    'django.setup()': setup_done - started,
+    'import views': import_done - setup_done,
+    'first search': first,
+    'second search': second,
+}))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Time a cold start: django.setup(), importing the views and the first search request'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Cold starts to time')
+        parser.add_argument('--query', default='chocolate cake', help='Description searched for')
+
+    def handle(self, *args, **options):
+        env = {**os.environ, 'PYTHONPATH': os.pathsep.join(path for path in sys.path if path)}
+        timings = {}
+        for run in range(options['runs']):
+            result = subprocess.run(
+                [sys.executable, '-c', COLD_START, options['query']],
+                env=env, capture_output=True, text=True,
+            )
+            if result.returncode:
+                raise CommandError(result.stderr.strip())
+            for phase, seconds in json.loads(result.stdout.strip().splitlines()[-1]).items():
+                timings.setdefault(phase, []).append(seconds * 1000)
+
+        for phase, values in timings.items():
+            self.stdout.write(f'{phase:<16} median {statistics.median(values):8.1f} ms   min {min(values):8.1f} ms')
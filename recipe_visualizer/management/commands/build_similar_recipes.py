@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from recipe_visualizer import similar
+
+
+class Command(BaseCommand):
+    help = 'Store the most similar recipes of the recipes added since the last run, or of every recipe with --full'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild every list, e.g. after recipes were edited')
+        parser.add_argument('--neighbours', type=int, help='Similar recipes kept per recipe, defaults to SIMILAR_RECIPES["NEIGHBOURS"]')
+        parser.add_argument('--block-size', type=int, help='Recipes scored per matrix product')
+
+    def handle(self, *args, **options):
+        count = similar.build(full=options['full'], k=options['neighbours'], block_size=options['block_size'])
+        self.stdout.write(self.style.SUCCESS(f'Built the similar recipes of {count} recipes.'))
@@ -0,0 +1,91 @@
+from collections import Counter, defaultdict
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from recipe_visualizer.models import Image, Recipe, StoredBlob
+from recipe_visualizer.storage import BLOBS_DIR
+from recipe_visualizer import images
+
+
+class Command(BaseCommand):
+    help = 'Recount the references to the stored media blobs and delete the unused ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=int, default=24, help='Keep unused blobs younger than this, their upload may not be committed yet')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted')
+
+    def handle(self, *args, **options):
+        # Deleted rows and replaced uploads don't release their blob, so the counts are rebuilt from the file fields
+        references = Counter()
+        for model, field in ((Recipe, 'recipe_image'), (Image, 'image_path'), (get_user_model(), 'image_path')):
+            rows = model.objects.filter(**{f'{field}__startswith': f'{BLOBS_DIR}/'}).values(field).annotate(count=Count('pk')).order_by()
+            references.update({row[field]: row['count'] for row in rows})
+
+        cutoff = timezone.now() - timedelta(hours=options['grace_hours'])
+        # Corrections by how much they change the count, applied with F() so the
+        # references uploads add meanwhile are kept
+        corrections = defaultdict(list)
+        unused = []
+        stored = set()
+        for blob in StoredBlob.objects.iterator(chunk_size=2000):
+            stored.add(blob.name)
+            if blob.refcount != references[blob.name]:
+                corrections[references[blob.name] - blob.refcount].append(blob.pk)
+            if not references[blob.name] and blob.created_at < cutoff:
+                unused.append(blob)
+        self.stdout.write(f'{sum(len(pks) for pks in corrections.values())} blobs had a wrong reference count.')
+
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        if not options['dry_run']:
+            for difference, pks in corrections.items():
+                for start in range(0, len(pks), 1000):
+                    StoredBlob.objects.filter(pk__in=pks[start:start + 1000]).update(refcount=F('refcount') + difference)
+            unused = [blob for blob in unused if self.delete_unused(blob)]
+        freed = sum(blob.size for blob in unused)
+        self.stdout.write(self.style.SUCCESS(f'{verb} {len(unused)} unused blobs, {freed / 1024 / 1024:.1f} MiB.'))
+
+        # Files whose upload was rolled back after placing them have no row at all
+        orphans = [name for name in self.blob_files() if name not in stored and default_storage.get_modified_time(name) < cutoff]
+        if not options['dry_run']:
+            orphans = [name for name in orphans if self.delete_orphan(name)]
+        self.stdout.write(self.style.SUCCESS(f'{verb} {len(orphans)} blob files without a row.'))
+
+    @staticmethod
+    def blob_files():
+        directories, files = default_storage.listdir(BLOBS_DIR) if default_storage.exists(BLOBS_DIR) else ([], [])
+        for directory in directories:
+            # Uploads still being written
+            if directory == 'tmp':
+                continue
+            for name in default_storage.listdir(f'{BLOBS_DIR}/{directory}')[1]:
+                yield f'{BLOBS_DIR}/{directory}/{name}'
+
+    @staticmethod
+    def delete_unused(blob):
+        """
+        Delete the row and the files of a blob, unless it was uploaded again since it was counted.
+        """
+        with transaction.atomic():
+            # A conditional DELETE, select_for_update() doesn't lock anything on SQLite. The deleted
+            # row stays locked until the file is gone, an upload of the same bytes waits for
+            # it, creates the row again and puts the file back.
+            deleted, counts = StoredBlob.objects.filter(pk=blob.pk, refcount=0).delete()
+            if not deleted:
+                return False
+            images.delete_variants(blob.name)
+            # The storage's delete() only drops a reference, the file goes here
+            default_storage.delete_blob(blob.name)
+        return True
+
+    @staticmethod
+    def delete_orphan(name):
+        # Uploaded again since it was listed, the upload owns the file now
+        if StoredBlob.objects.filter(name=name).exists():
+            return False
+        images.delete_variants(name)
+        default_storage.delete_blob(name)
+        return True
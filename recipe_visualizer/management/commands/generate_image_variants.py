@@ -0,0 +1,43 @@
+from concurrent.futures import ProcessPoolExecutor
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from recipe_visualizer.models import Image, Recipe
+from recipe_visualizer import images, recipe_cache
+import os
+
+
+class Command(BaseCommand):
+    help = 'Render the resized WebP/JPEG variants of every stored recipe, step and user image'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help='Render processes, defaults to the number of CPUs')
+        parser.add_argument('--force', action='store_true', help='Render images that already have variants again')
+
+    def handle(self, *args, **options):
+        names = set()
+        for model, field in ((Recipe, 'recipe_image'), (Image, 'image_path'), (get_user_model(), 'image_path')):
+            names.update(model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True}).values_list(field, flat=True).distinct())
+        if not options['force']:
+            names = {name for name in names if not images.get_variants(name)}
+        self.stdout.write(f'{len(names)} images to render.')
+
+        rendered = failed = 0
+        done = []
+        workers = options['workers'] or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            jobs = (images.make_job(name) for name in sorted(names))
+            for name, files in executor.map(images.render_job, jobs, chunksize=16):
+                if files is None:
+                    failed += 1
+                    continue
+                images.remember(name, files)
+                done.append(name)
+                rendered += 1
+                if rendered % 500 == 0:
+                    self.stdout.write(f'{rendered} images rendered')
+
+        # The cached details of these recipes were made without the variants
+        recipe_cache.bump_versions(images.recipes_using(done))
+        if failed:
+            self.stdout.write(self.style.WARNING(f'{failed} images are missing or unreadable.'))
+        self.stdout.write(self.style.SUCCESS(f'Rendered the variants of {rendered} images.'))
@@ -0,0 +1,142 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, Count, Value, When
+from recipe_visualizer.ingredient_names import canonical_name
+from recipe_visualizer.models import Ingredient, IngredientAlias, IngredientCategory, RecipeIngredient
+from recipe_visualizer.recipe_writes import join_quantities
+from recipe_visualizer.signals import ingredients_created, recipe_changed
+
+
+class Command(BaseCommand):
+    help = 'Merge the ingredients whose names have the same canonical form, or an alias, into one named after it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Print the merges without writing them')
+        parser.add_argument('--batch-size', type=int, default=500, help='Merged ingredients rewritten per UPDATE')
+
+    def handle(self, *args, **options):
+        targets, renames = self.plan()
+        if options['dry_run']:
+            names = dict(Ingredient.objects.filter(pk__in=[*targets, *targets.values()]).values_list('pk', 'name'))
+            for source, target in sorted(targets.items(), key=lambda item: (item[1], item[0])):
+                self.stdout.write(f'{names[source]} -> {renames.get(target, names[target])}')
+            self.stdout.write(f'{len(targets)} ingredients would be merged, {len(renames)} renamed.')
+            return
+
+        with transaction.atomic():
+            recipes, collapsed = self.merge(targets, renames, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(targets)} ingredients merged, {len(renames)} renamed, {recipes} recipes updated, '
+            f'{collapsed} duplicate rows collapsed.'
+        ))
+
+    @staticmethod
+    def plan():
+        """
+        {merged ingredient id: id of the ingredient it is merged into} and
+        {kept ingredient id: its canonical name} for the whole table.
+        """
+        aliases = dict(IngredientAlias.objects.values_list('alias', 'ingredient_id'))
+        groups = defaultdict(list)
+        for pk, name in Ingredient.objects.order_by('pk').values_list('pk', 'name').iterator(chunk_size=5000):
+            groups[canonical_name(name)].append((pk, name))
+
+        targets = {}
+        renames = {}
+        for key, members in groups.items():
+            # An alias wins, then an ingredient already named right, then the oldest
+            target = aliases.get(key) or next((pk for pk, name in members if name == key), members[0][0])
+            for pk, name in members:
+                if pk != target:
+                    targets[pk] = target
+                elif name != key and key not in aliases:
+                    renames[pk] = key
+
+        # An alias can point at an ingredient that is merged itself, follow the chain
+        for pk in list(targets):
+            seen = {pk}
+            target = targets[pk]
+            while target in targets and target not in seen:
+                seen.add(target)
+                target = targets[target]
+            targets[pk] = target
+        targets = {pk: target for pk, target in targets.items() if pk != target}
+        renames = {pk: name for pk, name in renames.items() if pk not in targets}
+        return targets, renames
+
+    @classmethod
+    def merge(cls, targets, renames, batch_size):
+        """
+        Point the rows of the merged ingredients at the kept ones, one UPDATE per
+        table and batch, then delete them and the rows that became duplicates.
+        Returns the number of recipes changed and of duplicate rows removed.
+        """
+        ingredients = Ingredient.objects.in_bulk(list(renames))
+        for pk, name in renames.items():
+            ingredients[pk].name = name
+        Ingredient.objects.bulk_update(ingredients.values(), ['name'], batch_size=batch_size)
+        # bulk_update doesn't send post_save either, the fuzzy matcher needs the new names
+        ingredients_created(list(ingredients.values()))
+
+        sources = list(targets)
+        recipe_ids = set()
+        for start in range(0, len(sources), batch_size):
+            batch = sources[start:start + batch_size]
+            recipe_ids.update(RecipeIngredient.objects.filter(ingredient_id__in=batch).values_list('recipe_id', flat=True))
+            target = Case(*[When(ingredient_id=pk, then=Value(targets[pk])) for pk in batch])
+            for model in (RecipeIngredient, IngredientCategory, IngredientAlias):
+                model.objects.filter(ingredient_id__in=batch).update(ingredient_id=target)
+            Ingredient.objects.filter(pk__in=batch).delete()
+
+        collapsed = cls.collapse_recipe_ingredients(list(recipe_ids), batch_size)
+        collapsed += cls.collapse_categories(set(targets.values()))
+        for recipe_id in recipe_ids:
+            recipe_changed(recipe_id)
+        return len(recipe_ids), collapsed
+
+    @staticmethod
+    def collapse_recipe_ingredients(recipe_ids, batch_size):
+        # A recipe listing two of the merged ingredients now lists the kept one twice,
+        # keep its first row with both quantities
+        removed = 0
+        for start in range(0, len(recipe_ids), batch_size):
+            batch = recipe_ids[start:start + batch_size]
+            duplicates = set(
+                RecipeIngredient.objects.filter(recipe_id__in=batch).values('recipe_id', 'ingredient_id')
+                .annotate(rows=Count('pk')).filter(rows__gt=1).values_list('recipe_id', 'ingredient_id')
+            )
+            if not duplicates:
+                continue
+            groups = defaultdict(list)
+            rows = RecipeIngredient.objects.filter(
+                recipe_id__in={recipe_id for recipe_id, ingredient_id in duplicates},
+                ingredient_id__in={ingredient_id for recipe_id, ingredient_id in duplicates},
+            ).order_by('pk')
+            for row in rows:
+                if (row.recipe_id, row.ingredient_id) in duplicates:
+                    groups[row.recipe_id, row.ingredient_id].append(row)
+            kept = []
+            extra = []
+            for group in groups.values():
+                [(ingredient_id, quantity)] = join_quantities((row.ingredient_id, row.quantity) for row in group)
+                group[0].quantity = quantity
+                kept.append(group[0])
+                extra.extend(row.pk for row in group[1:])
+            RecipeIngredient.objects.bulk_update(kept, ['quantity'], batch_size=batch_size)
+            removed += RecipeIngredient.objects.filter(pk__in=extra).delete()[0]
+        return removed
+
+    @staticmethod
+    def collapse_categories(ingredient_ids):
+        # Only the kept ingredients can have a category twice
+        seen = set()
+        extra = []
+        rows = IngredientCategory.objects.filter(ingredient_id__in=ingredient_ids).order_by('pk')
+        for pk, ingredient_id, category_id in rows.values_list('pk', 'ingredient_id', 'category_id'):
+            if (ingredient_id, category_id) in seen:
+                extra.append(pk)
+            seen.add((ingredient_id, category_id))
+        if not extra:
+            return 0
+        return IngredientCategory.objects.filter(pk__in=extra).delete()[0]
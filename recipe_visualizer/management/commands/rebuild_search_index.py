@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from recipe_visualizer import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the recipe search index'
+
+    def handle(self, *args, **options):
+        count = search.get_backend().rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} recipes.'))
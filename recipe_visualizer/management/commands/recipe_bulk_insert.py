@@ -1,74 +1,122 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth import get_user_model
-from recipe_visualizer.models import Recipe, Ingredient, RecipeIngredient, Tag, RecipeTag, RecipeStep
-import csv
+from django.db import transaction
+from recipe_visualizer.models import ImportCheckpoint, Recipe, Ingredient, IngredientAlias, RecipeIngredient, Tag, RecipeTag, RecipeStep
+from recipe_visualizer.search import get_backend
+from recipe_visualizer.signals import recipe_changed
+from recipe_visualizer.ingredient_names import canonical_name
+from recipe_visualizer.recipe_writes import join_quantities
+from recipe_visualizer import dataset, points
 import os
-import ast
+import time
+
 
 class Command(BaseCommand):
     help = 'Import data from CSV file'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default='final_dataset.csv', help='CSV file to import')
+        parser.add_argument('--user', default='scrapper_bot', help='Username the recipes are added by')
+        parser.add_argument('--chunk-bytes', type=int, default=1 << 20, help='Bytes of CSV parsed and imported per transaction')
+        parser.add_argument('--workers', type=int, help='Parser processes, defaults to the number of CPUs')
+        parser.add_argument('--resume', action='store_true', help='Skip the rows imported by a previous run')
+
     def handle(self, *args, **options):
         # Define the path to your CSV file
-        csv_file = 'final_dataset.csv'
+        csv_file = options['file']
 
         # Assuming your images are located in a folder named 'rimg'
         image_folder = 'recipe_images'
 
-        # Create a function to get or create an Ingredient instance
-        def get_or_create_ingredient(name):
-            ingredient, created = Ingredient.objects.get_or_create(name=name)
-            return ingredient
-
-        # Create a function to get or create a Tag instance
-        def get_or_create_tag(name):
-            tag_instance, created = Tag.objects.get_or_create(name=name)
-            return tag_instance
-
-        # Open and read the CSV file
-        with open(csv_file, 'r', newline='') as file:
-            csv_reader = csv.DictReader(file)
-            admin_user = get_user_model().objects.get(username='scrapper_bot')
-            for row in csv_reader:
-                # Create a Recipe instance
-                recipe = Recipe.objects.create(
+        try:
+            admin_user = get_user_model().objects.get(username=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"User '{options['user']}' does not exist.")
+
+        path = os.path.abspath(csv_file)
+        skip_rows = 0
+        offset = None
+        if options['resume']:
+            checkpoint = ImportCheckpoint.objects.filter(path=path).first()
+            if checkpoint is not None:
+                skip_rows = checkpoint.rows
+                offset = checkpoint.offset
+                self.stdout.write(f'Resuming after row {skip_rows}.')
+
+        # Load the vocabularies once instead of a get_or_create per name
+        # Ingredients by canonical name, the oldest of duplicates and then the aliases win
+        self.ingredient_ids = dict(Ingredient.objects.order_by('-pk').values_list('name', 'id'))
+        self.ingredient_ids.update(IngredientAlias.objects.values_list('alias', 'ingredient_id'))
+        self.tag_ids = dict(Tag.objects.values_list('name', 'id'))
+
+        started = time.monotonic()
+        imported = 0
+        # Worker processes parse the CSV while this one writes the previous chunks
+        records = dataset.stream_records(csv_file, start=offset, chunk_bytes=options['chunk_bytes'], workers=options['workers'])
+        for offset, rows in records:
+            # The position is saved with the rows, a crash can't leave one without the other
+            with transaction.atomic():
+                if rows:
+                    self.import_chunk(rows, admin_user, image_folder)
+                ImportCheckpoint.objects.update_or_create(
+                    path=path, defaults={'offset': offset, 'rows': skip_rows + imported + len(rows)},
+                )
+            imported += len(rows)
+
+            elapsed = time.monotonic() - started
+            self.stdout.write(f'{skip_rows + imported} rows imported, {imported / elapsed:.0f} rows/sec')
+
+        # bulk_create skips the signals that keep the points current
+        points.refresh_users([admin_user.pk])
+        ImportCheckpoint.objects.filter(path=path).delete()
+        self.stdout.write(self.style.SUCCESS('Data import completed.'))
+
+    def import_chunk(self, rows, admin_user, image_folder):
+        recipe_ids = []
+        with transaction.atomic(), get_backend().paused(recipe_ids):
+            self.create_missing(Ingredient, self.ingredient_ids, (canonical_name(name) for row in rows for name in row['ingredients']))
+            self.create_missing(Tag, self.tag_ids, (name for row in rows for name in row['tags']))
+
+            # Create the Recipe instances, SQLite and PostgreSQL return their ids
+            recipes = Recipe.objects.bulk_create([
+                Recipe(
                     title=row['title'],
                     description=row['description'],
                     making_time=row['minutes']+"minutes",
-                    recipe_image=os.path.join(image_folder, f"{row['image_path']}-min.png"),
+                    recipe_image=f"{image_folder}/{row['image_path']}-min.png",
                     user=admin_user
                 )
-                
-                # Create Ingredients and RecipeIngredients
-                ingredients = ast.literal_eval(row['ingredients'])
-                quantities = ast.literal_eval(row['quantities'])
-                
-                for ingredient_name, quantity in zip(ingredients, quantities):
-                    ingredient = get_or_create_ingredient(ingredient_name)
-                    RecipeIngredient.objects.create(
-                        recipe=recipe,
-                        ingredient=ingredient,
-                        quantity=quantity
-                    )
-                
-                # Create Tags and RecipeTags
-                tags = ast.literal_eval(row['tags'])
-                
-                for tag_name in tags:
-                    tag_instance = get_or_create_tag(tag_name)
-                    RecipeTag.objects.create( 
-                        recipe=recipe,
-                        tag=tag_instance
-                    )
-                
-                # Create Recipe Steps
-                steps = ast.literal_eval(row['steps'])
-                
-                for step_number, description in enumerate(steps, start=1):
-                    RecipeStep.objects.create(
-                        recipe=recipe,
-                        step_no=step_number,
-                        descriptions=description
-                    )
+                for row in rows
+            ])
+            recipe_ids.extend(recipe.pk for recipe in recipes)
+
+            recipe_ingredients = []
+            recipe_tags = []
+            recipe_steps = []
+            for recipe, row in zip(recipes, rows):
+                # Names with the same canonical form are one ingredient of the recipe
+                ingredients = join_quantities(
+                    (self.ingredient_ids[canonical_name(ingredient_name)], quantity)
+                    for ingredient_name, quantity in zip(row['ingredients'], row['quantities'])
+                )
+                for ingredient_id, quantity in ingredients:
+                    recipe_ingredients.append(RecipeIngredient(recipe=recipe, ingredient_id=ingredient_id, quantity=quantity))
+                for tag_name in row['tags']:
+                    recipe_tags.append(RecipeTag(recipe=recipe, tag_id=self.tag_ids[tag_name]))
+                for step_number, description in enumerate(row['steps'], start=1):
+                    recipe_steps.append(RecipeStep(recipe=recipe, step_no=step_number, descriptions=description))
+
+            RecipeIngredient.objects.bulk_create(recipe_ingredients, batch_size=1000)
+            RecipeTag.objects.bulk_create(recipe_tags, batch_size=1000)
+            RecipeStep.objects.bulk_create(recipe_steps, batch_size=1000)
+
+            # bulk_create doesn't send post_save, refresh the search data once the chunk commits
+            for recipe in recipes:
+                recipe_changed(recipe.pk)
+
+    @staticmethod
+    def create_missing(model, ids_by_name, names):
+        missing = sorted(set(name for name in names if name not in ids_by_name))
+        for instance in model.objects.bulk_create([model(name=name) for name in missing]):
+            ids_by_name[instance.name] = instance.pk
 
-        self.stdout.write(self.style.SUCCESS('Data import completed.'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from recipe_visualizer.models import Recipe
+from recipe_visualizer import recipe_cache
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the rating sum, count and average of every recipe from its feedback'
+
+    def handle(self, *args, **options):
+        updated = Recipe.objects.reconcile_ratings()
+        # A queryset update sends no signals. The recipe versions are RecipeVersion rows,
+        # cached search results expire on their own after SEARCH_CACHE['TTL'].
+        recipe_cache.bump_versions(Recipe.objects.values_list('pk', flat=True).iterator())
+        self.stdout.write(self.style.SUCCESS(f'Reconciled the ratings of {updated} recipes.'))
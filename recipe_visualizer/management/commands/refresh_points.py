@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from recipe_visualizer import points
+
+
+class Command(BaseCommand):
+    help = 'Recompute the points of every user, run it daily since points grow with account age'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Users refreshed per query')
+
+    def handle(self, *args, **options):
+        points.refresh_all(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('User points refreshed.'))
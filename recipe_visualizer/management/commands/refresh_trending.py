@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from recipe_visualizer import trending
+
+
+class Command(BaseCommand):
+    help = 'Add the recent search and review activity to the recipe popularity and rebuild the trending leaderboard, run it every few minutes'
+
+    def handle(self, *args, **options):
+        changed = trending.refresh()
+        self.stdout.write(self.style.SUCCESS(f'Popularity of {changed} recipes updated.'))
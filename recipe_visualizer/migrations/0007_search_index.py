@@ -0,0 +1,33 @@
+# Generated by Django 4.2.5 on 2026-10-18 15:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe_visualizer', '0006_tag_alter_brand_details_alter_category_details_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='recipe_visualizer.recipe')),
+                ('length', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100)),
+                ('frequency', models.IntegerField()),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_postings', to='recipe_visualizer.recipe')),
+            ],
+            options={
+                'unique_together': {('term', 'recipe')},
+            },
+        ),
+    ]
@@ -0,0 +1,69 @@
+from django.db import migrations
+
+FTS_TABLE = 'recipe_visualizer_recipe_fts'
+
+# Rebuilds the full text row of the recipes selected by {ids}
+REFRESH_SQL = f"""
+    DELETE FROM {FTS_TABLE} WHERE rowid IN ({{ids}});
+    INSERT INTO {FTS_TABLE}(rowid, title, description, tags, steps)
+    SELECT r.id, r.title, r.description,
+        (SELECT group_concat(t.name, ' ') FROM recipe_visualizer_recipetag rt
+            JOIN recipe_visualizer_tag t ON t.id = rt.tag_id WHERE rt.recipe_id = r.id),
+        (SELECT group_concat(s.descriptions, ' ') FROM recipe_visualizer_recipestep s
+            WHERE s.recipe_id = r.id)
+    FROM recipe_visualizer_recipe r WHERE r.id IN ({{ids}});
+"""
+
+TRIGGERS = {
+    'recipe_ai': ('AFTER INSERT ON recipe_visualizer_recipe', 'SELECT NEW.id'),
+    'recipe_au': ('AFTER UPDATE OF title, description ON recipe_visualizer_recipe', 'SELECT NEW.id'),
+    'step_ai': ('AFTER INSERT ON recipe_visualizer_recipestep', 'SELECT NEW.recipe_id'),
+    'step_au': ('AFTER UPDATE ON recipe_visualizer_recipestep', 'SELECT NEW.recipe_id UNION SELECT OLD.recipe_id'),
+    'step_ad': ('AFTER DELETE ON recipe_visualizer_recipestep', 'SELECT OLD.recipe_id'),
+    'tag_ai': ('AFTER INSERT ON recipe_visualizer_recipetag', 'SELECT NEW.recipe_id'),
+    'tag_au': ('AFTER UPDATE ON recipe_visualizer_recipetag', 'SELECT NEW.recipe_id UNION SELECT OLD.recipe_id'),
+    'tag_ad': ('AFTER DELETE ON recipe_visualizer_recipetag', 'SELECT OLD.recipe_id'),
+    'tag_name_au': (
+        'AFTER UPDATE OF name ON recipe_visualizer_tag',
+        'SELECT recipe_id FROM recipe_visualizer_recipetag WHERE tag_id = NEW.id',
+    ),
+}
+
+
+def create_fts(apps, schema_editor):
+    # FTS5 is SQLite only, other databases keep using the inverted index backend
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(title, description, tags, steps, tokenize='porter unicode61')"
+    )
+    for name, (event, ids) in TRIGGERS.items():
+        schema_editor.execute(
+            f'CREATE TRIGGER {FTS_TABLE}_{name} {event} BEGIN {REFRESH_SQL.format(ids=ids)} END'
+        )
+    schema_editor.execute(
+        f'CREATE TRIGGER {FTS_TABLE}_recipe_ad AFTER DELETE ON recipe_visualizer_recipe '
+        f'BEGIN DELETE FROM {FTS_TABLE} WHERE rowid = OLD.id; END'
+    )
+    for statement in REFRESH_SQL.format(ids='SELECT id FROM recipe_visualizer_recipe').split(';'):
+        if statement.strip():
+            schema_editor.execute(statement)
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for name in [*TRIGGERS, 'recipe_ad']:
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{name}')
+    schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe_visualizer', '0007_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
@@ -0,0 +1,66 @@
+from django.db import migrations
+
+FTS_TABLE = 'recipe_visualizer_recipe_fts'
+
+# While this table has a row the triggers do nothing, bulk loaders insert one
+# inside their transaction and refresh the recipes they wrote themselves.
+PAUSE_TABLE = 'recipe_visualizer_recipe_fts_pause'
+
+REFRESH_SQL = f"""
+    DELETE FROM {FTS_TABLE} WHERE rowid IN ({{ids}});
+    INSERT INTO {FTS_TABLE}(rowid, title, description, tags, steps)
+    SELECT r.id, r.title, r.description,
+        (SELECT group_concat(t.name, ' ') FROM recipe_visualizer_recipetag rt
+            JOIN recipe_visualizer_tag t ON t.id = rt.tag_id WHERE rt.recipe_id = r.id),
+        (SELECT group_concat(s.descriptions, ' ') FROM recipe_visualizer_recipestep s
+            WHERE s.recipe_id = r.id)
+    FROM recipe_visualizer_recipe r WHERE r.id IN ({{ids}});
+"""
+
+TRIGGERS = {
+    'recipe_ai': ('AFTER INSERT ON recipe_visualizer_recipe', 'SELECT NEW.id'),
+    'recipe_au': ('AFTER UPDATE OF title, description ON recipe_visualizer_recipe', 'SELECT NEW.id'),
+    'step_ai': ('AFTER INSERT ON recipe_visualizer_recipestep', 'SELECT NEW.recipe_id'),
+    'step_au': ('AFTER UPDATE ON recipe_visualizer_recipestep', 'SELECT NEW.recipe_id UNION SELECT OLD.recipe_id'),
+    'step_ad': ('AFTER DELETE ON recipe_visualizer_recipestep', 'SELECT OLD.recipe_id'),
+    'tag_ai': ('AFTER INSERT ON recipe_visualizer_recipetag', 'SELECT NEW.recipe_id'),
+    'tag_au': ('AFTER UPDATE ON recipe_visualizer_recipetag', 'SELECT NEW.recipe_id UNION SELECT OLD.recipe_id'),
+    'tag_ad': ('AFTER DELETE ON recipe_visualizer_recipetag', 'SELECT OLD.recipe_id'),
+    'tag_name_au': (
+        'AFTER UPDATE OF name ON recipe_visualizer_tag',
+        'SELECT recipe_id FROM recipe_visualizer_recipetag WHERE tag_id = NEW.id',
+    ),
+}
+
+
+def create_triggers(schema_editor, when=''):
+    for name, (event, ids) in TRIGGERS.items():
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{name}')
+        schema_editor.execute(
+            f'CREATE TRIGGER {FTS_TABLE}_{name} {event} {when} BEGIN {REFRESH_SQL.format(ids=ids)} END'
+        )
+
+
+def add_pause(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f'CREATE TABLE {PAUSE_TABLE} (paused integer NOT NULL)')
+    create_triggers(schema_editor, when=f'WHEN NOT EXISTS (SELECT 1 FROM {PAUSE_TABLE})')
+
+
+def remove_pause(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    create_triggers(schema_editor)
+    schema_editor.execute(f'DROP TABLE IF EXISTS {PAUSE_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe_visualizer', '0008_recipe_fts'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_pause, remove_pause),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.2.5 on 2026-10-18 15:41
+
+from decimal import Decimal
+from importlib import import_module
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+fts = import_module('recipe_visualizer.migrations.0009_recipe_fts_pause')
+
+
+# SQLite adds NOT NULL columns by copying the table, which drops the FTS triggers
+# on it and breaks the ones that read it, so they're recreated around the change
+def drop_fts_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for name in [*fts.TRIGGERS, 'recipe_ad']:
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {fts.FTS_TABLE}_{name}')
+
+
+def create_fts_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    fts.create_triggers(schema_editor, when=f'WHEN NOT EXISTS (SELECT 1 FROM {fts.PAUSE_TABLE})')
+    schema_editor.execute(f'DROP TRIGGER IF EXISTS {fts.FTS_TABLE}_recipe_ad')
+    schema_editor.execute(
+        f'CREATE TRIGGER {fts.FTS_TABLE}_recipe_ad AFTER DELETE ON recipe_visualizer_recipe '
+        f'BEGIN DELETE FROM {fts.FTS_TABLE} WHERE rowid = OLD.id; END'
+    )
+
+
+def backfill_ratings(apps, schema_editor):
+    Recipe = apps.get_model('recipe_visualizer', 'Recipe')
+    Feedback = apps.get_model('recipe_visualizer', 'Feedback')
+    feedback = Feedback.objects.filter(recipe=models.OuterRef('pk')).order_by().values('recipe')
+    Recipe.objects.update(
+        rating_sum=Coalesce(models.Subquery(feedback.annotate(total=models.Sum('rating')).values('total')), Decimal(0)),
+        rating_count=Coalesce(models.Subquery(feedback.annotate(count=models.Count('id')).values('count')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe_visualizer', '0009_recipe_fts_pause'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_fts_triggers, create_fts_triggers),
+        migrations.AddField(
+            model_name='recipe',
+            name='rating_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='rating_sum',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+        migrations.RunPython(create_fts_triggers, drop_fts_triggers),
+    ]
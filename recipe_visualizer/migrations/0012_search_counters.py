@@ -0,0 +1,36 @@
+# Generated by Django 4.2.5 on 2026-10-18 15:56
+
+from django.db import migrations, models
+
+
+# Nothing wrote Search rows before, but merge any duplicates added by hand so the unique constraint holds
+def merge_duplicates(apps, schema_editor):
+    Search = apps.get_model('recipe_visualizer', 'Search')
+    duplicates = (
+        Search.objects.values('user', 'recipe')
+        .annotate(rows=models.Count('id'), total=models.Sum('count'), first=models.Min('id'))
+        .filter(rows__gt=1)
+    )
+    for duplicate in duplicates:
+        Search.objects.filter(pk=duplicate['first']).update(count=duplicate['total'])
+        Search.objects.filter(user=duplicate['user'], recipe=duplicate['recipe']).exclude(pk=duplicate['first']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe_visualizer', '0011_stored_blob'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='search',
+            name='opens',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterUniqueTogether(
+            name='search',
+            unique_together={('user', 'recipe')},
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.5 on 2026-10-18 15:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe_visualizer', '0012_search_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipePopularity',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='recipe_visualizer.recipe')),
+                ('log_score', models.FloatField()),
+                ('rank_key', models.FloatField(db_index=True)),
+                ('hits_seen', models.IntegerField(default=0)),
+                ('opens_seen', models.IntegerField(default=0)),
+                ('reviews_seen', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TrendingRecipe',
+            fields=[
+                ('rank', models.PositiveSmallIntegerField(primary_key=True, serialize=False)),
+                ('score', models.FloatField()),
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='trending', to='recipe_visualizer.recipe')),
+            ],
+        ),
+    ]
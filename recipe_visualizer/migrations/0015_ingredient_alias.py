@@ -0,0 +1,22 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe_visualizer', '0014_similar_recipe'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngredientAlias',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('alias', models.CharField(max_length=100, unique=True)),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aliases', to='recipe_visualizer.ingredient')),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe_visualizer', '0015_ingredient_alias'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=500, unique=True)),
+                ('offset', models.BigIntegerField()),
+                ('rows', models.IntegerField()),
+            ],
+        ),
+    ]
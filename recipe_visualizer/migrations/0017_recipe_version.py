@@ -0,0 +1,21 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe_visualizer', '0016_import_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeVersion',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='version', serialize=False, to='recipe_visualizer.recipe')),
+                ('version', models.BigIntegerField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe_visualizer', '0017_recipe_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['is_feature', 'rating', 'id'], name='recipe_feature_rating_idx'),
+        ),
+    ]
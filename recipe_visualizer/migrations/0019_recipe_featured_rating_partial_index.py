@@ -0,0 +1,21 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe_visualizer', '0018_recipe_feature_rating_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='recipe',
+            name='recipe_feature_rating_idx',
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(('is_feature', True)), fields=['-rating', '-id'], name='recipe_featured_rating_idx'),
+        ),
+    ]
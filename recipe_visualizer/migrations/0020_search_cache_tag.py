@@ -0,0 +1,20 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe_visualizer', '0019_recipe_featured_rating_partial_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchCacheTag',
+            fields=[
+                ('tag', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('generation', models.BigIntegerField()),
+            ],
+        ),
+    ]
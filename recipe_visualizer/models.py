@@ -1,7 +1,10 @@
 # models.py
-from django.db import models
+from decimal import Decimal
+from django.db import models, transaction
+from django.db.models.functions import Cast, Coalesce
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AbstractUser, BaseUserManager
+from .ingredient_names import canonical_name
 
 class CustomUserManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
@@ -59,6 +62,18 @@ class Ingredient(models.Model):
     def __str__(self):
         return self.name
 
+class IngredientAlias(models.Model): # Canonical name (see ingredient_names.py) written and searched as another ingredient
+    alias = models.CharField(max_length=100, unique=True)
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE, related_name='aliases')
+
+    def save(self, *args, **kwargs):
+        # Looked up by canonical name only
+        self.alias = canonical_name(self.alias)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.alias
+
 class IngredientCategory(models.Model):
     ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
@@ -70,6 +85,61 @@ class Type(models.Model): # Type of Recipe
     def __str__(self):
         return self.name
 
+class RecipeQuerySet(models.QuerySet):
+    def for_list(self):
+        # Everything RecipeListSerializer reads
+        return self.select_related('user')
+
+    def for_detail(self):
+        # Everything RecipeSerializer reads, one query per relation
+        return self.select_related('user').prefetch_related(
+            models.Prefetch('feedback', queryset=Feedback.objects.select_related('user')),
+            models.Prefetch('ingredients', queryset=RecipeIngredient.objects.select_related('ingredient')),
+            models.Prefetch('steps', queryset=RecipeStep.objects.order_by('step_no').prefetch_related(
+                models.Prefetch('step_images', queryset=StepImage.objects.select_related('image').order_by('serial_no')),
+            )),
+            models.Prefetch('tags', queryset=RecipeTag.objects.select_related('tag')),
+        )
+
+    def adjust_ratings(self, total, count):
+        """
+        Add total to the rating sum and count to the number of ratings in a single
+        UPDATE, whatever the number of reviews. The database reads the old sum and
+        count, so concurrent reviews can't be lost.
+        """
+        rating_sum = models.F('rating_sum') + total
+        rating_count = models.F('rating_count') + count
+        return self.update(
+            rating_sum=rating_sum,
+            rating_count=rating_count,
+            rating=models.Case(
+                models.When(rating_count__lte=-count, then=models.Value(0.0)),
+                # Cast, or SQLite divides integral sums as integers
+                default=Cast(rating_sum, models.FloatField()) / rating_count,
+                output_field=models.FloatField(),
+            ),
+        )
+
+    def add_rating(self, rating):
+        return self.adjust_ratings(rating, 1)
+
+    def remove_rating(self, rating):
+        return self.adjust_ratings(-rating, -1)
+
+    def change_rating(self, old, new):
+        return self.adjust_ratings(new - old, 0)
+
+    def reconcile_ratings(self):
+        """
+        Rebuild the rating aggregates from the feedback table in one UPDATE.
+        """
+        feedback = Feedback.objects.filter(recipe=models.OuterRef('pk')).order_by().values('recipe')
+        return self.update(
+            rating_sum=Coalesce(models.Subquery(feedback.annotate(total=models.Sum('rating')).values('total')), Decimal(0)),
+            rating_count=Coalesce(models.Subquery(feedback.annotate(count=models.Count('id')).values('count')), 0),
+            rating=Coalesce(models.Subquery(feedback.annotate(average=models.Avg('rating')).values('average')), Decimal(0)),
+        )
+
 class Recipe(models.Model):
     user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='recipes')
     recipe_image = models.ImageField(upload_to='recipe_images/',null=True, default=None)
@@ -79,6 +149,19 @@ class Recipe(models.Model):
     is_valid = models.BooleanField(default=True)
     is_feature = models.BooleanField(default=False)
     rating = models.DecimalField(max_digits=3, decimal_places=2, default=0)
+    rating_sum = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    rating_count = models.IntegerField(default=0)
+
+    objects = RecipeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # The home page, featured recipes by rating then id, see HomePageView.keyset_ordering.
+            # Partial, SQLite can't use is_feature as a column of the index for a bare WHERE "is_feature"
+            models.Index(
+                fields=['-rating', '-id'], condition=models.Q(is_feature=True), name='recipe_featured_rating_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.title
@@ -105,7 +188,13 @@ class StepImage(models.Model):
 class Search(models.Model):
     user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
+    # Times the recipe was in the search results of the user, and opened after that.
+    # Written in batches by search_stats.
     count = models.IntegerField(default=0)
+    opens = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'recipe')
 
 class Feedback(models.Model):
     user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
@@ -113,6 +202,19 @@ class Feedback(models.Model):
     rating = models.DecimalField(max_digits=3, decimal_places=2)
     review_text = models.TextField()
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # What the recipe's rating aggregates count for this review, see signals.py
+        if 'recipe_id' in field_names and 'rating' in field_names:
+            instance.counted = (instance.recipe_id, instance.rating)
+        return instance
+
+    def save(self, *args, **kwargs):
+        # post_save updates the rating aggregates, in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 class RecipeIngredient(models.Model):
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='ingredients')
     ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
@@ -124,3 +226,62 @@ class Tag(models.Model):
 class RecipeTag(models.Model):
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='tags')
     tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+
+class StoredBlob(models.Model): # File kept once by ContentAddressedStorage, whatever name it was uploaded with
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField()
+    refcount = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+class SearchDocument(models.Model): # Per-recipe statistics of the search index
+    recipe = models.OneToOneField(Recipe, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    length = models.IntegerField(default=0)
+
+class SearchPosting(models.Model): # Inverted index entry: term -> recipe
+    term = models.CharField(max_length=100)
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='search_postings')
+    frequency = models.IntegerField()
+
+    class Meta:
+        unique_together = ('term', 'recipe')
+
+class RecipeVersion(models.Model): # Version behind the ETag of a recipe's details, see recipe_cache.py
+    recipe = models.OneToOneField(Recipe, on_delete=models.CASCADE, primary_key=True, related_name='version')
+    # Microseconds since the epoch of the last change
+    version = models.BigIntegerField()
+
+class SearchCacheTag(models.Model): # Last invalidation of the search cache entries with a tag, see search_cache.py
+    tag = models.CharField(max_length=255, primary_key=True)
+    # Number of the invalidation, the row of search_cache.LATEST holds the latest one
+    generation = models.BigIntegerField()
+
+class RecipePopularity(models.Model): # Decayed search and review activity of a recipe, see trending.py
+    recipe = models.OneToOneField(Recipe, on_delete=models.CASCADE, primary_key=True, related_name='popularity')
+    # log2 of the activity, decayed to trending.EPOCH so only active recipes need writing
+    log_score = models.FloatField()
+    # log_score plus the rating, what the leaderboard is sorted by
+    rank_key = models.FloatField(db_index=True)
+    # Search and Recipe counters already added to the score
+    hits_seen = models.IntegerField(default=0)
+    opens_seen = models.IntegerField(default=0)
+    reviews_seen = models.IntegerField(default=0)
+
+class TrendingRecipe(models.Model): # Top of the leaderboard, rewritten by refresh_trending
+    rank = models.PositiveSmallIntegerField(primary_key=True)
+    recipe = models.OneToOneField(Recipe, on_delete=models.CASCADE, related_name='trending')
+    score = models.FloatField()
+
+class SimilarRecipe(models.Model): # Precomputed neighbour of a recipe, see similar.py
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='similar')
+    similar = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='similar_to')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ('recipe', 'rank')
+
+class ImportCheckpoint(models.Model): # Where recipe_bulk_insert stopped in a CSV file, written with each chunk
+    path = models.CharField(max_length=500, unique=True)
+    # Byte offset of the first record not imported yet, and the rows imported before it
+    offset = models.BigIntegerField()
+    rows = models.IntegerField()
@@ -0,0 +1,162 @@
+import base64
+import binascii
+import json
+from bisect import bisect_right
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on the ordering columns instead of OFFSET.
+
+    The cursor holds the ordering values of the last row of the page and the next page
+    starts right after them, so deep pages cost the same as the first one and nothing
+    is counted. Views set `keyset_ordering`, which must end with a unique column.
+    """
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering = ('-id',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request, view)
+        return self.finish_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request, view)
+        return self.finish_page([row async for row in queryset])
+
+    def page_queryset(self, queryset, request, view):
+        # The rows of the page plus one, to know if there is a next page
+        self.request = request
+        self.page_size_for_request = self.get_page_size(request)
+        ordering = getattr(view, 'keyset_ordering', self.ordering)
+        self.fields = [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+
+        queryset = queryset.order_by(*ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.after(self.fields, self.clean_position(queryset.model, position)))
+        return queryset[:self.page_size_for_request + 1]
+
+    def clean_position(self, model, position):
+        # The cursor comes from the client, one value of the right type per ordering column
+        if len(position) != len(self.fields):
+            raise NotFound(self.invalid_cursor_message)
+        values = []
+        for (name, descending), value in zip(self.fields, position):
+            if value is None or isinstance(value, (dict, list)):
+                raise NotFound(self.invalid_cursor_message)
+            try:
+                values.append(model._meta.get_field(name).to_python(value))
+            except (ValidationError, ValueError, TypeError):
+                raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def finish_page(self, rows):
+        page_size = self.page_size_for_request
+        page = rows[:page_size]
+        self.next_position = None
+        if len(rows) > page_size:
+            last = page[-1]
+            self.next_position = [getattr(last, name) for name, descending in self.fields]
+        return page
+
+    def paginate_sequence(self, items, sort_key, request, keep=None):
+        """
+        Paginate an already sorted list, e.g. ranked search results. sort_key(item)
+        must be ascending along the list and unique, it is what the cursor stores.
+        keep(items) returns the items of a batch to show, in order, the page is
+        filled from the following items for those it drops.
+        """
+        self.request = request
+        page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+        start = 0
+        if position is not None and items:
+            # Sort keys are numbers, a cursor of other values or length can't be compared
+            reference = sort_key(items[0])
+            if len(position) != len(reference) or not all(
+                isinstance(value, (int, float)) and not isinstance(value, bool) for value in position
+            ):
+                raise NotFound(self.invalid_cursor_message)
+            try:
+                start = bisect_right(items, tuple(position), key=sort_key)
+            except TypeError:
+                raise NotFound(self.invalid_cursor_message)
+
+        page = []
+        end = start
+        while len(page) < page_size and end < len(items):
+            batch = items[end:end + page_size - len(page)]
+            end += len(batch)
+            page.extend(keep(batch) if keep is not None else batch)
+        self.next_position = None
+        if end < len(items):
+            # After the last item looked at, kept or not
+            self.next_position = list(sort_key(items[end - 1]))
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def encode_cursor(self, position):
+        payload = json.dumps(position, cls=DjangoJSONEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    @staticmethod
+    def after(fields, position):
+        # (a, b) after (x, y) is a > x OR (a = x AND b > y), flipped for descending columns
+        condition = Q()
+        equal = {}
+        for (name, descending), value in zip(fields, position):
+            lookup = 'lt' if descending else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
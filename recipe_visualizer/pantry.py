@@ -0,0 +1,173 @@
+import threading
+from collections import Counter
+import numpy as np
+from django.conf import settings
+from .models import Ingredient
+from . import ingredient_index
+
+
+class PantryIndex:
+    """
+    Bitsets of the ingredients of every recipe, to rank the whole catalogue by
+    what a pantry lacks.
+
+    The `bits` most used ingredients get one bit per recipe, so the missing ones
+    are counted for every recipe with a few vectorized popcounts. The others are
+    only counted per recipe, and looked up in the ingredient index when a pantry
+    has one. Built from the ingredient index and kept in step with it.
+    """
+
+    def __init__(self, bits=512):
+        self.max_bits = bits
+        self.words = max(1, -(-bits // 64))
+        self.lock = threading.Lock()
+        # The ingredient index this was built from, and its build time then
+        self.index = None
+        self.source = None
+        self.bit_by_ingredient = {}
+        self.row_by_recipe = {}
+        self.recipe_ids = np.zeros(0, dtype=np.int64)
+        self.bits = np.zeros((0, self.words), dtype=np.uint64)
+        self.rare_counts = np.zeros(0, dtype=np.int32)
+
+    def build(self, index):
+        with index.lock:
+            ingredients_by_recipe = {recipe_id: set(ids) for recipe_id, ids in index.ingredients_by_recipe.items()}
+            source = index.built_at
+        usage = Counter(ingredient_id for ids in ingredients_by_recipe.values() for ingredient_id in ids)
+        bit_by_ingredient = {
+            ingredient_id: bit for bit, (ingredient_id, count) in enumerate(usage.most_common(self.max_bits))
+        }
+        recipe_ids = np.array(sorted(ingredients_by_recipe), dtype=np.int64)
+        bits = np.zeros((len(recipe_ids), self.words), dtype=np.uint64)
+        rare_counts = np.zeros(len(recipe_ids), dtype=np.int32)
+        self._fill(bits, rare_counts, bit_by_ingredient, [
+            (row, ingredients_by_recipe[recipe_id]) for row, recipe_id in enumerate(recipe_ids.tolist())
+        ])
+
+        with self.lock:
+            self.bit_by_ingredient = bit_by_ingredient
+            self.row_by_recipe = {recipe_id: row for row, recipe_id in enumerate(recipe_ids.tolist())}
+            self.recipe_ids = recipe_ids
+            self.bits = bits
+            self.rare_counts = rare_counts
+            self.index = index
+            self.source = source
+
+    def update_recipes(self, recipe_ids, index):
+        """
+        Reload the rows of the given recipes from the ingredient index. Ingredients
+        first used since the build are counted like the rare ones.
+        """
+        with index.lock:
+            ingredients_by_recipe = {recipe_id: set(index.ingredients_by_recipe.get(recipe_id, ())) for recipe_id in recipe_ids}
+        with self.lock:
+            new = [recipe_id for recipe_id, ids in ingredients_by_recipe.items() if ids and recipe_id not in self.row_by_recipe]
+            if new:
+                for recipe_id in new:
+                    self.row_by_recipe[recipe_id] = len(self.row_by_recipe)
+                self.recipe_ids = np.concatenate([self.recipe_ids, np.array(new, dtype=np.int64)])
+                self.bits = np.concatenate([self.bits, np.zeros((len(new), self.words), dtype=np.uint64)])
+                self.rare_counts = np.concatenate([self.rare_counts, np.zeros(len(new), dtype=np.int32)])
+            # Recipes without ingredients keep an empty row, nothing ranks them
+            rows = [
+                (self.row_by_recipe[recipe_id], ids)
+                for recipe_id, ids in ingredients_by_recipe.items() if recipe_id in self.row_by_recipe
+            ]
+            self._fill(self.bits, self.rare_counts, self.bit_by_ingredient, rows)
+
+    @staticmethod
+    def _fill(bits, rare_counts, bit_by_ingredient, rows):
+        # Set the bits of [(row, ingredient ids)] in one vectorized OR
+        positions = []
+        row_numbers = []
+        for row, ingredient_ids in rows:
+            bits[row] = 0
+            rare_counts[row] = 0
+            for ingredient_id in ingredient_ids:
+                bit = bit_by_ingredient.get(ingredient_id)
+                if bit is None:
+                    rare_counts[row] += 1
+                else:
+                    row_numbers.append(row)
+                    positions.append(bit)
+        positions = np.array(positions, dtype=np.uint64)
+        np.bitwise_or.at(
+            bits,
+            (np.array(row_numbers, dtype=np.int64), (positions >> np.uint64(6)).astype(np.int64)),
+            np.left_shift(np.uint64(1), positions & np.uint64(63)),
+        )
+
+    def _mask(self, ingredient_ids):
+        mask = np.zeros(self.words, dtype=np.uint64)
+        for ingredient_id in ingredient_ids:
+            bit = self.bit_by_ingredient.get(ingredient_id)
+            if bit is not None:
+                mask[bit >> 6] |= np.uint64(1 << (bit & 63))
+        return mask
+
+    def rank(self, pantry_ids, have_ids, index, max_missing=None):
+        """
+        Rank the recipes using at least one pantry ingredient by the number of their
+        ingredients not in have_ids (the pantry plus the staples), fewest first, then
+        by the number of pantry ingredients they use.
+        Returns (recipe_id, used, missing) tuples, best match first.
+        """
+        with self.lock:
+            missing = np.bitwise_count(self.bits & ~self._mask(have_ids)).sum(axis=1, dtype=np.int32) + self.rare_counts
+            used = np.bitwise_count(self.bits & self._mask(pantry_ids)).sum(axis=1, dtype=np.int32)
+            with index.lock:
+                for ingredient_id in have_ids:
+                    if ingredient_id in self.bit_by_ingredient:
+                        continue
+                    rows = [
+                        self.row_by_recipe[recipe_id]
+                        for recipe_id in index.recipes_by_ingredient.get(ingredient_id, ())
+                        if recipe_id in self.row_by_recipe
+                    ]
+                    np.subtract.at(missing, rows, 1)
+                    if ingredient_id in pantry_ids:
+                        np.add.at(used, rows, 1)
+            recipe_ids = self.recipe_ids
+
+        matches = used > 0
+        if max_missing is not None:
+            matches &= missing <= max_missing
+        rows = np.flatnonzero(matches)
+        order = rows[np.lexsort((-recipe_ids[rows], -used[rows], missing[rows]))]
+        return list(zip(recipe_ids[order].tolist(), used[order].tolist(), missing[order].tolist()))
+
+
+def get_options():
+    return getattr(settings, 'PANTRY', {})
+
+
+_index = PantryIndex(bits=get_options().get('BITS', 512))
+_build_lock = threading.Lock()
+
+
+def get_index():
+    """
+    The process-wide pantry index and the ingredient index it was built from,
+    rebuilt whenever that one is.
+    """
+    source = ingredient_index.get_index()
+    if _index.source != source.built_at:
+        with _build_lock:
+            if _index.source != source.built_at:
+                _index.build(source)
+    return _index, source
+
+
+def recipes_changed(recipe_ids):
+    # Follows the ingredient index, which has already loaded the changes. Once that
+    # one is rebuilt, so is this one on its next use.
+    if _index.index is not None and _index.index.built_at == _index.source:
+        _index.update_recipes(recipe_ids, _index.index)
+
+
+def staple_ids():
+    """
+    Ids of the ingredients named in PANTRY['STAPLES'], which most kitchens have.
+    """
+    return set(Ingredient.objects.filter(name__in=get_options().get('STAPLES', [])).values_list('id', flat=True))
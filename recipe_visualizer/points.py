@@ -0,0 +1,69 @@
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.db.models import Avg, Count
+from django.utils import timezone
+from .models import Recipe
+from . import recipe_cache, search_cache
+
+RECIPE_POINTS = Decimal(2)
+RATING_POINTS = Decimal(3)
+DAY_POINTS = Decimal('0.1')
+
+
+def compute_points(recipe_count, average_rating, registration_date, now):
+    """
+    2 points per recipe, 3 per star of the average recipe rating and 0.1 per day since registration.
+    """
+    points = recipe_count * RECIPE_POINTS
+    if recipe_count:
+        points += Decimal(average_rating) * RATING_POINTS
+    points += (now - registration_date).days * DAY_POINTS
+    return points.quantize(Decimal('0.01'))
+
+
+def refresh_users(user_ids):
+    """
+    Recompute the stored points of the given users, with one aggregate query for all of them.
+    """
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    stats = {
+        row['user']: (row['count'], row['average'])
+        for row in Recipe.objects.filter(user__in=user_ids).order_by().values('user').annotate(
+            count=Count('id'), average=Avg('rating'),
+        )
+    }
+    now = timezone.now()
+    changed = []
+    for user in get_user_model().objects.filter(pk__in=user_ids).only('pk', 'registration_date', 'points'):
+        count, average = stats.get(user.pk, (0, None))
+        points = compute_points(count, average, user.registration_date, now)
+        if points != user.points:
+            user.points = points
+            changed.append(user)
+    if not changed:
+        return
+    get_user_model().objects.bulk_update(changed, ['points'], batch_size=500)
+    # bulk_update sends no post_save, drop the search results and the recipe details that embed these users
+    changed_ids = [user.pk for user in changed]
+    search_cache.users_changed(changed_ids)
+    recipe_cache.bump_versions(Recipe.objects.filter(user__in=changed_ids).values_list('pk', flat=True).iterator())
+
+
+def refresh_recipe_authors(recipe_ids):
+    refresh_users(Recipe.objects.filter(pk__in=recipe_ids).values_list('user_id', flat=True))
+
+
+def refresh_all(batch_size=1000):
+    """
+    Recompute every user's points, e.g. daily for the part that grows with time.
+    """
+    user_ids = get_user_model().objects.order_by('pk').values_list('pk', flat=True)
+    batch = []
+    for user_id in user_ids.iterator(chunk_size=batch_size):
+        batch.append(user_id)
+        if len(batch) == batch_size:
+            refresh_users(batch)
+            batch = []
+    refresh_users(batch)
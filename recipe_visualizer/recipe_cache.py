@@ -0,0 +1,87 @@
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from .models import Recipe, RecipeVersion
+
+
+def _payload_key(recipe_id, version, base_url):
+    return f'recipe:{recipe_id}:{version}:{base_url}'
+
+
+def _new_version(previous=0):
+    # Microseconds since the epoch, so the version is also the last modification time. Every
+    # version starts a new second, Last-Modified only has seconds and must tell them apart.
+    return max(time.time_ns() // 1000, (previous // 1_000_000 + 1) * 1_000_000)
+
+
+def get_version(recipe_id):
+    """
+    Current version of a recipe, None if there is no such recipe. The versions are
+    in the database so every process agrees on them, 0 means unchanged since they
+    were first recorded.
+    """
+    row = Recipe.objects.filter(pk=recipe_id).values_list('version__version').first()
+    return None if row is None else row[0] or 0
+
+
+async def aget_version(recipe_id):
+    row = await Recipe.objects.filter(pk=recipe_id).values_list('version__version').afirst()
+    return None if row is None else row[0] or 0
+
+
+def bump_versions(recipe_ids, batch_size=500):
+    """
+    Give the recipes a new version, two queries per batch_size recipes. Deleted recipes are skipped.
+    """
+    recipe_ids = list(recipe_ids)
+    for start in range(0, len(recipe_ids), batch_size):
+        previous = Recipe.objects.filter(pk__in=recipe_ids[start:start + batch_size]).values_list('pk', 'version__version')
+        RecipeVersion.objects.bulk_create(
+            [RecipeVersion(recipe_id=recipe_id, version=_new_version(version or 0)) for recipe_id, version in previous],
+            update_conflicts=True, unique_fields=['recipe'], update_fields=['version'],
+        )
+
+
+def etag(recipe_id, version):
+    return quote_etag(f'{recipe_id}-{version}')
+
+
+def headers(recipe_id, version):
+    """
+    Validators of a version, there is no Last-Modified for a recipe unchanged since
+    the versions were first recorded.
+    """
+    headers = {'ETag': etag(recipe_id, version), 'Cache-Control': 'no-cache'}
+    if version:
+        headers['Last-Modified'] = http_date(version // 1_000_000)
+    return headers
+
+
+def not_modified(request, recipe_id, version):
+    """
+    True if the client's copy, named by If-None-Match or If-Modified-Since, is still current.
+    """
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        return etag(recipe_id, version) in parse_etags(if_none_match) or if_none_match.strip() == '*'
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return bool(version) and if_modified_since is not None and version // 1_000_000 <= if_modified_since
+
+
+def get_payload(recipe_id, version, base_url):
+    return cache.get(_payload_key(recipe_id, version, base_url))
+
+
+def set_payload(recipe_id, version, base_url, payload):
+    timeout = getattr(settings, 'RECIPE_CACHE_TIMEOUT', 60 * 60 * 24)
+    cache.set(_payload_key(recipe_id, version, base_url), payload, timeout=timeout)
+
+
+async def aget_payload(recipe_id, version, base_url):
+    return await cache.aget(_payload_key(recipe_id, version, base_url))
+
+
+async def aset_payload(recipe_id, version, base_url, payload):
+    timeout = getattr(settings, 'RECIPE_CACHE_TIMEOUT', 60 * 60 * 24)
+    await cache.aset(_payload_key(recipe_id, version, base_url), payload, timeout=timeout)
@@ -0,0 +1,266 @@
+from django.db import transaction
+from django.db.models import Prefetch
+from . import images
+from .ingredient_names import canonical_name
+from .models import Image, Ingredient, IngredientAlias, Recipe, RecipeIngredient, RecipeStep, RecipeTag, StepImage, Tag
+from .signals import ingredients_created, recipe_changed
+
+QUANTITY_MAX_LENGTH = RecipeIngredient._meta.get_field('quantity').max_length
+
+
+def ids_by_name(model, names):
+    """
+    Map every name to the id of an Ingredient or Tag with that name, creating the
+    missing ones with one bulk_create. Two queries whatever the number of names.
+    """
+    names = set(names)
+    ids = {}
+    # Names aren't unique, use the oldest row
+    for pk, name in model.objects.filter(name__in=names).order_by('-pk').values_list('pk', 'name'):
+        ids[name] = pk
+    created = model.objects.bulk_create([model(name=name) for name in sorted(names - ids.keys())])
+    for instance in created:
+        ids[instance.name] = instance.pk
+    if created and model is Ingredient:
+        ingredients_created(created)
+    return ids
+
+
+def ingredient_ids_by_name(names):
+    """
+    Map every name to the id of the Ingredient of its canonical name, see
+    ingredient_names. An IngredientAlias wins over an Ingredient with that name,
+    the missing ones are created under their canonical name. Three queries whatever
+    the number of names.
+    """
+    canonical = {name: canonical_name(name) for name in names}
+    ids = dict(IngredientAlias.objects.filter(alias__in=set(canonical.values())).values_list('alias', 'ingredient_id'))
+    ids.update(ids_by_name(Ingredient, set(canonical.values()) - ids.keys()))
+    return {name: ids[key] for name, key in canonical.items()}
+
+
+def join_quantities(pairs):
+    """
+    Collapse [(ingredient_id, quantity)] to one pair per ingredient in first seen
+    order, so an ingredient listed twice ('eggs' and 'egg') is one row with both quantities.
+    """
+    quantities = {}
+    for ingredient_id, quantity in pairs:
+        quantities.setdefault(ingredient_id, []).append(quantity)
+    return [
+        (ingredient_id, ' + '.join(filter(None, values))[:QUANTITY_MAX_LENGTH] or values[0])
+        for ingredient_id, values in quantities.items()
+    ]
+
+
+def create_recipe(user, data):
+    """
+    Create a recipe with its ingredients, tags, steps and step images from
+    AddRecipeSerializer's validated data, in one transaction and a fixed number of queries.
+    """
+    ingredients_data = data.get('ingredients', [])
+    tags_data = data.get('tags', [])
+    steps_data = data.get('steps', [])
+
+    with transaction.atomic():
+        recipe = Recipe.objects.create(
+            title=data['title'],
+            description=data['description'],
+            making_time=data['making_time'],
+            recipe_image=data.get('recipe_image'),
+            user=user,
+        )
+
+        ingredient_names = [item.get('ingredient', {}).get('name') for item in ingredients_data]
+        ingredient_ids = ingredient_ids_by_name(ingredient_names)
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe=recipe, ingredient_id=ingredient_id, quantity=quantity)
+            for ingredient_id, quantity in join_quantities(
+                (ingredient_ids[name], item.get('quantity')+" "+name) for item, name in zip(ingredients_data, ingredient_names)
+            )
+        ])
+
+        tag_names = [item.get('tag', {}).get('name') for item in tags_data]
+        tag_ids = ids_by_name(Tag, tag_names)
+        RecipeTag.objects.bulk_create([RecipeTag(recipe=recipe, tag_id=tag_ids[name]) for name in tag_names])
+
+        steps = RecipeStep.objects.bulk_create([
+            RecipeStep(recipe=recipe, step_no=item.get('step_no'), descriptions=item.get('descriptions'))
+            for item in steps_data
+        ])
+        step_images = [
+            (step, position, image_data)
+            for step, item in zip(steps, steps_data)
+            for position, image_data in enumerate(item.get('step_images') or [], start=1)
+        ]
+        new_images = Image.objects.bulk_create([
+            Image(
+                image_path=image_data.get('image', {}).get('image_path'),
+                descriptions=image_data.get('image', {}).get('descriptions'),
+            )
+            for step, position, image_data in step_images
+        ])
+        StepImage.objects.bulk_create([
+            StepImage(step=step, image=image, serial_no=image_data.get('serial_no', position))
+            for (step, position, image_data), image in zip(step_images, new_images)
+        ])
+        for image in new_images:
+            images.generate_on_commit(image.image_path.name)
+
+        # bulk_create doesn't send post_save, refresh the derived data once for the whole recipe
+        recipe_changed(recipe.pk)
+    return recipe
+
+
+def update_recipe(recipe, data):
+    """
+    Apply AddRecipeSerializer's (partial) validated data to a recipe. Only the
+    rows that differ are inserted, updated or deleted, so unchanged children keep
+    their ids. Lists missing from the data are left alone.
+    """
+    with transaction.atomic():
+        fields = [name for name in ('title', 'description', 'making_time') if name in data and data[name] != getattr(recipe, name)]
+        if data.get('recipe_image'):
+            fields.append('recipe_image')
+        for name in fields:
+            setattr(recipe, name, data[name])
+        if fields:
+            recipe.save(update_fields=fields)
+
+        if 'ingredients' in data:
+            _update_ingredients(recipe, data['ingredients'])
+        if 'tags' in data:
+            _update_tags(recipe, data['tags'])
+        if 'steps' in data:
+            _update_steps(recipe, data['steps'])
+
+        # Bulk writes don't send post_save, deletes do but that's only part of the changes
+        recipe_changed(recipe.pk)
+    return recipe
+
+
+def _update_ingredients(recipe, ingredients_data):
+    names = [item.get('ingredient', {}).get('name') for item in ingredients_data]
+    ingredient_ids = ingredient_ids_by_name(names)
+
+    # Rows are matched on their ingredient, a changed quantity is an update
+    existing = {}
+    for row in recipe.ingredients.order_by('pk'):
+        existing.setdefault(row.ingredient_id, []).append(row)
+    created, updated = [], []
+    for ingredient_id, quantity in join_quantities((ingredient_ids[name], item.get('quantity')) for item, name in zip(ingredients_data, names)):
+        rows = existing.get(ingredient_id)
+        if rows:
+            row = rows.pop(0)
+            if row.quantity != quantity:
+                row.quantity = quantity
+                updated.append(row)
+        else:
+            created.append(RecipeIngredient(recipe=recipe, ingredient_id=ingredient_id, quantity=quantity))
+
+    RecipeIngredient.objects.bulk_create(created)
+    RecipeIngredient.objects.bulk_update(updated, ['quantity'])
+    removed = [row.pk for rows in existing.values() for row in rows]
+    if removed:
+        RecipeIngredient.objects.filter(pk__in=removed).delete()
+
+
+def _update_tags(recipe, tags_data):
+    tag_ids = ids_by_name(Tag, [item.get('tag', {}).get('name') for item in tags_data])
+    wanted = set(tag_ids.values())
+
+    kept = set()
+    removed = []
+    for row in recipe.tags.order_by('pk'):
+        if row.tag_id in wanted and row.tag_id not in kept:
+            kept.add(row.tag_id)
+        else:
+            removed.append(row.pk)
+
+    RecipeTag.objects.bulk_create([RecipeTag(recipe=recipe, tag_id=tag_id) for tag_id in sorted(wanted - kept)])
+    if removed:
+        RecipeTag.objects.filter(pk__in=removed).delete()
+
+
+def _update_steps(recipe, steps_data):
+    # Steps are matched on their number, step images on their serial number
+    existing = {
+        step.step_no: step
+        for step in recipe.steps.prefetch_related(
+            Prefetch('step_images', queryset=StepImage.objects.select_related('image')),
+        )
+    }
+    new_steps, updated_steps = [], []
+    step_images = []
+    for item in steps_data:
+        step = existing.pop(item.get('step_no'), None)
+        current = {}
+        if step is None:
+            step = RecipeStep(recipe=recipe, step_no=item.get('step_no'), descriptions=item.get('descriptions'))
+            new_steps.append(step)
+        else:
+            current = {step_image.serial_no: step_image for step_image in step.step_images.all()}
+            if step.descriptions != item.get('descriptions'):
+                step.descriptions = item.get('descriptions')
+                updated_steps.append(step)
+        if item.get('step_images') is not None:
+            step_images.append((step, current, item['step_images']))
+
+    RecipeStep.objects.bulk_create(new_steps)
+    RecipeStep.objects.bulk_update(updated_steps, ['descriptions'])
+
+    new_images, new_step_images = [], []
+    updated_images, updated_step_images, removed_step_images = [], [], []
+    replaced_image_ids = set()
+    for step, current, images_data in step_images:
+        for position, image_data in enumerate(images_data, start=1):
+            serial_no = image_data.get('serial_no', position)
+            image_path = image_data.get('image', {}).get('image_path')
+            descriptions = image_data.get('image', {}).get('descriptions')
+            step_image = current.pop(serial_no, None)
+            if step_image is None or (image_path and image_path != step_image.image.image_path):
+                image = Image(image_path=image_path, descriptions=descriptions)
+                new_images.append(image)
+                if step_image is None:
+                    new_step_images.append(StepImage(step=step, image=image, serial_no=serial_no))
+                else:
+                    replaced_image_ids.add(step_image.image_id)
+                    step_image.image = image
+                    updated_step_images.append(step_image)
+            elif step_image.image.descriptions != descriptions:
+                step_image.image.descriptions = descriptions
+                updated_images.append(step_image.image)
+        for step_image in current.values():
+            removed_step_images.append(step_image.pk)
+            replaced_image_ids.add(step_image.image_id)
+
+    Image.objects.bulk_create(new_images)
+    Image.objects.bulk_update(updated_images, ['descriptions'])
+    for image in new_images:
+        images.generate_on_commit(image.image_path.name)
+    StepImage.objects.bulk_create(new_step_images)
+    StepImage.objects.bulk_update(updated_step_images, ['image'])
+
+    # Deleting a step takes its step images with it, their images are left behind
+    for step in existing.values():
+        replaced_image_ids.update(step_image.image_id for step_image in step.step_images.all())
+    if removed_step_images:
+        StepImage.objects.filter(pk__in=removed_step_images).delete()
+    if existing:
+        RecipeStep.objects.filter(pk__in=[step.pk for step in existing.values()]).delete()
+    delete_orphaned_images(replaced_image_ids)
+
+
+def delete_orphaned_images(image_ids):
+    """
+    Delete the given images that no step uses anymore, and their files once the transaction commits.
+    """
+    if not image_ids:
+        return
+    orphans = list(Image.objects.filter(pk__in=image_ids, stepimage__isnull=True))
+    if not orphans:
+        return
+    Image.objects.filter(pk__in=[image.pk for image in orphans]).delete()
+    for image in orphans:
+        if image.image_path:
+            transaction.on_commit(lambda image=image: images.delete_image(image.image_path))
@@ -0,0 +1,315 @@
+import math
+import sqlite3
+import threading
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Avg, Count
+from django.utils.module_loading import import_string
+from .models import Recipe, SearchDocument, SearchPosting
+from .text import tokenize
+
+# Terms found in the title or the tags say more about a recipe than the ones in its steps
+FIELD_WEIGHTS = {
+    'title': 3,
+    'tags': 2,
+    'description': 1,
+    'steps': 1,
+}
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+MAX_TERM_LENGTH = SearchPosting._meta.get_field('term').max_length
+
+SearchHit = namedtuple('SearchHit', ['recipe_id', 'score'])
+
+
+def recipe_terms(recipe):
+    """
+    Weighted term frequencies of a recipe. Steps and tags must be prefetched.
+    """
+    fields = {
+        'title': recipe.title,
+        'description': recipe.description,
+        'tags': ' '.join(recipe_tag.tag.name for recipe_tag in recipe.tags.all()),
+        'steps': ' '.join(step.descriptions for step in recipe.steps.all()),
+    }
+    terms = Counter()
+    for field, text in fields.items():
+        for term in tokenize(text):
+            if len(term) <= MAX_TERM_LENGTH:
+                terms[term] += FIELD_WEIGHTS[field]
+    return terms
+
+
+def index_recipes(recipe_ids):
+    """
+    (Re)build the postings of the given recipes. Recipes that no longer exist are dropped.
+    """
+    recipe_ids = list(recipe_ids)
+    recipes = Recipe.objects.filter(id__in=recipe_ids).prefetch_related('steps', 'tags__tag')
+
+    documents = []
+    postings = []
+    for recipe in recipes:
+        terms = recipe_terms(recipe)
+        documents.append(SearchDocument(recipe=recipe, length=sum(terms.values())))
+        postings.extend(
+            SearchPosting(term=term, recipe=recipe, frequency=frequency)
+            for term, frequency in terms.items()
+        )
+
+    with transaction.atomic():
+        SearchPosting.objects.filter(recipe_id__in=recipe_ids).delete()
+        SearchDocument.objects.filter(recipe_id__in=recipe_ids).delete()
+        SearchDocument.objects.bulk_create(documents)
+        SearchPosting.objects.bulk_create(postings, batch_size=500)
+
+
+def rebuild_index(batch_size=500):
+    """
+    Index every recipe from scratch. Returns the number of indexed recipes.
+    """
+    SearchPosting.objects.all().delete()
+    SearchDocument.objects.all().delete()
+    recipe_ids = list(Recipe.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(recipe_ids), batch_size):
+        index_recipes(recipe_ids[start:start + batch_size])
+    return len(recipe_ids)
+
+
+def search_recipes(query):
+    """
+    Return (recipe_id, score) pairs of the recipes containing every term of the query,
+    best BM25 score first. Returns None if the query has no searchable terms.
+    """
+    terms = set(term for term in tokenize(query) if len(term) <= MAX_TERM_LENGTH)
+    if not terms:
+        return None
+
+    # Load the posting list of every term with one indexed query
+    postings = {}
+    rows = SearchPosting.objects.filter(term__in=terms).values_list('term', 'recipe_id', 'frequency')
+    for term, recipe_id, frequency in rows:
+        postings.setdefault(term, {})[recipe_id] = frequency
+    if len(postings) < len(terms):
+        return []
+
+    # Intersect starting from the rarest term so the candidate set only shrinks
+    posting_lists = sorted(postings.values(), key=len)
+    candidates = set(posting_lists[0])
+    for posting_list in posting_lists[1:]:
+        candidates.intersection_update(posting_list)
+        if not candidates:
+            return []
+
+    stats = SearchDocument.objects.aggregate(count=Count('pk'), average_length=Avg('length'))
+    document_count = stats['count']
+    average_length = stats['average_length'] or 1
+    lengths = dict(
+        SearchDocument.objects.filter(recipe_id__in=candidates).values_list('recipe_id', 'length')
+    )
+
+    scores = dict.fromkeys(candidates, 0.0)
+    for posting_list in posting_lists:
+        document_frequency = len(posting_list)
+        idf = math.log(1 + (document_count - document_frequency + 0.5) / (document_frequency + 0.5))
+        for recipe_id in candidates:
+            frequency = posting_list[recipe_id]
+            norm = 1 - BM25_B + BM25_B * lengths.get(recipe_id, average_length) / average_length
+            scores[recipe_id] += idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * norm)
+
+    return sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+
+
+class BaseSearchBackend:
+    """
+    Full text search over recipes. search() returns SearchHit tuples, best match first,
+    or None if the query has no searchable terms.
+    """
+
+    def search(self, query):
+        raise NotImplementedError
+
+    def snippets(self, query, recipe_ids):
+        """
+        Excerpts of the given recipes with the query terms highlighted, by recipe id.
+        Asked for the page only, once the hits are ranked and paginated.
+        """
+        return {}
+
+    def query_terms(self, query):
+        """
+        The indexed terms search(query) looks up. A recipe matches a term only if
+        index_terms() of its text has it.
+        """
+        return set(tokenize(query))
+
+    def index_terms(self, text):
+        """
+        The terms a recipe with this text is found by.
+        """
+        return set(tokenize(text))
+
+    def index_recipes(self, recipe_ids):
+        pass
+
+    def rebuild(self):
+        raise NotImplementedError
+
+    @contextmanager
+    def paused(self, recipe_ids):
+        """
+        Stop the database from maintaining the index row by row for a bulk write,
+        the recipes appended to recipe_ids are indexed once when the block exits.
+        Must be used inside a transaction. The written recipes still have to go
+        through recipe_changed for the other derived data.
+        """
+        yield
+
+
+class InvertedIndexBackend(BaseSearchBackend):
+    """
+    BM25 over the SearchPosting tables, works on every database.
+    """
+
+    def search(self, query):
+        results = search_recipes(query)
+        if results is None:
+            return None
+        return [SearchHit(recipe_id, score) for recipe_id, score in results]
+
+    def index_recipes(self, recipe_ids):
+        index_recipes(recipe_ids)
+
+    def rebuild(self):
+        return rebuild_index()
+
+
+class Fts5SearchBackend(BaseSearchBackend):
+    """
+    SQLite FTS5 table kept in sync by triggers, see migrations 0008_recipe_fts and 0009_recipe_fts_pause.
+    """
+    table = 'recipe_visualizer_recipe_fts'
+
+    # bm25() weights of the title, description, tags and steps columns
+    column_weights = (FIELD_WEIGHTS['title'], FIELD_WEIGHTS['description'], FIELD_WEIGHTS['tags'], FIELD_WEIGHTS['steps'])
+
+    snippet_tokens = 16
+
+    def query_terms(self, query):
+        return porter_terms(' '.join(tokenize(query)))
+
+    def index_terms(self, text):
+        return porter_terms(text)
+
+    def search(self, query):
+        match = self._match(query)
+        if match is None:
+            return None
+        weights = ', '.join(str(float(weight)) for weight in self.column_weights)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, bm25({self.table}, {weights}) "
+                f"FROM {self.table} WHERE {self.table} MATCH %s ORDER BY 2, rowid DESC",
+                [match],
+            )
+            # bm25() is lower for better matches
+            return [SearchHit(recipe_id, -rank) for recipe_id, rank in cursor.fetchall()]
+
+    def snippets(self, query, recipe_ids):
+        # snippet() reads the row's text back, only worth it for the rows shown
+        match = self._match(query)
+        recipe_ids = list(recipe_ids)
+        if match is None or not recipe_ids:
+            return {}
+        placeholders = ', '.join(['%s'] * len(recipe_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, snippet({self.table}, -1, '<mark>', '</mark>', '...', {self.snippet_tokens}) "
+                f"FROM {self.table} WHERE {self.table} MATCH %s AND rowid IN ({placeholders})",
+                [match, *recipe_ids],
+            )
+            return dict(cursor.fetchall())
+
+    @staticmethod
+    def _match(query):
+        terms = tokenize(query)
+        if not terms:
+            return None
+        # Quote every term so user input can't use the FTS5 query syntax
+        return ' '.join(f'"{term}"' for term in terms)
+
+    def rebuild(self):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            return self._insert_rows(cursor, 'SELECT id FROM recipe_visualizer_recipe', [])
+
+    @contextmanager
+    def paused(self, recipe_ids):
+        # The triggers skip their work while the pause table has a row, other connections
+        # never see it because SQLite lets only this transaction write until it commits
+        with connection.cursor() as cursor:
+            cursor.execute(f'INSERT INTO {self.table}_pause (paused) VALUES (1)')
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {self.table}_pause')
+        with connection.cursor() as cursor:
+            for start in range(0, len(recipe_ids), 500):
+                batch = list(recipe_ids[start:start + 500])
+                placeholders = ', '.join(['%s'] * len(batch))
+                cursor.execute(f'DELETE FROM {self.table} WHERE rowid IN ({placeholders})', batch)
+                self._insert_rows(cursor, placeholders, batch)
+
+    def _insert_rows(self, cursor, ids, params):
+        cursor.execute(
+            f"INSERT INTO {self.table}(rowid, title, description, tags, steps) "
+            "SELECT r.id, r.title, r.description, "
+            "(SELECT group_concat(t.name, ' ') FROM recipe_visualizer_recipetag rt "
+            "JOIN recipe_visualizer_tag t ON t.id = rt.tag_id WHERE rt.recipe_id = r.id), "
+            "(SELECT group_concat(s.descriptions, ' ') FROM recipe_visualizer_recipestep s WHERE s.recipe_id = r.id) "
+            f"FROM recipe_visualizer_recipe r WHERE r.id IN ({ids})",
+            params,
+        )
+        return cursor.rowcount
+
+
+# Tokenizer of the FTS5 table, see migration 0008_recipe_fts
+FTS5_TOKENIZER = 'porter unicode61'
+
+_porter = None
+_porter_lock = threading.Lock()
+
+
+def porter_terms(text):
+    """
+    The terms FTS5 indexes text under, from SQLite's own tokenizer so they are
+    exactly the stems the MATCH queries compare: 'baking' is 'bake'.
+    """
+    global _porter
+    with _porter_lock:
+        if _porter is None:
+            # A private in-memory database, the text is inserted and rolled back
+            _porter = sqlite3.connect(':memory:', isolation_level=None, check_same_thread=False)
+            _porter.execute(f"CREATE VIRTUAL TABLE terms USING fts5(text, tokenize='{FTS5_TOKENIZER}')")
+            _porter.execute("CREATE VIRTUAL TABLE terms_vocab USING fts5vocab(terms, 'row')")
+        _porter.execute('BEGIN')
+        try:
+            _porter.execute('INSERT INTO terms (text) VALUES (?)', [text])
+            return {term for term, in _porter.execute('SELECT term FROM terms_vocab')}
+        finally:
+            _porter.execute('ROLLBACK')
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    """
+    The backend configured by the SEARCH_BACKEND setting.
+    """
+    backend = getattr(settings, 'SEARCH_BACKEND', 'recipe_visualizer.search.InvertedIndexBackend')
+    return import_string(backend)()
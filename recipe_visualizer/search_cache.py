@@ -0,0 +1,220 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.db.models import F
+from .models import Recipe, RecipeIngredient, SearchCacheTag
+from .search import get_backend
+from .text import get_analyzer
+
+# Tag of the entries that depend on every recipe, e.g. a search listing all of them
+ALL_RECIPES = 'all'
+
+# Tag of the entries that depend on the ingredient vocabulary
+VOCABULARY = 'vocabulary'
+
+# SearchCacheTag row holding the generation of the latest invalidation
+LATEST = ''
+
+
+def normalize_query(text):
+    """
+    Lowercased, sorted words of a query without the stop words.
+    """
+    stop_words = get_analyzer().stop_words
+    return tuple(sorted(set(word for word in text.lower().split() if word not in stop_words)))
+
+
+def term_tags(terms):
+    # Terms as the search backend indexes them, so 'baking' invalidates searches for 'bake'
+    return {f'term:{term}' for term in terms}
+
+
+def recipe_tags(recipe):
+    return {f'recipe:{recipe.pk}', f'user:{recipe.user_id}'}
+
+
+def _row_tag(tag):
+    # A long term is cut to fit the column, sharing a row only invalidates more
+    return tag[:255]
+
+
+class SearchCache:
+    """
+    LRU cache of search responses with a TTL.
+
+    The entries live in the memory of each process. Every entry carries tags naming
+    what it was computed from (recipes, ingredients, terms), so a write only drops
+    the entries it can affect.
+
+    Invalidations are recorded in SearchCacheTag rows so every process sees them:
+    each one is numbered, an entry keeps the number current when its computation
+    started and is stale once one of its tags was invalidated after that.
+    """
+
+    def __init__(self, max_entries=1000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.keys_by_tag = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        entry = self._lookup(key)
+        if entry is not None and self._stale(entry).exists():
+            self._drop(key, entry)
+            entry = None
+        return self._count(entry)
+
+    async def aget(self, key):
+        entry = self._lookup(key)
+        if entry is not None and await self._stale(entry).aexists():
+            self._drop(key, entry)
+            entry = None
+        return self._count(entry)
+
+    def generation(self):
+        """
+        Number of the latest invalidation, taken before computing an entry and given to set().
+        """
+        return SearchCacheTag.objects.filter(tag=LATEST).values_list('generation', flat=True).first() or 0
+
+    async def ageneration(self):
+        return await SearchCacheTag.objects.filter(tag=LATEST).values_list('generation', flat=True).afirst() or 0
+
+    def set(self, key, value, tags, generation):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.monotonic() + self.ttl, value, frozenset(tags), generation)
+            for tag in tags:
+                self.keys_by_tag.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, tags):
+        """
+        Make the entries with any of the tags stale in every process, and drop them from this one.
+        """
+        tags = set(tags)
+        generation = self._next_generation()
+        SearchCacheTag.objects.bulk_create(
+            [SearchCacheTag(tag=tag, generation=generation) for tag in {_row_tag(tag) for tag in tags}],
+            update_conflicts=True, unique_fields=['tag'], update_fields=['generation'],
+        )
+        with self.lock:
+            keys = set()
+            for tag in tags:
+                keys.update(self.keys_by_tag.get(tag, ()))
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.keys_by_tag.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _lookup(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                return None
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def _stale(self, entry):
+        expires, value, tags, generation = entry
+        return SearchCacheTag.objects.filter(tag__in={_row_tag(tag) for tag in tags}, generation__gt=generation)
+
+    def _drop(self, key, entry):
+        # Invalidated by another process
+        with self.lock:
+            if self.entries.get(key) is entry:
+                self._remove(key)
+                self.invalidations += 1
+
+    def _count(self, entry):
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    @staticmethod
+    def _next_generation():
+        # Numbered with an UPDATE so concurrent writers never reuse a number older than theirs
+        if not SearchCacheTag.objects.filter(tag=LATEST).update(generation=F('generation') + 1):
+            SearchCacheTag.objects.get_or_create(tag=LATEST, defaults={'generation': 1})
+        return SearchCacheTag.objects.get(tag=LATEST).generation
+
+    def _remove(self, key):
+        expires, value, tags, generation = self.entries.pop(key)
+        for tag in tags:
+            keys = self.keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.keys_by_tag[tag]
+
+
+_options = getattr(settings, 'SEARCH_CACHE', {})
+results = SearchCache(max_entries=_options.get('MAX_ENTRIES', 1000), ttl=_options.get('TTL', 300))
+
+
+def recipes_changed(recipe_ids):
+    """
+    Drop the entries that contained the recipes or that their current text or ingredients could now match.
+    """
+    tags = {ALL_RECIPES}
+    tags.update(f'recipe:{recipe_id}' for recipe_id in recipe_ids)
+
+    backend = get_backend()
+    recipes = Recipe.objects.filter(id__in=recipe_ids).prefetch_related('steps', 'tags__tag')
+    for recipe in recipes:
+        tags.add(f'user:{recipe.user_id}')
+        text = ' '.join([
+            recipe.title,
+            recipe.description,
+            *(recipe_tag.tag.name for recipe_tag in recipe.tags.all()),
+            *(step.descriptions for step in recipe.steps.all()),
+        ])
+        tags.update(term_tags(backend.index_terms(text)))
+    ingredient_ids = RecipeIngredient.objects.filter(recipe_id__in=recipe_ids).values_list('ingredient_id', flat=True)
+    tags.update(f'ingredient:{ingredient_id}' for ingredient_id in ingredient_ids)
+    results.invalidate(tags)
+
+
+def vocabulary_changed():
+    results.invalidate([VOCABULARY])
+
+
+def user_changed(user_id):
+    users_changed([user_id])
+
+
+def users_changed(user_ids):
+    results.invalidate({f'user:{user_id}' for user_id in user_ids})
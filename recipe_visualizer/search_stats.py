@@ -0,0 +1,136 @@
+import atexit
+import logging
+import threading
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from .models import Recipe, Search
+
+logger = logging.getLogger(__name__)
+
+HITS = 0
+OPENS = 1
+
+
+class SearchStats:
+    """
+    Counts how often recipes show up in the search results of a user (hits) and
+    how often the user opens one of them afterwards (opens), adding the counts to
+    the Search rows in batches rather than writing on every request.
+
+    Counts are kept per (user, recipe) in memory and written every flush_interval
+    seconds by a background thread, and once more when the process exits. At most
+    max_keys pairs are kept, new pairs are dropped while the buffer is full.
+    """
+
+    def __init__(self, max_keys=10000, flush_interval=30):
+        self.max_keys = max_keys
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.dropped = 0
+        self.flushed = 0
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def record_hits(self, user_id, recipe_ids):
+        self._add(user_id, recipe_ids, HITS)
+
+    def record_open(self, user_id, recipe_id):
+        self._add(user_id, [recipe_id], OPENS)
+
+    def _add(self, user_id, recipe_ids, column):
+        if user_id is None:
+            return
+        with self.lock:
+            for recipe_id in recipe_ids:
+                counts = self.counts.get((user_id, recipe_id))
+                if counts is None:
+                    if len(self.counts) >= self.max_keys:
+                        self.dropped += 1
+                        continue
+                    counts = self.counts[(user_id, recipe_id)] = [0, 0]
+                counts[column] += 1
+            full = len(self.counts) >= self.max_keys
+            if self.thread is None and self.flush_interval:
+                self._start()
+        if full:
+            # Flush now instead of waiting for the interval
+            self.wakeup.set()
+
+    def _start(self):
+        self.thread = threading.Thread(target=self._run, name='search-stats', daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except DatabaseError:
+                logger.exception('Could not write the search stats')
+            finally:
+                # This thread has its own connection, don't keep it past CONN_MAX_AGE
+                close_old_connections()
+
+    def flush(self):
+        """
+        Add the buffered counts to the database. Returns the number of (user, recipe) pairs written.
+        """
+        with self.lock:
+            counts, self.counts = self.counts, {}
+        if not counts:
+            return 0
+        write_counts(counts)
+        with self.lock:
+            self.flushed += len(counts)
+        return len(counts)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'pending': len(self.counts),
+                'max_keys': self.max_keys,
+                'flushed': self.flushed,
+                'dropped': self.dropped,
+            }
+
+
+def write_counts(counts):
+    """
+    Add {(user_id, recipe_id): [hits, opens]} to the Search rows. Hits create the
+    row if needed. Opens only count for recipes the user found through search, so
+    they only update existing rows. Users and recipes deleted since are skipped.
+    """
+    table = connection.ops.quote_name(Search._meta.db_table)
+    recipe_table = connection.ops.quote_name(Recipe._meta.db_table)
+    user_table = connection.ops.quote_name(get_user_model()._meta.db_table)
+    hits = [
+        (user_id, recipe_id, counts[HITS], recipe_id, user_id)
+        for (user_id, recipe_id), counts in counts.items() if counts[HITS]
+    ]
+    opens = [
+        (counts[OPENS], user_id, recipe_id)
+        for (user_id, recipe_id), counts in counts.items() if counts[OPENS]
+    ]
+    # SQLite and PostgreSQL both add to the counter of an existing row with ON CONFLICT
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(0, len(hits), 500):
+            cursor.executemany(
+                f"INSERT INTO {table} (user_id, recipe_id, count, opens) "
+                f"SELECT %s, %s, %s, 0 WHERE EXISTS (SELECT 1 FROM {recipe_table} WHERE id = %s) "
+                f"AND EXISTS (SELECT 1 FROM {user_table} WHERE id = %s) "
+                f"ON CONFLICT (user_id, recipe_id) DO UPDATE SET count = {table}.count + excluded.count",
+                hits[start:start + 500],
+            )
+        for start in range(0, len(opens), 500):
+            cursor.executemany(
+                f"UPDATE {table} SET opens = opens + %s WHERE user_id = %s AND recipe_id = %s",
+                opens[start:start + 500],
+            )
+
+
+_options = getattr(settings, 'SEARCH_STATS', {})
+counters = SearchStats(max_keys=_options.get('MAX_KEYS', 10000), flush_interval=_options.get('FLUSH_INTERVAL', 30))
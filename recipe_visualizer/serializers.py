@@ -1,11 +1,20 @@
 from rest_framework import serializers
 from django.contrib.auth.hashers import make_password
 from .models import CustomUser, Category, IngredientCategory, Brand, Ingredient, Type, Recipe, RecipeType, Image, RecipeStep, StepImage, Search, Feedback, RecipeIngredient, Tag, RecipeTag
+from . import images
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """
+    Resized WebP and JPEG copies of an image field by width, so clients can pick the smallest that fits.
+    """
+    def to_representation(self, value):
+        return images.variant_urls(value, self.context.get('request'))
 
 class CustomUserSerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField(source='image_path')
     class Meta:
         model = CustomUser
-        fields = ('id', 'username', 'email', 'first_name', 'last_name', 'image_path', 'points', 'registration_date')
+        fields = ('id', 'username', 'email', 'first_name', 'last_name', 'image_path', 'image_variants', 'points', 'registration_date')
 
 class UpdateUserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -82,6 +91,7 @@ class RecipeTypeSerializer(serializers.ModelSerializer):
         fields = ( 'id', 'type')
 
 class ImageSerializer(serializers.ModelSerializer):
+    variants = ImageVariantsField(source='image_path')
     class Meta:
         model = Image
         fields = '__all__'
@@ -137,9 +147,10 @@ class RecipeSerializer(serializers.ModelSerializer):
     ingredients = RecipeIngredientSerializer(many=True)
     steps = RecipeStepSerializer(many=True)
     tags = RecipeTagSerializer(many=True)
+    recipe_image_variants = ImageVariantsField(source='recipe_image')
     class Meta:
         model = Recipe
-        fields = ('id', 'recipe_image', 'title', 'description', 'making_time', 'rating', 'user', 'feedback', 'ingredients', 'steps', 'tags')
+        fields = ('id', 'recipe_image', 'recipe_image_variants', 'title', 'description', 'making_time', 'rating', 'user', 'feedback', 'ingredients', 'steps', 'tags')
 
 class AddRecipeSerializer(serializers.ModelSerializer):
     ingredients = RecipeIngredientSerializer(many=True)
@@ -151,9 +162,10 @@ class AddRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'recipe_image', 'title', 'description', 'making_time', 'ingredients', 'steps','tags')
 class RecipeListSerializer(serializers.ModelSerializer):
     user = CustomUserSerializer()
+    recipe_image_variants = ImageVariantsField(source='recipe_image')
     class Meta:
         model = Recipe
-        fields = ('id', 'recipe_image', 'title', 'description', 'making_time', 'rating', 'user')
+        fields = ('id', 'recipe_image', 'recipe_image_variants', 'title', 'description', 'making_time', 'rating', 'user')
     def to_representation(self, instance):
         # Get the current request context
         request = self.context.get('request')
@@ -208,11 +220,19 @@ class SignupSerializer(serializers.ModelSerializer):
 
 class SearchByIngredientsSerializer(serializers.Serializer):
     ingredients = serializers.ListField(child=serializers.CharField())
+    # all: recipes using every ingredient, coverage: recipes using any, best coverage first
+    match = serializers.ChoiceField(choices=['all', 'coverage'], default='all')
     def validate(self, data):
         if len(data['ingredients']) < 1:
             raise serializers.ValidationError("Please select at least two ingredients.")
         return data
     
+class PantrySerializer(serializers.Serializer):
+    ingredients = serializers.ListField(child=serializers.CharField(), min_length=1)
+    # Don't count the PANTRY['STAPLES'] as missing
+    ignore_staples = serializers.BooleanField(default=True)
+    max_missing = serializers.IntegerField(min_value=0, required=False)
+
 class SearchByDescriptionSerializer(serializers.Serializer):    
     description = serializers.CharField()
     def validate(self, data):
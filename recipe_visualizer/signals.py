@@ -0,0 +1,149 @@
+import threading
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.contrib.auth import get_user_model
+from .models import Feedback, Image, Ingredient, Recipe, RecipeIngredient, RecipeStep, RecipeTag, StepImage
+from . import autocomplete, fuzzy, images, ingredient_index, pantry, points, recipe_cache, search, search_cache
+
+_pending = threading.local()
+
+
+def recipe_changed(recipe_id):
+    """
+    Refresh the data derived from a recipe once the current transaction commits.
+    Bulk writes don't send model signals, so they must call this themselves.
+    """
+    if not hasattr(_pending, 'recipe_ids'):
+        _pending.recipe_ids = set()
+    _pending.recipe_ids.add(recipe_id)
+    # Every change registers a callback, the first one to run handles the whole batch
+    transaction.on_commit(_refresh_pending)
+
+
+def _refresh_pending():
+    recipe_ids = getattr(_pending, 'recipe_ids', None)
+    if not recipe_ids:
+        return
+    _pending.recipe_ids = set()
+    search.get_backend().index_recipes(recipe_ids)
+    ingredient_index.recipes_changed(recipe_ids)
+    pantry.recipes_changed(recipe_ids)
+    search_cache.recipes_changed(recipe_ids)
+    recipe_cache.bump_versions(recipe_ids)
+    # Usage counts rank the completions
+    autocomplete.vocabulary_changed()
+
+
+def image_saved_with(kwargs, field):
+    # Saves of other fields, such as the last_login of a login, leave the image as it was
+    update_fields = kwargs.get('update_fields')
+    return update_fields is None or field in update_fields
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_saved_or_deleted(sender, instance, created=True, **kwargs):
+    recipe_changed(instance.pk)
+    if kwargs['signal'] is post_save and image_saved_with(kwargs, 'recipe_image'):
+        images.generate_on_commit(instance.recipe_image.name)
+    # Points depend on the number of recipes, edits don't change them
+    if created:
+        user_id = instance.user_id
+        transaction.on_commit(lambda: points.refresh_users([user_id]))
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+@receiver(post_save, sender=RecipeStep)
+@receiver(post_delete, sender=RecipeStep)
+@receiver(post_save, sender=RecipeTag)
+@receiver(post_delete, sender=RecipeTag)
+def recipe_child_saved_or_deleted(sender, instance, **kwargs):
+    recipe_changed(instance.recipe_id)
+
+
+@receiver(post_save, sender=Feedback)
+@receiver(post_delete, sender=Feedback)
+def feedback_saved_or_deleted(sender, instance, **kwargs):
+    # Reviews don't change the search index, only the cached payloads that show
+    # them or the recipe's rating,
+    recipe_id = instance.recipe_id
+    transaction.on_commit(lambda: recipe_cache.bump_versions([recipe_id]))
+    transaction.on_commit(lambda: search_cache.recipes_changed([recipe_id]))
+    # and the author's points through the rating
+    transaction.on_commit(lambda: points.refresh_recipe_authors([recipe_id]))
+
+
+@receiver(post_save, sender=Feedback)
+def feedback_rating_saved(sender, instance, created, raw=False, **kwargs):
+    # The rating aggregates follow every review written, through the API or the admin,
+    # in the transaction of the write. reconcile_ratings fixes up bulk writes.
+    if raw:
+        return
+    counted = getattr(instance, 'counted', None)
+    recipe = Recipe.objects.filter(pk=instance.recipe_id)
+    if created:
+        # Also how GiveFeedbackView finds out the recipe doesn't exist
+        if not recipe.add_rating(instance.rating):
+            raise Recipe.DoesNotExist(f'Recipe {instance.recipe_id} does not exist.')
+    elif counted is None:
+        # Saved without being loaded first, what was counted before is unknown
+        recipe.reconcile_ratings()
+    elif counted[0] != instance.recipe_id:
+        Recipe.objects.filter(pk=counted[0]).remove_rating(counted[1])
+        recipe.add_rating(instance.rating)
+    elif counted[1] != instance.rating:
+        recipe.change_rating(counted[1], instance.rating)
+    instance.counted = (instance.recipe_id, instance.rating)
+
+
+@receiver(post_delete, sender=Feedback)
+def feedback_rating_deleted(sender, instance, **kwargs):
+    # Deletes run in a transaction, cascades from recipes and users included
+    recipe_id, rating = getattr(instance, 'counted', (instance.recipe_id, instance.rating))
+    Recipe.objects.filter(pk=recipe_id).remove_rating(rating)
+
+
+@receiver(post_save, sender=StepImage)
+@receiver(post_delete, sender=StepImage)
+def step_image_saved_or_deleted(sender, instance, **kwargs):
+    recipe_id = instance.step.recipe_id
+    transaction.on_commit(lambda: recipe_cache.bump_versions([recipe_id]))
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_saved(sender, instance, **kwargs):
+    transaction.on_commit(lambda: fuzzy.ingredient_saved(instance))
+    transaction.on_commit(search_cache.vocabulary_changed)
+    transaction.on_commit(autocomplete.vocabulary_changed)
+
+
+def ingredients_created(ingredients):
+    """
+    What ingredient_saved does, for ingredients added with bulk_create.
+    """
+    for ingredient in ingredients:
+        transaction.on_commit(lambda ingredient=ingredient: fuzzy.ingredient_saved(ingredient))
+    transaction.on_commit(search_cache.vocabulary_changed)
+    transaction.on_commit(autocomplete.vocabulary_changed)
+
+
+@receiver(post_delete, sender=Ingredient)
+def ingredient_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: fuzzy.ingredient_deleted(instance))
+    transaction.on_commit(search_cache.vocabulary_changed)
+    transaction.on_commit(autocomplete.vocabulary_changed)
+
+
+@receiver(post_save, sender=get_user_model())
+def user_saved(sender, instance, **kwargs):
+    # Search results embed the author of every recipe
+    transaction.on_commit(lambda: search_cache.user_changed(instance.pk))
+    if image_saved_with(kwargs, 'image_path'):
+        images.generate_on_commit(instance.image_path.name)
+
+
+@receiver(post_save, sender=Image)
+def image_saved(sender, instance, **kwargs):
+    images.generate_on_commit(instance.image_path.name)
@@ -0,0 +1,158 @@
+import numpy as np
+from scipy import sparse
+from django.conf import settings
+from django.db import transaction
+from .models import RecipeIngredient, RecipeTag, SimilarRecipe
+
+# A shared tag says less about two recipes than a shared ingredient
+INGREDIENT_WEIGHT = 1.0
+TAG_WEIGHT = 0.5
+
+# Similarity scores computed at once, rows per block * recipes
+BLOCK_CELLS = 4_000_000
+
+
+def get_neighbours():
+    return getattr(settings, 'SIMILAR_RECIPES', {}).get('NEIGHBOURS', 10)
+
+
+def load_vectors():
+    """
+    Ids of the recipes with ingredients or tags, and their TF-IDF vectors as the
+    L2 normalized rows of a sparse matrix, so a dot product is a cosine similarity.
+    """
+    row_by_recipe = {}
+    column_by_feature = {}
+    rows = []
+    columns = []
+    weights = []
+    sources = (
+        (RecipeIngredient.objects.values_list('recipe_id', 'ingredient_id'), 'ingredient', INGREDIENT_WEIGHT),
+        (RecipeTag.objects.values_list('recipe_id', 'tag_id'), 'tag', TAG_WEIGHT),
+    )
+    for pairs, kind, weight in sources:
+        for recipe_id, feature_id in pairs.iterator(chunk_size=5000):
+            rows.append(row_by_recipe.setdefault(recipe_id, len(row_by_recipe)))
+            columns.append(column_by_feature.setdefault((kind, feature_id), len(column_by_feature)))
+            weights.append(weight)
+
+    shape = (len(row_by_recipe), len(column_by_feature))
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, columns)), shape=shape)
+    # An ingredient listed twice is still one ingredient
+    matrix.data[:] = 1
+
+    # Smoothed inverse document frequency, times the weight of the feature kind
+    document_frequency = np.bincount(matrix.indices, minlength=shape[1])
+    idf = np.log((1 + shape[0]) / (1 + document_frequency)) + 1
+    column_weights = np.zeros(shape[1], dtype=np.float32)
+    column_weights[columns] = weights
+    matrix = matrix @ sparse.diags((idf * column_weights).astype(np.float32))
+
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    matrix = sparse.diags((1 / norms).astype(np.float32)) @ matrix
+
+    recipe_ids = np.empty(len(row_by_recipe), dtype=np.int64)
+    for recipe_id, row in row_by_recipe.items():
+        recipe_ids[row] = recipe_id
+    return recipe_ids, matrix.tocsr()
+
+
+def score_blocks(matrix, rows, block_size):
+    """
+    Yield (block of rows, dense similarities of the block to every row), self similarity zeroed.
+    """
+    transposed = matrix.T.tocsc()
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        scores = (matrix[block] @ transposed).toarray()
+        scores[np.arange(len(block)), block] = 0
+        yield block, scores
+
+
+def top_k(scores, k):
+    """
+    (columns, scores) of the k best positive scores of every row, best first.
+    """
+    k = min(k, scores.shape[1])
+    if k < scores.shape[1]:
+        columns = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        columns = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    top_scores = np.take_along_axis(scores, columns, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(columns, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def write_neighbours(neighbours):
+    """
+    Replace the stored neighbours of the recipes in {recipe_id: [(similar_id, score), ...]}.
+    """
+    with transaction.atomic():
+        SimilarRecipe.objects.filter(recipe_id__in=list(neighbours)).delete()
+        SimilarRecipe.objects.bulk_create([
+            SimilarRecipe(recipe_id=recipe_id, similar_id=similar_id, rank=rank, score=score)
+            for recipe_id, similar in neighbours.items()
+            for rank, (similar_id, score) in enumerate(similar, start=1)
+        ], batch_size=1000)
+
+
+def build(full=False, k=None, block_size=None):
+    """
+    Store the k most similar recipes of the recipes added since the last build, or
+    of every recipe when full. The new recipes also take the place of weaker
+    neighbours in the lists of the others. Returns the number of recipes scored.
+    """
+    k = k or get_neighbours()
+    recipe_ids, matrix = load_vectors()
+    if not len(recipe_ids):
+        return 0
+    block_size = block_size or max(1, BLOCK_CELLS // len(recipe_ids))
+
+    built = set(SimilarRecipe.objects.values_list('recipe_id', flat=True).distinct())
+    if full:
+        pending = np.arange(len(recipe_ids))
+        thresholds = None
+        # Recipes that lost all their ingredients and tags
+        SimilarRecipe.objects.filter(recipe_id__in=list(built - set(recipe_ids.tolist()))).delete()
+    else:
+        # The recipes sharing nothing with any other are scored again every time, there are few
+        pending = np.array([row for row, recipe_id in enumerate(recipe_ids.tolist()) if recipe_id not in built], dtype=np.int64)
+        # A recipe with a full list only takes a new neighbour that beats its last one
+        thresholds = np.zeros(len(recipe_ids), dtype=np.float32)
+        row_by_recipe = {recipe_id: row for row, recipe_id in enumerate(recipe_ids.tolist())}
+        for recipe_id, score in SimilarRecipe.objects.filter(rank=k).values_list('recipe_id', 'score'):
+            if recipe_id in row_by_recipe:
+                thresholds[row_by_recipe[recipe_id]] = score
+        thresholds[pending] = np.inf
+
+    candidates = {}
+    for block, scores in score_blocks(matrix, pending, block_size):
+        columns, top_scores = top_k(scores, k)
+        write_neighbours({
+            int(recipe_ids[row]): [
+                (int(recipe_ids[column]), float(score))
+                for column, score in zip(row_columns, row_scores) if score > 0
+            ]
+            for row, row_columns, row_scores in zip(block, columns, top_scores)
+        })
+        if thresholds is not None:
+            for block_row, column in zip(*np.nonzero(scores > thresholds)):
+                candidates.setdefault(int(recipe_ids[column]), []).append(
+                    (int(recipe_ids[block[block_row]]), float(scores[block_row, column]))
+                )
+
+    # Merge the new recipes into the lists they made it into
+    recipe_ids_to_merge = list(candidates)
+    for start in range(0, len(recipe_ids_to_merge), 500):
+        batch = recipe_ids_to_merge[start:start + 500]
+        stored = SimilarRecipe.objects.filter(recipe_id__in=batch).values_list('recipe_id', 'similar_id', 'score')
+        scores_by_recipe = {recipe_id: {} for recipe_id in batch}
+        for recipe_id, similar_id, score in [*stored, *((recipe_id, *item) for recipe_id in batch for item in candidates[recipe_id])]:
+            scores = scores_by_recipe[recipe_id]
+            scores[similar_id] = max(score, scores.get(similar_id, 0))
+        write_neighbours({
+            recipe_id: sorted(scores.items(), key=lambda item: -item[1])[:k]
+            for recipe_id, scores in scores_by_recipe.items()
+        })
+    return len(pending)
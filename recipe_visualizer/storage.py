@@ -0,0 +1,87 @@
+import hashlib
+import os
+import tempfile
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+BLOBS_DIR = 'blobs'
+
+
+def is_blob(name):
+    return name.replace('\\', '/').startswith(f'{BLOBS_DIR}/')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Media storage that keeps every file once, under blobs/<aa>/<sha256><ext>,
+    whatever name it was uploaded with. Saving the same bytes again only adds a
+    reference to its StoredBlob row and deleting only drops one, the
+    collect_blobs command removes the files nothing uses anymore.
+
+    Files stored before this storage was set up keep their names and behave as
+    with FileSystemStorage.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # The name is decided by the content in _save, equal names are the same file
+        return name
+
+    def _save(self, name, content):
+        digest, size, temp_path = self._spool(content)
+        extension = os.path.splitext(name)[1].lower()
+        blob_name = f'{BLOBS_DIR}/{digest[:2]}/{digest}{extension}'
+        full_path = self.path(blob_name)
+        # Reference first, collect_blobs never removes the file of a referenced blob.
+        # It may have removed it just before, then the upload puts it back.
+        self._add_reference(blob_name, size)
+        if os.path.exists(full_path):
+            os.remove(temp_path)
+            # Newer than collect_blobs' grace period again, in case the file was left without a row
+            os.utime(full_path)
+        else:
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            os.replace(temp_path, full_path)
+            if self.file_permissions_mode is not None:
+                os.chmod(full_path, self.file_permissions_mode)
+        return blob_name
+
+    def _spool(self, content):
+        # Hash while copying to a temporary file next to the blobs, so the final rename is atomic
+        temp_dir = self.path(f'{BLOBS_DIR}/tmp')
+        os.makedirs(temp_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        with tempfile.NamedTemporaryFile(dir=temp_dir, delete=False) as temp_file:
+            for chunk in content.chunks():
+                digest.update(chunk)
+                temp_file.write(chunk)
+                size += len(chunk)
+        return digest.hexdigest(), size, temp_file.name
+
+    @staticmethod
+    def _add_reference(name, size):
+        # Imported here, storages are created before the apps are ready
+        from .models import StoredBlob
+        if StoredBlob.objects.filter(name=name).update(refcount=F('refcount') + 1):
+            return
+        try:
+            with transaction.atomic():
+                StoredBlob.objects.create(name=name, size=size, refcount=1)
+        except IntegrityError:
+            # Another upload of the same bytes created the row first
+            StoredBlob.objects.filter(name=name).update(refcount=F('refcount') + 1)
+
+    def delete(self, name):
+        if not is_blob(name):
+            return super().delete(name)
+        from .models import StoredBlob
+        StoredBlob.objects.filter(name=name, refcount__gt=0).update(refcount=F('refcount') - 1)
+
+    def delete_blob(self, name):
+        """
+        Remove a blob file for good, for collect_blobs once nothing references it.
+        """
+        super().delete(name)
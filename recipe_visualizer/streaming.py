@@ -0,0 +1,106 @@
+import json
+from itertools import islice
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.encoders import JSONEncoder
+
+# ?stream= values and what they answer with
+FORMATS = {
+    '1': 'json',
+    'json': 'json',
+    'ndjson': 'ndjson',
+}
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+CHUNK_SIZE = 500
+
+
+def stream_format(request):
+    """
+    'json' or 'ndjson' if the request asks for the whole list streamed, else None.
+    """
+    value = request.query_params.get('stream')
+    if not value:
+        return None
+    if value not in FORMATS:
+        raise ValidationError({'stream': f'Expected one of {", ".join(FORMATS)}.'})
+    return FORMATS[value]
+
+
+def _encode(item):
+    return json.dumps(item, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def _chunks(rows, size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def _lines(chunks, serializer_class, context, fmt):
+    # One serializer call and one write per chunk of rows
+    first = True
+    if fmt == 'json':
+        yield b'['
+    for chunk in chunks:
+        encoded = [_encode(item) for item in serializer_class(chunk, many=True, context=context).data]
+        if fmt == 'json':
+            yield (b'' if first else b',') + b','.join(encoded)
+        else:
+            yield b'\n'.join(encoded) + b'\n'
+        first = False
+    if fmt == 'json':
+        yield b']'
+
+
+async def _achunks(rows, size):
+    chunk = []
+    async for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def _alines(chunks, serializer_class, context, fmt):
+    first = True
+    if fmt == 'json':
+        yield b'['
+    async for chunk in chunks:
+        encoded = [_encode(item) for item in serializer_class(chunk, many=True, context=context).data]
+        if fmt == 'json':
+            yield (b'' if first else b',') + b','.join(encoded)
+        else:
+            yield b'\n'.join(encoded) + b'\n'
+        first = False
+    if fmt == 'json':
+        yield b']'
+
+
+def stream_response(queryset, serializer_class, context, fmt, chunk_size=None):
+    """
+    Serialize the whole queryset as a JSON array or NDJSON while it is read, a
+    chunk of rows at a time, so memory doesn't grow with the number of rows.
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    rows = queryset.iterator(chunk_size=chunk_size)
+    return StreamingHttpResponse(
+        _lines(_chunks(rows, chunk_size), serializer_class, context, fmt),
+        content_type=CONTENT_TYPES[fmt],
+    )
+
+
+def astream_response(queryset, serializer_class, context, fmt, chunk_size=None):
+    """
+    stream_response() for async views, reading the rows with aiterator().
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    rows = queryset.aiterator(chunk_size=chunk_size)
+    return StreamingHttpResponse(
+        _alines(_achunks(rows, chunk_size), serializer_class, context, fmt),
+        content_type=CONTENT_TYPES[fmt],
+    )
@@ -1,3 +1,1411 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from PIL import Image as PILImage
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import path, reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from .models import (
+    Category,
+    Feedback,
+    Image,
+    ImportCheckpoint,
+    Ingredient,
+    IngredientAlias,
+    IngredientCategory,
+    Recipe,
+    RecipeIngredient,
+    RecipeStep,
+    RecipeTag,
+    Search,
+    SearchDocument,
+    SearchPosting,
+    StepImage,
+    StoredBlob,
+    Tag,
+    TrendingRecipe,
+)
+from . import async_views, autocomplete, dataset, fuzzy, images, ingredient_index, ingredient_names, pantry, recipe_cache, search, search_cache, search_stats, similar, streaming, text, trending, urls
+from .management.commands.collect_blobs import Command as CollectBlobs
+from .pagination import KeysetPagination
+from .storage import ContentAddressedStorage
+from .views import ingredient_search_key, serve_media
 
-# Create your tests here.
+
+class RecipeFixtures:
+    """
+    A cook, the ingredients named in ingredient_names and a helper adding recipes
+    made of them, for the tests of the data derived from recipes.
+    """
+    ingredient_names = ()
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create_user(email='chef@example.com', username='chef', password='secret')
+        cls.ingredients = {name: Ingredient.objects.create(name=name) for name in cls.ingredient_names}
+
+    @classmethod
+    def create_recipe(cls, title, ingredient_names=(), tags=(), description=None):
+        recipe = Recipe.objects.create(user=cls.user, title=title, description=description or title, making_time='1 hour')
+        for name in ingredient_names:
+            RecipeIngredient.objects.create(recipe=recipe, ingredient=cls.ingredients[name], quantity='1')
+        for tag in tags:
+            RecipeTag.objects.create(recipe=recipe, tag=tag)
+        return recipe
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Pin the number of queries of the read endpoints, so they can't grow with the
+    number of recipes, steps or reviews again.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        user_model = get_user_model()
+        cls.users = [
+            user_model.objects.create_user(email=f'cook{i}@example.com', username=f'cook{i}', password='secret')
+            for i in range(3)
+        ]
+        butter = Ingredient.objects.create(name='butter')
+        sugar = Ingredient.objects.create(name='sugar')
+        dessert = Tag.objects.create(name='dessert')
+        for i in range(5):
+            recipe = Recipe.objects.create(
+                user=cls.users[i % 3],
+                title=f'chocolate cake {i}',
+                description='a rich chocolate cake',
+                making_time='30 minutes',
+                is_feature=True,
+            )
+            RecipeIngredient.objects.create(recipe=recipe, ingredient=butter, quantity='1 cup butter')
+            RecipeIngredient.objects.create(recipe=recipe, ingredient=sugar, quantity='2 cup sugar')
+            RecipeTag.objects.create(recipe=recipe, tag=dessert)
+            for step_no in range(1, 4):
+                step = RecipeStep.objects.create(recipe=recipe, step_no=step_no, descriptions=f'step {step_no}')
+                image = Image.objects.create(image_path=f'recipe_step_images/{i}-{step_no}.png')
+                StepImage.objects.create(step=step, image=image, serial_no=1)
+            for user in cls.users:
+                Feedback.objects.create(user=user, recipe=recipe, rating=4, review_text='tasty')
+        cls.recipe = recipe
+
+    def setUp(self):
+        self.client = APIClient()
+        cache.clear()
+        search_cache.results.clear()
+        ingredient_index.get_index().build()
+        fuzzy.get_matcher().build()
+
+    @staticmethod
+    def read_stream(response):
+        # The async views stream from an async generator
+        if not response.is_async:
+            return b''.join(response.streaming_content)
+
+        async def read():
+            return b''.join([chunk async for chunk in response.streaming_content])
+        return async_to_sync(read)()
+
+    def test_home_page(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('home_page'))
+        self.assertEqual(len(response.json()['results']), 5)
+
+    def test_recipe_list(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('recipe_list'))
+        self.assertEqual(len(response.json()['results']), 5)
+
+    def test_trending(self):
+        # Every recipe has reviews
+        Recipe.objects.reconcile_ratings()
+        trending.refresh()
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('trending_recipes'))
+        self.assertEqual(len(response.json()['results']), 5)
+
+    def test_recipe_details(self):
+        # version, recipe and user, feedback, ingredients, steps, step images, tags
+        with self.assertNumQueries(7):
+            response = self.client.get(reverse('recipe_details', args=[self.recipe.pk]))
+        self.assertEqual(len(response.json()['steps']), 3)
+        self.assertEqual(len(response.json()['feedback']), 3)
+
+    def test_recipe_details_cached(self):
+        url = reverse('recipe_details', args=[self.recipe.pk])
+        etag = self.client.get(url)['ETag']
+        # Only the version is read
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Any change to the recipe makes a new version
+        with self.captureOnCommitCallbacks(execute=True):
+            Feedback.objects.create(user=self.users[0], recipe=self.recipe, rating=5, review_text='great')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()['feedback']), 4)
+
+    def test_recipe_details_missing(self):
+        url = reverse('recipe_details', args=[self.recipe.pk + 1000])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 404)
+
+    def test_recipe_details_changed_within_a_second(self):
+        url = reverse('recipe_details', args=[self.recipe.pk])
+        with mock.patch('time.time_ns', return_value=1_700_000_000_000_000_000):
+            recipe_cache.bump_versions([self.recipe.pk])
+            last_modified = self.client.get(url)['Last-Modified']
+            recipe_cache.bump_versions([self.recipe.pk])
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['Last-Modified'], last_modified)
+
+    def test_ingredient_list(self):
+        with self.assertNumQueries(1):
+            self.client.get(reverse('ingredient-list'))
+
+    def test_recipe_list_stream(self):
+        expected = self.client.get(reverse('recipe_list')).json()['results']
+        with mock.patch.object(streaming, 'CHUNK_SIZE', 2), self.assertNumQueries(1):
+            response = self.client.get(reverse('recipe_list'), {'stream': '1'})
+            content = self.read_stream(response)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(content), expected)
+
+        with mock.patch.object(streaming, 'CHUNK_SIZE', 2):
+            response = self.client.get(reverse('recipe_list'), {'stream': 'ndjson'})
+            lines = self.read_stream(response).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], expected)
+        self.assertEqual(self.client.get(reverse('recipe_list'), {'stream': 'xml'}).status_code, 400)
+
+    def test_ingredient_list_stream(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('ingredient-list'), {'stream': 'ndjson'})
+            lines = self.read_stream(response).splitlines()
+        self.assertEqual([json.loads(line)['name'] for line in lines], ['butter', 'sugar'])
+
+    def test_search_by_description(self):
+        # latest invalidation, full text match, page of recipes, snippets of the page
+        with self.assertNumQueries(4):
+            response = self.client.post(reverse('search_by_description'), {'description': 'chocolate cake'}, format='json')
+        self.assertEqual(len(response.json()['results']), 5)
+        self.assertIn('<mark>', response.json()['results'][0]['snippet'])
+        # invalidations of the cached page since
+        with self.assertNumQueries(1):
+            self.client.post(reverse('search_by_description'), {'description': 'cake chocolate'}, format='json')
+
+    def test_search_by_ingredients(self):
+        # latest invalidation, ingredient names, page of recipes
+        with self.assertNumQueries(3):
+            response = self.client.post(reverse('search_by_ingredients'), {'ingredients': ['butter', 'sugar']}, format='json')
+        self.assertEqual(len(response.json()['results']), 5)
+        # invalidations of the cached page since
+        with self.assertNumQueries(1):
+            self.client.post(reverse('search_by_ingredients'), {'ingredients': ['sugar', 'butter']}, format='json')
+
+
+class AnalyzerTests(SimpleTestCase):
+    def test_bundled_stop_words(self):
+        self.assertEqual(text.tokenize("Don't burn the Chocolate cakes!"), ['burn', 'chocolate', 'cakes'])
+        self.assertNotIn('nltk', sys.modules)
+
+    def test_stemmer(self):
+        analyzer = text.Analyzer(text.load_stop_words(), stem=lambda term: term.rstrip('s'))
+        self.assertEqual(analyzer.tokenize('the cakes'), ['cake'])
+
+    def test_non_ascii_words(self):
+        self.assertEqual(text.tokenize('Crème brûlée with jalapeño_salsa'), ['creme', 'brulee', 'jalapeno', 'salsa'])
+        # The same terms as the FTS5 tokenizer
+        backend = search.Fts5SearchBackend()
+        self.assertEqual(backend.query_terms('Crème brûlée'), backend.index_terms('crème brûlée'))
+        self.assertEqual(backend.query_terms('Crème brûlée'), {'creme', 'brule'})
+
+
+class InvertedIndexTests(RecipeFixtures, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.cake = cls.create_recipe('chocolate cake', description='a rich dessert')
+        cls.brownies = cls.create_recipe('brownies', description='chocolate squares')
+        cls.salad = cls.create_recipe('salad', description='green leaves')
+        search.rebuild_index()
+
+    def test_postings(self):
+        # The title counts three times, the description once
+        postings = SearchPosting.objects.filter(term='chocolate').values_list('recipe_id', 'frequency')
+        self.assertEqual(sorted(postings), sorted([(self.cake.pk, 3), (self.brownies.pk, 1)]))
+        self.assertEqual(SearchDocument.objects.get(recipe=self.cake).length, 3 + 3 + 2)
+
+    def test_bm25_ranking(self):
+        results = search.search_recipes('Chocolate')
+        self.assertEqual([recipe_id for recipe_id, score in results], [self.cake.pk, self.brownies.pk])
+        self.assertGreater(results[0][1], results[1][1])
+        # Every term must match
+        self.assertEqual([recipe_id for recipe_id, score in search.search_recipes('chocolate squares')], [self.brownies.pk])
+        self.assertEqual(search.search_recipes('chocolate pizza'), [])
+        self.assertIsNone(search.search_recipes('the'))
+
+    def test_reindex(self):
+        Recipe.objects.filter(pk=self.brownies.pk).update(description='fudge squares')
+        self.salad.delete()
+        search.index_recipes([self.brownies.pk, self.salad.pk])
+        self.assertEqual([recipe_id for recipe_id, score in search.search_recipes('chocolate')], [self.cake.pk])
+        self.assertEqual([recipe_id for recipe_id, score in search.search_recipes('fudge')], [self.brownies.pk])
+        self.assertEqual(SearchDocument.objects.count(), 2)
+
+
+class Fts5SearchTests(RecipeFixtures, TestCase):
+    def setUp(self):
+        self.backend = search.Fts5SearchBackend()
+
+    def found(self, query):
+        return [hit.recipe_id for hit in self.backend.search(query)]
+
+    def indexed(self, recipe_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {self.backend.table} WHERE rowid = %s', [recipe_id])
+            return cursor.fetchone()[0] == 1
+
+    def test_triggers(self):
+        recipe = self.create_recipe('lemon tart', description='a sharp dessert')
+        self.assertEqual(self.found('tarts'), [recipe.pk])
+
+        Recipe.objects.filter(pk=recipe.pk).update(title='lime tart')
+        self.assertEqual(self.found('lemon'), [])
+        self.assertEqual(self.found('lime'), [recipe.pk])
+
+        step = RecipeStep.objects.create(recipe=recipe, step_no=1, descriptions='Blind bake the pastry')
+        tag = Tag.objects.create(name='summer')
+        RecipeTag.objects.create(recipe=recipe, tag=tag)
+        self.assertEqual(self.found('pastry summer'), [recipe.pk])
+        Tag.objects.filter(pk=tag.pk).update(name='picnic')
+        step.delete()
+        self.assertEqual(self.found('picnic'), [recipe.pk])
+        self.assertEqual(self.found('pastry'), [])
+
+        recipe.delete()
+        self.assertFalse(self.indexed(recipe.pk))
+
+    def test_ranking_and_snippet(self):
+        cake = self.create_recipe('chocolate cake', description='a rich dessert')
+        brownies = self.create_recipe('brownies', description='chocolate squares')
+        hits = self.backend.search('chocolate')
+        # The title weighs more than the description
+        self.assertEqual([hit.recipe_id for hit in hits], [cake.pk, brownies.pk])
+        # Only for the recipes asked for
+        snippets = self.backend.snippets('chocolate', [brownies.pk])
+        self.assertEqual(list(snippets), [brownies.pk])
+        self.assertIn('<mark>chocolate</mark>', snippets[brownies.pk])
+        self.assertEqual(self.backend.snippets('chocolate', []), {})
+        self.assertIsNone(self.backend.search('the'))
+
+    def test_paused(self):
+        recipe_ids = []
+        with transaction.atomic(), self.backend.paused(recipe_ids):
+            recipe = self.create_recipe('lemon tart')
+            recipe_ids.append(recipe.pk)
+            self.assertFalse(self.indexed(recipe.pk))
+        # Indexed once when the block exits, and the triggers work again
+        self.assertEqual(self.found('lemon'), [recipe.pk])
+        other = self.create_recipe('lemon curd')
+        self.assertEqual(self.found('lemon'), [other.pk, recipe.pk])
+
+
+class AsyncURLConf:
+    # urls.py as it is under ASGI
+    urlpatterns = [
+        path('', async_views.HomePageView.as_view(), name='home_page'),
+        path('recipes/', async_views.RecipeListView.as_view(), name='recipe_list'),
+        path('recipes/trending/', async_views.TrendingRecipesView.as_view(), name='trending_recipes'),
+        path('recipes/<int:pk>/', async_views.RecipeDetailsView.as_view(), name='recipe_details'),
+        path('recipes/search_by_ingredients/', async_views.SearchByIngredientsView.as_view(), name='search_by_ingredients'),
+        path('recipes/search_by_description/', async_views.SearchByDescriptionView.as_view(), name='search_by_description'),
+        *urls.urlpatterns,
+    ]
+
+
+@override_settings(ROOT_URLCONF=AsyncURLConf)
+class AsyncQueryBudgetTests(QueryBudgetTests):
+    """
+    The same budgets and answers for the async views used under ASGI.
+    """
+
+    def test_same_payload(self):
+        response = self.client.get(reverse('recipe_list'), {'page_size': 2})
+        with override_settings(ROOT_URLCONF='KhaboBackend.urls'):
+            expected = self.client.get(reverse('recipe_list'), {'page_size': 2})
+        self.assertEqual(response.json(), expected.json())
+        self.assertEqual(self.client.get(response.json()['next']).json()['results'][0]['id'], self.recipe.pk - 2)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get(reverse('recipe_list'), {'cursor': 'nope'}).status_code, 404)
+
+
+class RatingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user_model = get_user_model()
+        cls.users = [
+            user_model.objects.create_user(email=f'critic{i}@example.com', username=f'critic{i}', password='secret')
+            for i in range(3)
+        ]
+        cls.recipe = Recipe.objects.create(user=cls.users[0], title='soup', description='soup', making_time='10 minutes')
+
+    def give_feedback(self, user, rating, recipe_id=None):
+        client = APIClient()
+        client.force_authenticate(user)
+        url = reverse('give_feedback', args=[recipe_id or self.recipe.pk])
+        return client.post(url, {'rating': rating, 'review_text': 'ok'}, format='json')
+
+    def test_feedback_updates_aggregates(self):
+        for user, rating in zip(self.users, [5, 4, 4]):
+            self.assertEqual(self.give_feedback(user, rating).status_code, 201)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.rating_count, 3)
+        self.assertEqual(self.recipe.rating_sum, Decimal('13'))
+        self.assertEqual(self.recipe.rating, Decimal('4.33'))
+
+    def test_feedback_cost_doesnt_grow(self):
+        for user in self.users:
+            Feedback.objects.create(user=user, recipe=self.recipe, rating=3, review_text='meh')
+        # rating update, feedback insert, plus savepoints in the test transaction
+        with self.assertNumQueries(4):
+            self.give_feedback(self.users[0], 5)
+
+    def test_unknown_recipe(self):
+        self.assertEqual(self.give_feedback(self.users[0], 5, recipe_id=self.recipe.pk + 1).status_code, 404)
+        self.assertFalse(Feedback.objects.exists())
+
+    def aggregates(self, recipe=None):
+        recipe = recipe or self.recipe
+        recipe.refresh_from_db()
+        return recipe.rating_sum, recipe.rating_count, recipe.rating
+
+    def test_edit_and_delete(self):
+        for user, rating in zip(self.users, [5, 4, 3]):
+            self.give_feedback(user, rating)
+        # As the admin changes a review, loaded then saved
+        feedback = Feedback.objects.get(user=self.users[2])
+        feedback.rating = 1
+        feedback.save()
+        self.assertEqual(self.aggregates(), (Decimal('10'), 3, Decimal('3.33')))
+        Feedback.objects.get(user=self.users[0]).delete()
+        self.assertEqual(self.aggregates(), (Decimal('5'), 2, Decimal('2.5')))
+
+        # Deleting a user deletes their reviews
+        self.users[1].delete()
+        feedback.delete()
+        self.assertEqual(self.aggregates(), (Decimal('0'), 0, Decimal('0')))
+
+    def test_moved_or_unloaded(self):
+        other = Recipe.objects.create(user=self.users[0], title='stew', description='stew', making_time='1 hour')
+        feedback = Feedback.objects.create(user=self.users[0], recipe=self.recipe, rating=4, review_text='ok')
+        feedback.recipe = other
+        feedback.save()
+        self.assertEqual(self.aggregates()[:2], (Decimal('0'), 0))
+        self.assertEqual(self.aggregates(other)[:2], (Decimal('4'), 1))
+        # Not loaded from the database, the recipe is counted again from its reviews
+        Feedback(pk=feedback.pk, user=self.users[0], recipe=other, rating=2, review_text='meh').save()
+        self.assertEqual(self.aggregates(other), (Decimal('2'), 1, Decimal('2')))
+
+    def test_reconcile(self):
+        for user, rating in zip(self.users, [2, 3, 5]):
+            Feedback.objects.create(user=user, recipe=self.recipe, rating=rating, review_text='ok')
+        Recipe.objects.reconcile_ratings()
+        self.recipe.refresh_from_db()
+        self.assertEqual((self.recipe.rating_sum, self.recipe.rating_count), (Decimal('10'), 3))
+        self.assertEqual(self.recipe.rating, Decimal('3.33'))
+
+
+class PointsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email='chef@example.com', username='chef', password='secret')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_recipe(self, rating):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Recipe.objects.create(
+                user=self.user, title='stew', description='stew', making_time='1 hour', rating=rating,
+            )
+
+    def test_points_follow_recipes(self):
+        self.create_recipe(4)
+        self.create_recipe(5)
+        self.user.refresh_from_db()
+        # 2 recipes * 2 + 4.5 average * 3
+        self.assertEqual(self.user.points, Decimal('17.50'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.get(user=self.user, rating=5).delete()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.points, Decimal('14.00'))
+
+    def test_cached_details_show_new_points(self):
+        stew = self.create_recipe(4)
+        url = reverse('recipe_details', args=[stew.pk])
+        self.assertEqual(self.client.get(url).data['user']['points'], '14.00')
+        # The author's points come from every recipe, another one changes this one's details
+        self.create_recipe(5)
+        self.assertEqual(self.client.get(url).data['user']['points'], '17.50')
+
+    def test_profile_is_read_only(self):
+        for rating in range(3):
+            self.create_recipe(rating)
+        # user, page of recipes, nothing written
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('user_profile', args=[self.user.pk]), {'page_size': 2})
+        self.assertEqual(response.data['points'], '9.00')
+        self.assertEqual(len(response.data['added_recipes']['results']), 2)
+        self.assertIsNotNone(response.data['added_recipes']['next'])
+
+
+class AddRecipeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email='baker@example.com', username='baker', password='secret')
+        Ingredient.objects.create(name='flour')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def payload(self, size):
+        return {
+            'title': 'bread',
+            'description': 'plain bread',
+            'making_time': '2 hours',
+            'ingredients': [{'ingredient': {'name': f'flour {i}' if i else 'flour'}, 'quantity': '1 cup'} for i in range(size)],
+            'tags': [{'tag': {'name': f'tag {i}'}} for i in range(size)],
+            'steps': [{'step_no': i + 1, 'descriptions': f'step {i + 1}'} for i in range(size)],
+        }
+
+    def test_query_count_doesnt_depend_on_size(self):
+        # recipe, ingredient aliases, ingredients, tags and steps, plus the savepoint of the transaction
+        with self.assertNumQueries(11):
+            response = self.client.post(reverse('add_recipe'), self.payload(2), format='json')
+        self.assertEqual(response.status_code, 201)
+        with self.assertNumQueries(11):
+            self.client.post(reverse('add_recipe'), self.payload(15), format='json')
+
+        recipe = Recipe.objects.latest('pk')
+        self.assertEqual(recipe.ingredients.count(), 15)
+        self.assertEqual(recipe.tags.count(), 15)
+        self.assertEqual(list(recipe.steps.order_by('step_no').values_list('step_no', flat=True)), list(range(1, 16)))
+        # existing ingredients are reused
+        self.assertEqual(Ingredient.objects.filter(name='flour').count(), 1)
+
+
+class UpdateRecipeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email='editor@example.com', username='editor', password='secret')
+        cls.recipe = Recipe.objects.create(user=cls.user, title='pie', description='apple pie', making_time='1 hour')
+        for name in ('apple', 'flour'):
+            RecipeIngredient.objects.create(recipe=cls.recipe, ingredient=Ingredient.objects.create(name=name), quantity='1 cup')
+        RecipeTag.objects.create(recipe=cls.recipe, tag=Tag.objects.create(name='dessert'))
+        for step_no in (1, 2):
+            step = RecipeStep.objects.create(recipe=cls.recipe, step_no=step_no, descriptions=f'step {step_no}')
+            StepImage.objects.create(step=step, image=Image.objects.create(image_path=f'recipe_step_images/{step_no}.png'), serial_no=1)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('recipe-update', args=[self.recipe.pk])
+
+    def ids(self, related):
+        return sorted(related.values_list('pk', flat=True))
+
+    def test_step_typo_keeps_ids(self):
+        ingredient_ids, tag_ids, step_ids = self.ids(self.recipe.ingredients), self.ids(self.recipe.tags), self.ids(self.recipe.steps)
+        response = self.client.patch(self.url, {
+            'steps': [{'step_no': 1, 'descriptions': 'step 1'}, {'step_no': 2, 'descriptions': 'step two'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.ids(self.recipe.ingredients), ingredient_ids)
+        self.assertEqual(self.ids(self.recipe.tags), tag_ids)
+        self.assertEqual(self.ids(self.recipe.steps), step_ids)
+        self.assertEqual(RecipeStep.objects.get(recipe=self.recipe, step_no=2).descriptions, 'step two')
+        self.assertEqual(StepImage.objects.filter(step__recipe=self.recipe).count(), 2)
+
+    def test_diff(self):
+        apple = self.recipe.ingredients.get(ingredient__name='apple')
+        self.client.patch(self.url, {
+            'ingredients': [{'ingredient': {'name': 'apple'}, 'quantity': '3'}, {'ingredient': {'name': 'sugar'}, 'quantity': '1 cup'}],
+            'tags': [{'tag': {'name': 'dessert'}}, {'tag': {'name': 'baked'}}],
+            'steps': [{'step_no': 1, 'descriptions': 'step 1'}],
+        }, format='json')
+        self.assertEqual(self.recipe.ingredients.get(ingredient__name='apple').pk, apple.pk)
+        self.assertEqual(
+            sorted(self.recipe.ingredients.values_list('ingredient__name', 'quantity')),
+            [('apple', '3'), ('sugar', '1 cup')],
+        )
+        self.assertEqual(sorted(self.recipe.tags.values_list('tag__name', flat=True)), ['baked', 'dessert'])
+        # The image of the deleted step went with it
+        self.assertEqual(list(Image.objects.values_list('image_path', flat=True)), ['recipe_step_images/1.png'])
+
+
+class IngredientNameTests(RecipeFixtures, TestCase):
+    def test_canonical_name(self):
+        for name, canonical in [
+            ('Large EGGS (room temperature)', 'egg'),
+            ('tomatoes', 'tomato'),
+            ('bay leaves', 'bay leaf'),
+            ('molasses', 'molasses'),
+            ('fresh grated parmesan cheese', 'parmesan cheese'),
+            ('chicken breast, boneless', 'chicken breast'),
+            ('a pinch of salt', 'salt'),
+            ('coca powder', 'cocoa powder'),
+            ('icing sugar', 'powdered sugar'),
+            ('ground cinnamon', 'ground cinnamon'),
+        ]:
+            self.assertEqual(ingredient_names.canonical_name(name), canonical)
+
+    def test_written_under_canonical_name(self):
+        egg = Ingredient.objects.create(name='egg')
+        sugar = Ingredient.objects.create(name='sugar')
+        IngredientAlias.objects.create(alias='Caster Sugar', ingredient=sugar)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        client.post(reverse('add_recipe'), {
+            'title': 'meringue',
+            'description': 'meringue',
+            'making_time': '2 hours',
+            'ingredients': [
+                {'ingredient': {'name': name}, 'quantity': '1'} for name in ('Eggs', 'caster sugar', 'Lemons')
+            ],
+            'tags': [],
+            'steps': [],
+        }, format='json')
+        recipe = Recipe.objects.latest('pk')
+        self.assertEqual(
+            sorted(recipe.ingredients.values_list('ingredient__name', flat=True)), ['egg', 'lemon', 'sugar'],
+        )
+        self.assertEqual(ingredient_index.resolve_ingredients(['EGGS', 'caster sugar']), [{egg.pk}, {sugar.pk}])
+
+    def test_merge(self):
+        egg = Ingredient.objects.create(name='Eggs')
+        duplicates = [Ingredient.objects.create(name=name) for name in ('egg', 'large eggs')]
+        IngredientAlias.objects.create(alias='huevo', ingredient=duplicates[1])
+        dairy = Category.objects.create(name='dairy')
+        IngredientCategory.objects.create(ingredient=duplicates[1], category=dairy)
+        IngredientCategory.objects.create(ingredient=duplicates[0], category=dairy)
+        recipes = []
+        for ingredient in (egg, *duplicates):
+            recipe = self.create_recipe('omelette')
+            RecipeIngredient.objects.create(recipe=recipe, ingredient=ingredient, quantity='2')
+            recipes.append(recipe)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('merge_ingredients', batch_size=1, stdout=io.StringIO())
+        # The ingredient already named right is kept
+        self.assertEqual(list(Ingredient.objects.values_list('pk', flat=True)), [duplicates[0].pk])
+        self.assertEqual(RecipeIngredient.objects.filter(ingredient=duplicates[0]).count(), 3)
+        self.assertEqual(IngredientCategory.objects.get().ingredient_id, duplicates[0].pk)
+        self.assertEqual(IngredientAlias.objects.get().ingredient_id, duplicates[0].pk)
+        self.assertEqual(ingredient_index.get_index().recipes_by_ingredient[duplicates[0].pk], {recipe.pk for recipe in recipes})
+
+    def test_merge_collapses_rows_of_one_recipe(self):
+        omelette = self.create_recipe('omelette')
+        for name, quantity in (('egg', '1'), ('Eggs', '2'), ('butter', '1 tbsp')):
+            RecipeIngredient.objects.create(recipe=omelette, ingredient=Ingredient.objects.create(name=name), quantity=quantity)
+        call_command('merge_ingredients', stdout=io.StringIO())
+        self.assertEqual(
+            sorted(omelette.ingredients.values_list('ingredient__name', 'quantity')), [('butter', '1 tbsp'), ('egg', '1 + 2')],
+        )
+
+    def test_repeated_ingredient_is_one_row(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        client.post(reverse('add_recipe'), {
+            'title': 'omelette',
+            'description': 'omelette',
+            'making_time': '5 minutes',
+            'ingredients': [{'ingredient': {'name': name}, 'quantity': '1'} for name in ('egg', 'Eggs')],
+            'tags': [],
+            'steps': [],
+        }, format='json')
+        recipe = Recipe.objects.latest('pk')
+        self.assertEqual(list(recipe.ingredients.values_list('ingredient__name', 'quantity')), [('egg', '1 egg + 1 Eggs')])
+
+
+class SearchCacheTests(RecipeFixtures, TestCase):
+    ingredient_names = ('flour',)
+
+    def setUp(self):
+        self.client = APIClient()
+        search_cache.results.clear()
+        # Left over from other tests otherwise, the recipes created here are added on commit
+        ingredient_index.get_index().build()
+
+    def search(self, description):
+        response = self.client.post(reverse('search_by_description'), {'description': description}, format='json')
+        return [result['id'] for result in response.json()['results']]
+
+    def test_new_recipe_matching_a_stem(self):
+        self.assertEqual(self.search('bake'), [])
+        self.assertEqual(len(search_cache.results), 1)
+        # FTS5 matches 'bake' with 'baking', the cached empty page must go
+        with self.captureOnCommitCallbacks(execute=True):
+            bread = self.create_recipe('bread', description='Baking bread at home')
+        self.assertEqual(len(search_cache.results), 0)
+        self.assertEqual(self.search('bake'), [bread.pk])
+
+    def test_unrelated_recipe_keeps_entries(self):
+        self.search('bake')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_recipe('soup', description='tomato soup')
+        self.assertEqual(len(search_cache.results), 1)
+
+    def test_invalidated_by_signals(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            bread = self.create_recipe('bread', ['flour'], description='baking bread')
+        self.search('bake')
+        self.client.post(reverse('search_by_ingredients'), {'ingredients': ['flour']}, format='json')
+        self.assertEqual(len(search_cache.results), 2)
+
+        # The author is embedded in both pages
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Ada'
+            self.user.save()
+        self.assertEqual(len(search_cache.results), 0)
+
+        self.search('bake')
+        self.client.post(reverse('search_by_ingredients'), {'ingredients': ['flour']}, format='json')
+        # A new ingredient can match the names searched for
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='rye flour')
+        self.assertEqual(len(search_cache.results), 1)
+        # The rating is part of the page
+        with self.captureOnCommitCallbacks(execute=True):
+            Feedback.objects.create(user=self.user, recipe=bread, rating=4, review_text='good')
+        self.assertEqual(len(search_cache.results), 0)
+
+    def test_invalidated_by_recipe_parts(self):
+        bread = self.create_recipe('bread', description='baking bread')
+        soup = self.create_recipe('soup', description='tomato soup')
+        self.search('bake')
+
+        # A step or a tag can make a recipe match
+        with self.captureOnCommitCallbacks(execute=True):
+            RecipeStep.objects.create(recipe=soup, step_no=1, descriptions='Bake the croutons')
+        self.assertEqual(len(search_cache.results), 0)
+        self.assertCountEqual(self.search('bake'), [soup.pk, bread.pk])
+        search_cache.results.clear()
+        self.search('spicy')
+        with self.captureOnCommitCallbacks(execute=True):
+            RecipeTag.objects.create(recipe=soup, tag=Tag.objects.create(name='spicy'))
+        self.assertEqual(len(search_cache.results), 0)
+
+        # The recipe is gone from the page listing it
+        self.search('bread')
+        with self.captureOnCommitCallbacks(execute=True):
+            bread.delete()
+        self.assertEqual(len(search_cache.results), 0)
+
+        self.client.post(reverse('search_by_ingredients'), {'ingredients': ['flour']}, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            RecipeIngredient.objects.create(recipe=soup, ingredient=self.ingredients['flour'], quantity='1')
+        self.assertEqual(len(search_cache.results), 0)
+        self.client.post(reverse('search_by_ingredients'), {'ingredients': ['flour']}, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='cornflour').delete()
+        self.assertEqual(len(search_cache.results), 0)
+
+    def test_ingredient_keys(self):
+        request = RequestFactory().post('/search/ingredients/')
+        key = lambda *names: ingredient_search_key(request, names, 'all')
+        # Word order and stop words are part of an ingredient name
+        self.assertNotEqual(key('peanut butter'), key('butter peanut'))
+        self.assertNotEqual(key('half and half'), key('half'))
+        self.assertNotEqual(key('flour'), key('flour', 'flour'))
+        # Names looked up the same share the entry
+        self.assertEqual(key('Eggs', 'flour'), key('flour', 'egg'))
+
+    def test_lru_and_ttl(self):
+        cache = search_cache.SearchCache(max_entries=2, ttl=60)
+        generation = cache.generation()
+        cache.set('a', 1, {'recipe:1'}, generation)
+        cache.set('b', 2, {'recipe:2'}, generation)
+        self.assertEqual(cache.get('a'), 1)
+        # 'b' is the least recently used
+        cache.set('c', 3, {'recipe:1'}, generation)
+        self.assertIsNone(cache.get('b'))
+        cache.invalidate({'recipe:1'})
+        self.assertEqual(len(cache), 0)
+        cache.set('d', 4, set(), cache.generation())
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get('d'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_invalidated_in_other_processes(self):
+        # Another worker's cache, its entries are only dropped from this one's
+        other = search_cache.SearchCache()
+        generation = other.generation()
+        other.set('bread', 1, {'recipe:1', 'term:bread'}, generation)
+        other.set('soup', 2, {'recipe:2'}, generation)
+        search_cache.results.invalidate({'term:bread'})
+        self.assertEqual(len(other), 2)
+        self.assertIsNone(other.get('bread'))
+        self.assertEqual(other.get('soup'), 2)
+        # Computed while a write was being invalidated
+        other.set('bread', 1, {'term:bread'}, generation)
+        self.assertIsNone(other.get('bread'))
+        other.set('bread', 1, {'term:bread'}, other.generation())
+        self.assertEqual(other.get('bread'), 1)
+
+
+class SearchPaginationTests(RecipeFixtures, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        search_cache.results.clear()
+
+    def search(self, cursor=None):
+        url = reverse('search_by_description') + '?page_size=2' + (f'&cursor={cursor}' if cursor else '')
+        return self.client.post(url, {'description': 'soup'}, format='json').json()
+
+    def test_invalid_recipes_dont_shorten_pages(self):
+        soups = [self.create_recipe(f'soup {number}') for number in range(5)]
+        Recipe.objects.filter(pk__in=[soups[4].pk, soups[3].pk, soups[0].pk]).update(is_valid=False)
+        page = self.search()
+        self.assertEqual([result['id'] for result in page['results']], [soups[2].pk, soups[1].pk])
+        self.assertIsNotNone(page['next'])
+        cursor = page['next'].split('cursor=')[1]
+        # Only an invalid recipe is left
+        page = self.search(cursor)
+        self.assertEqual(page['results'], [])
+        self.assertIsNone(page['next'])
+
+    def walk(self, fetch, url):
+        ids = []
+        while url is not None:
+            page = fetch(url).json()
+            ids.extend(result['id'] for result in page['results'])
+            url = page['next']
+        return ids
+
+    def test_home_page_round_trip(self):
+        recipes = [self.create_recipe(f'cake {number}') for number in range(5)]
+        for recipe, rating in zip(recipes, ['4.50', '4.50', '3.00', '4.50', '0.00']):
+            Recipe.objects.filter(pk=recipe.pk).update(rating=Decimal(rating), is_feature=True)
+        # Equal ratings continue by id across pages
+        self.assertEqual(
+            self.walk(self.client.get, reverse('home_page') + '?page_size=2'),
+            [recipes[3].pk, recipes[1].pk, recipes[0].pk, recipes[2].pk, recipes[4].pk],
+        )
+
+    def test_search_round_trip(self):
+        soups = [self.create_recipe(f'soup {number}', description='soup ' * (number % 3 + 1)) for number in range(7)]
+        url = reverse('search_by_description')
+        ranked = [result['id'] for result in self.client.post(url + '?page_size=100', {'description': 'soup'}, format='json').json()['results']]
+        self.assertCountEqual(ranked, [soup.pk for soup in soups])
+        fetch = lambda url: self.client.post(url, {'description': 'soup'}, format='json')
+        self.assertEqual(self.walk(fetch, url + '?page_size=3'), ranked)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get(reverse('home_page'), {'cursor': 'not a cursor'}).status_code, 404)
+        # One value for a two column ordering
+        cursor = KeysetPagination().encode_cursor([1])
+        self.assertEqual(self.client.get(reverse('home_page'), {'cursor': cursor}).status_code, 404)
+
+    def test_malformed_cursor_values(self):
+        self.create_recipe('soup')
+        encode = KeysetPagination().encode_cursor
+        for url in [reverse('recipe_list'), reverse('ingredient-list')]:
+            for position in [['abc'], [None], [{'a': 1}], [[1]]]:
+                with self.subTest(url=url, position=position):
+                    self.assertEqual(self.client.get(url, {'cursor': encode(position)}).status_code, 404)
+        for position in [['1', 'x'], [None, 1], ['4.5', {'a': 1}]]:
+            with self.subTest(position=position):
+                self.assertEqual(self.client.get(reverse('home_page'), {'cursor': encode(position)}).status_code, 404)
+        # Ranked results are compared in memory against the cursor
+        url = reverse('search_by_description')
+        for position in [['abc', 1], [None, 1], [1], [True, 1]]:
+            with self.subTest(url=url, position=position):
+                response = self.client.post(url + '?cursor=' + encode(position), {'description': 'soup'}, format='json')
+                self.assertEqual(response.status_code, 404)
+
+
+class DatasetChunkTests(SimpleTestCase):
+    header = ['title', 'quantities', 'ingredients', 'tags', 'steps', 'description']
+    rows = [
+        ['pancakes', '["1 cup"]', '["flour"]', "['breakfast']", "['Whisk', 'Fry']", 'Fluffy.\nFlip "once", then serve'],
+        ['soup', '["2"]', '["tomatoes"]', '[]', "['Simmer']", 'Warm\r\nand red'],
+        ['He said "delicious"', '[]', '[]', '[]', '[]', ''],
+        ['toast', '["1 slice"]', '["bread"]', "['quick']", "['Toast it']", 'Crisp'],
+    ]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = f'{directory.name}/recipes.csv'
+        with open(self.path, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(self.header)
+            writer.writerows(self.rows)
+        self.size = os.path.getsize(self.path)
+
+    def test_record_boundary(self):
+        self.assertEqual(dataset.record_boundary(b'a,b\n"x\ny",z\n'), 12)
+        # The second newline is inside a quoted field
+        self.assertEqual(dataset.record_boundary(b'a,b\n"x\ny'), 4)
+        self.assertIsNone(dataset.record_boundary(b'"x\ny'))
+        # Doubled quotes are an escaped quote, not the end of the field
+        self.assertEqual(dataset.record_boundary(b'"say ""hi""\n",1\n"a'), 16)
+
+    def test_chunks_hold_whole_records(self):
+        fieldnames, start = dataset.read_header(self.path)
+        self.assertEqual(fieldnames, self.header)
+        for chunk_bytes in (1, 7, 64, 1 << 20):
+            chunks = list(dataset.find_chunks(self.path, start, chunk_bytes))
+            # Back to back from the first record to the end of the file
+            self.assertEqual(chunks[0][0], start)
+            self.assertEqual(chunks[-1][1], self.size)
+            self.assertTrue(all(end == next_start for (_, end), (next_start, _) in zip(chunks, chunks[1:])))
+            records = [record for chunk_start, chunk_end in chunks for record in dataset.parse_chunk(self.path, chunk_start, chunk_end, fieldnames)]
+            self.assertEqual([record['title'] for record in records], [row[0] for row in self.rows])
+            self.assertEqual(records[0]['description'], 'Fluffy.\nFlip "once", then serve')
+            self.assertEqual(records[1]['description'], 'Warm\r\nand red')
+            self.assertEqual(records[0]['steps'], ['Whisk', 'Fry'])
+
+    def test_resume_from_end_offset(self):
+        chunks = list(dataset.stream_records(self.path, chunk_bytes=1, workers=1))
+        self.assertEqual([len(records) for end, records in chunks], [1, 1, 1, 1])
+        resumed = list(dataset.stream_records(self.path, start=chunks[1][0], chunk_bytes=1, workers=1))
+        self.assertEqual([records[0]['title'] for end, records in resumed], ['He said "delicious"', 'toast'])
+
+
+class BulkImportTests(TestCase):
+    rows = [
+        ('brownies', ['2 cup', '3/4 cup', '4'], ['peanut butter', 'peanut butter', 'eggs'], ['desserts']),
+        ('omelette', ['3', '1 tbsp'], ['egg', 'butter'], ['breakfast']),
+        ('stew', ['1 lb', '2'], ['beef', 'onions'], ['dinner']),
+        ('salad', ['1', '1 tbsp'], ['lettuce', 'olive oil'], ['lunch, light']),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        get_user_model().objects.create_user(email='bot@example.com', username='scrapper_bot', password='secret')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.csv_file = f'{directory.name}/recipes.csv'
+        with open(self.csv_file, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['title', 'quantities', 'ingredients', 'minutes', 'tags', 'steps', 'description', 'image_path'])
+            for title, quantities, ingredients, tags in self.rows:
+                writer.writerow([title, json.dumps(quantities), json.dumps(ingredients), '10', str(tags), "['mix', 'serve']", title, title])
+
+    def run_import(self, **options):
+        # Chunks this small hold one record each
+        call_command('recipe_bulk_insert', file=self.csv_file, chunk_bytes=64, workers=1, stdout=io.StringIO(), **options)
+
+    def test_import(self):
+        self.run_import()
+        self.assertEqual(list(Recipe.objects.order_by('pk').values_list('title', flat=True)), ['brownies', 'omelette', 'stew', 'salad'])
+        brownies = Recipe.objects.get(title='brownies')
+        # Names with the same canonical form are one row
+        self.assertEqual(
+            sorted(brownies.ingredients.values_list('ingredient__name', 'quantity')),
+            [('egg', '4'), ('peanut butter', '2 cup + 3/4 cup')],
+        )
+        self.assertEqual(Ingredient.objects.filter(name='egg').count(), 1)
+        self.assertEqual(list(Recipe.objects.get(title='salad').tags.values_list('tag__name', flat=True)), ['lunch, light'])
+        self.assertFalse(ImportCheckpoint.objects.exists())
+
+    def test_resume_after_crash(self):
+        save = ImportCheckpoint.objects.update_or_create
+        calls = []
+
+        def crash_on_third_chunk(*args, **kwargs):
+            calls.append(kwargs)
+            if len(calls) == 3:
+                raise RuntimeError('killed')
+            return save(*args, **kwargs)
+
+        # Dying while the position is saved loses the chunk's recipes as well
+        with mock.patch.object(ImportCheckpoint.objects, 'update_or_create', crash_on_third_chunk):
+            with self.assertRaises(RuntimeError):
+                self.run_import()
+        self.assertEqual(Recipe.objects.count(), 2)
+        self.assertEqual(ImportCheckpoint.objects.get().rows, 2)
+
+        self.run_import(resume=True)
+        self.assertEqual(list(Recipe.objects.order_by('pk').values_list('title', flat=True)), ['brownies', 'omelette', 'stew', 'salad'])
+
+
+class SearchStatsTests(RecipeFixtures, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.cake, cls.pie = [cls.create_recipe(title, description='sweet') for title in ('chocolate cake', 'chocolate pie')]
+
+    def setUp(self):
+        self.client = APIClient()
+        search_cache.results.clear()
+        search_stats.counters.flush()
+
+    def search(self):
+        self.client.post(reverse('search_by_description'), {'description': 'chocolate'}, format='json')
+
+    def test_hits_and_opens(self):
+        self.search()
+        self.client.force_authenticate(self.user)
+        self.search()
+        self.search()
+        self.client.get(reverse('recipe_details', args=[self.cake.pk]))
+        self.assertFalse(Search.objects.exists())
+
+        with self.assertNumQueries(4):
+            # savepoint and release, upsert of the hits, update of the opens
+            self.assertEqual(search_stats.counters.flush(), 2)
+        rows = {row.recipe_id: (row.count, row.opens) for row in Search.objects.filter(user=self.user)}
+        self.assertEqual(rows, {self.cake.pk: (2, 1), self.pie.pk: (2, 0)})
+
+        self.search()
+        search_stats.counters.flush()
+        self.assertEqual(Search.objects.get(user=self.user, recipe=self.cake).count, 3)
+
+    def test_bounded_buffer(self):
+        counters = search_stats.SearchStats(max_keys=2, flush_interval=None)
+        counters.record_hits(self.user.pk, [self.cake.pk, self.pie.pk, self.pie.pk + 1])
+        counters.record_open(self.user.pk, self.cake.pk)
+        self.assertEqual(counters.stats()['dropped'], 1)
+        self.assertEqual(counters.flush(), 2)
+        self.assertEqual(Search.objects.get(recipe=self.cake).opens, 1)
+
+
+class TrendingTests(RecipeFixtures, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.cake, cls.pie, cls.soup = [cls.create_recipe(title) for title in ('cake', 'pie', 'soup')]
+
+    def test_activity_decays(self):
+        now = timezone.now()
+        Search.objects.create(user=self.user, recipe=self.cake, count=10)
+        pie = Search.objects.create(user=self.user, recipe=self.pie, count=4, opens=1)
+        self.assertEqual(trending.refresh(now), 2)
+        self.assertEqual(list(TrendingRecipe.objects.order_by('rank').values_list('recipe', flat=True)), [self.cake.pk, self.pie.pk])
+
+        # Two half lives later the cake's 10 hits weigh 2.5, the pie's old 7 and 5 new ones 6.75
+        pie.count = 9
+        pie.save()
+        self.assertEqual(trending.refresh(now + timedelta(hours=48)), 1)
+        leaderboard = list(TrendingRecipe.objects.order_by('rank').values_list('recipe', 'score'))
+        self.assertEqual([recipe_id for recipe_id, score in leaderboard], [self.pie.pk, self.cake.pk])
+        self.assertAlmostEqual(leaderboard[0][1], 6.75 * 3 / 5)
+
+        # Nothing new, nothing written
+        self.assertEqual(trending.refresh(now + timedelta(hours=49)), 0)
+
+    def test_rating_and_validity(self):
+        Search.objects.create(user=self.user, recipe=self.cake, count=5)
+        Search.objects.create(user=self.user, recipe=self.pie, count=5)
+        Search.objects.create(user=self.user, recipe=self.soup, count=5)
+        Recipe.objects.filter(pk=self.pie.pk).add_rating(5)
+        Recipe.objects.filter(pk=self.soup.pk).update(is_valid=False)
+        trending.refresh()
+        self.assertEqual(list(TrendingRecipe.objects.order_by('rank').values_list('recipe', flat=True)), [self.pie.pk, self.cake.pk])
+
+
+class SimilarRecipeTests(RecipeFixtures, TestCase):
+    ingredient_names = ('flour', 'sugar', 'butter', 'egg', 'beef', 'onion')
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.dessert = Tag.objects.create(name='dessert')
+        cls.cake = cls.create_recipe('cake', ['flour', 'sugar', 'butter', 'egg'], tags=[cls.dessert])
+        cls.pie = cls.create_recipe('pie', ['flour', 'butter', 'egg'], tags=[cls.dessert])
+        cls.cookie = cls.create_recipe('cookie', ['flour', 'sugar', 'butter'])
+        cls.stew = cls.create_recipe('stew', ['beef', 'onion', 'egg'])
+
+    def similar_ids(self, recipe):
+        return [result['id'] for result in self.client.get(reverse('similar_recipes', args=[recipe.pk])).json()['results']]
+
+    def test_neighbours(self):
+        self.assertEqual(similar.build(), 4)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.similar_ids(self.cake), [self.cookie.pk, self.pie.pk, self.stew.pk])
+        self.assertEqual(self.client.get(reverse('similar_recipes', args=[self.stew.pk + 100])).status_code, 404)
+
+    def test_incremental(self):
+        similar.build(k=1)
+        self.assertEqual(self.similar_ids(self.cake), [self.cookie.pk])
+        self.assertEqual(similar.build(k=1), 0)
+
+        # Only the new recipe is scored, and it replaces weaker neighbours
+        brownie = self.create_recipe('brownie', ['flour', 'sugar', 'butter', 'egg'], tags=[self.dessert])
+        self.assertEqual(similar.build(k=1), 1)
+        self.assertEqual(self.similar_ids(brownie), [self.cake.pk])
+        self.assertEqual(self.similar_ids(self.cake), [brownie.pk])
+
+
+class IngredientIndexTests(RecipeFixtures, TestCase):
+    ingredient_names = ('spaghetti', 'tomato', 'garlic', 'basil', 'salt', 'beef')
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.pomodoro = cls.create_recipe('pomodoro', ['spaghetti', 'tomato', 'garlic', 'salt'])
+        cls.marinara = cls.create_recipe('marinara', ['tomato', 'garlic', 'basil', 'salt'])
+        cls.bolognese = cls.create_recipe('bolognese', ['spaghetti', 'tomato', 'beef', 'garlic', 'basil'])
+        cls.steak = cls.create_recipe('steak', ['beef', 'salt'])
+
+    def setUp(self):
+        self.index = ingredient_index.IngredientIndex()
+        self.index.build()
+
+    def groups(self, *groups):
+        return [{self.ingredients[name].pk for name in group} for group in groups]
+
+    def test_recipes_with_all(self):
+        self.assertEqual(self.index.recipes_with_all(self.groups(['tomato'], ['basil'])), {self.marinara.pk, self.bolognese.pk})
+        # Any ingredient of a group will do
+        self.assertEqual(
+            self.index.recipes_with_all(self.groups(['beef', 'basil'], ['salt'])), {self.marinara.pk, self.steak.pk},
+        )
+        self.assertEqual(self.index.recipes_with_all(self.groups(['spaghetti'], ['salt'], ['beef'])), set())
+
+    def test_rank_by_coverage(self):
+        # Most groups covered first, then fewest other ingredients, then newest
+        self.assertEqual(self.index.rank_by_coverage(self.groups(['spaghetti'], ['tomato'], ['garlic'])), [
+            (self.pomodoro.pk, 3, 1), (self.bolognese.pk, 3, 2), (self.marinara.pk, 2, 2),
+        ])
+        self.assertEqual(self.index.rank_by_coverage(self.groups(['salt'])), [
+            (self.steak.pk, 1, 1), (self.marinara.pk, 1, 3), (self.pomodoro.pk, 1, 3),
+        ])
+
+    def test_update_recipes(self):
+        RecipeIngredient.objects.filter(recipe=self.steak).delete()
+        RecipeIngredient.objects.create(recipe=self.marinara, ingredient=self.ingredients['beef'], quantity='1')
+        self.index.update_recipes([self.steak.pk, self.marinara.pk])
+        self.assertNotIn(self.steak.pk, self.index.ingredients_by_recipe)
+        self.assertEqual(self.index.recipes_with_all(self.groups(['beef'])), {self.marinara.pk, self.bolognese.pk})
+        self.assertEqual(self.index.recipes_by_ingredient[self.ingredients['salt'].pk], {self.pomodoro.pk, self.marinara.pk})
+
+
+class FuzzyMatchTests(RecipeFixtures, TestCase):
+    ingredient_names = ('flour', 'flower', 'tomato', 'tomato paste', 'tomato sauce', 'potato')
+
+    def setUp(self):
+        self.matcher = fuzzy.IngredientMatcher()
+        self.matcher.build()
+
+    def names(self, term, **kwargs):
+        return [name for ingredient_id, name, score in self.matcher.match(term, **kwargs)]
+
+    def test_score_cutoff(self):
+        self.assertEqual(self.names('Flour'), ['flour'])
+        self.assertEqual(self.names('flour', score_cutoff=70), ['flour', 'flower'])
+        with self.settings(FUZZY_MATCH_CUTOFF=70):
+            self.assertEqual(self.names('flour'), ['flour', 'flower'])
+
+    def test_candidates(self):
+        self.assertEqual(self.names('tomato', score_cutoff=0), ['tomato', 'tomato paste', 'tomato sauce', 'potato'])
+        # Only the names sharing the most n-grams are scored
+        with mock.patch.object(fuzzy, 'MAX_CANDIDATES', 1):
+            self.assertEqual(self.names('tomato', score_cutoff=0), ['tomato'])
+        # 'potato' shares a single n-gram with 'tomatoe', too few to be scored at all
+        self.assertNotIn('potato', self.names('tomatoe', score_cutoff=0))
+
+    def test_typo_in_search(self):
+        fuzzy.get_matcher().build()
+        self.assertEqual(ingredient_index.resolve_ingredients(['tomatto']), [{self.ingredients['tomato'].pk}])
+
+
+class PantryTests(RecipeFixtures, TestCase):
+    ingredient_names = ('spaghetti', 'tomato', 'garlic', 'basil', 'salt', 'beef', 'cheddar', 'unsalted butter')
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.pomodoro = cls.create_recipe('pomodoro', ['spaghetti', 'tomato', 'garlic', 'salt'])
+        cls.marinara = cls.create_recipe('marinara', ['tomato', 'garlic', 'basil', 'salt'])
+        cls.lasagna = cls.create_recipe('lasagna', ['spaghetti', 'tomato', 'beef', 'cheddar', 'salt'])
+        cls.steak = cls.create_recipe('steak', ['beef', 'salt'])
+
+    def setUp(self):
+        self.client = APIClient()
+        ingredient_index.get_index().build()
+        fuzzy.get_matcher().build()
+
+    def search(self, **data):
+        response = self.client.post(reverse('pantry_search'), {'ingredients': ['spaghetti', 'tomato', 'garlic'], **data}, format='json')
+        return [(result['id'], result['missing']) for result in response.json()['results']]
+
+    def test_fewest_missing_first(self):
+        self.assertEqual(self.search(), [
+            (self.pomodoro.pk, []),
+            (self.marinara.pk, ['basil']),
+            (self.lasagna.pk, ['beef', 'cheddar']),
+        ])
+        self.assertEqual(self.search(ignore_staples=False, max_missing=1), [(self.pomodoro.pk, ['salt'])])
+
+    def test_rare_ingredients(self):
+        # Only the two most used ingredients get a bit, the others are counted aside
+        index = pantry.PantryIndex(bits=2)
+        source = ingredient_index.get_index()
+        index.build(source)
+        pantry_ids = {self.ingredients[name].pk for name in ('spaghetti', 'tomato', 'garlic')}
+        have_ids = pantry_ids | {self.ingredients['salt'].pk}
+        self.assertEqual(index.rank(pantry_ids, have_ids, source), [
+            (self.pomodoro.pk, 3, 0), (self.marinara.pk, 2, 1), (self.lasagna.pk, 2, 2),
+        ])
+
+    def test_new_recipes(self):
+        pantry.get_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            carbonara = self.create_recipe('carbonara', ['spaghetti', 'garlic'])
+        self.assertEqual(self.search()[:2], [(self.pomodoro.pk, []), (carbonara.pk, [])])
+
+    def test_exact_names(self):
+        IngredientAlias.objects.create(alias='passata', ingredient=self.ingredients['tomato'])
+        self.assertEqual(ingredient_index.resolve_exact(['Salt', 'passata', 'tomatoes']), [
+            {self.ingredients['salt'].pk}, {self.ingredients['tomato'].pk}, {self.ingredients['tomato'].pk},
+        ])
+        # Nothing is called that, the typo falls back to the fuzzy matches
+        self.assertEqual(ingredient_index.resolve_exact(['spagheti']), [{self.ingredients['spaghetti'].pk}])
+
+        pantry.get_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_recipe('shortbread', ['unsalted butter'])
+        self.assertEqual(self.search(ingredients=['salt'], ignore_staples=False, max_missing=0), [])
+
+
+class AutocompleteTests(RecipeFixtures, TestCase):
+    ingredient_names = ('sugar', 'brown sugar', 'salt', 'sumac')
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.create_recipe('cake', ['sugar', 'salt'])
+        cls.create_recipe('cake', ['brown sugar', 'salt'])
+        cls.create_recipe('cake', ['sugar'], tags=[Tag.objects.create(name='Quick Dinner')])
+        Tag.objects.create(name='dessert')
+
+    def setUp(self):
+        autocomplete._completers.clear()
+        autocomplete._building.clear()
+
+    def complete(self, url_name, q):
+        response = self.client.get(reverse(url_name), {'q': q})
+        return [result['name'] for result in response.json()['results']]
+
+    def test_most_used_first(self):
+        # Any word of the name, ties by name
+        self.assertEqual(self.complete('ingredient_autocomplete', 's'), ['salt', 'sugar', 'brown sugar', 'sumac'])
+        self.assertEqual(self.complete('ingredient_autocomplete', 'SUG'), ['sugar', 'brown sugar'])
+        self.assertEqual(self.complete('ingredient_autocomplete', 'brown s'), ['brown sugar'])
+        self.assertEqual(self.complete('ingredient_autocomplete', 'x'), [])
+        self.assertEqual(self.complete('tag_autocomplete', 'din'), ['Quick Dinner'])
+        # Served from memory once built
+        with self.assertNumQueries(0):
+            self.complete('ingredient_autocomplete', 'sum')
+
+    @override_settings(AUTOCOMPLETE={'REFRESH_SECONDS': 0, 'BACKGROUND': False})
+    def test_refreshed_on_change(self):
+        self.assertEqual(self.complete('ingredient_autocomplete', 'su'), ['sugar', 'brown sugar', 'sumac'])
+        with self.captureOnCommitCallbacks(execute=True):
+            for title in ('stew', 'soup', 'rice'):
+                self.create_recipe(title, ['sumac'])
+        self.assertEqual(self.complete('ingredient_autocomplete', 'su'), ['sumac', 'sugar', 'brown sugar'])
+
+    @override_settings(AUTOCOMPLETE={'REFRESH_SECONDS': 0})
+    def test_old_completer_answers_during_rebuild(self):
+        old = autocomplete.get_completer('ingredients')
+        autocomplete.vocabulary_changed()
+        # Another request is rebuilding it
+        autocomplete._building.add('ingredients')
+        with self.assertNumQueries(0):
+            self.assertIs(autocomplete.get_completer('ingredients'), old)
+
+    def test_change_during_build(self):
+        load = autocomplete.load
+
+        def load_then_change(kind):
+            names = load(kind)
+            autocomplete.vocabulary_changed()
+            return names
+
+        with mock.patch.object(autocomplete, 'load', load_then_change):
+            completer = autocomplete.build('ingredients')
+        # The change may be missing from it, it is refreshed again
+        self.assertTrue(completer.changed)
+        self.assertFalse(autocomplete.build('ingredients').changed)
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(
+            MEDIA_ROOT=media_root.name, IMAGE_VARIANT_WIDTHS=(160, 320), IMAGE_VARIANT_BACKGROUND=False,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email='painter@example.com', username='painter', password='secret')
+
+    def upload(self):
+        content = io.BytesIO()
+        PILImage.new('RGB', (400, 300), 'orange').save(content, 'PNG')
+        return SimpleUploadedFile('cake.png', content.getvalue(), content_type='image/png')
+
+    def test_variants_on_upload(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = Recipe.objects.create(
+                user=self.user, title='cake', description='cake', making_time='1 hour', recipe_image=self.upload(),
+            )
+        response = APIClient().get(reverse('recipe_list'))
+        variants = response.data['results'][0]['recipe_image_variants']
+        self.assertEqual(list(variants), ['160', '320', '400'])
+        self.assertEqual(set(variants['160']), {'webp', 'jpg'})
+        self.assertTrue(variants['320']['webp'].endswith('.webp'))
+
+        thumbnail = images.get_variants(recipe.recipe_image.name)[160]['webp']
+        with PILImage.open(default_storage.path(thumbnail)) as image:
+            self.assertEqual(image.size, (160, 120))
+
+    def test_details_cached_before_the_render(self):
+        with mock.patch.object(images, 'generate_and_refresh'), self.captureOnCommitCallbacks(execute=True):
+            recipe = Recipe.objects.create(
+                user=self.user, title='cake', description='cake', making_time='1 hour', recipe_image=self.upload(),
+            )
+        url = reverse('recipe_details', args=[recipe.pk])
+        self.assertEqual(self.client.get(url).json()['recipe_image_variants'], {})
+        # The render gives the recipe a new version, the payload without variants isn't served again
+        images.generate_and_refresh(recipe.recipe_image.name)
+        self.assertEqual(list(self.client.get(url).json()['recipe_image_variants']), ['160', '320', '400'])
+
+    def test_login_doesnt_render(self):
+        with mock.patch.object(images, 'generate_and_refresh') as generate, self.captureOnCommitCallbacks(execute=True):
+            self.user.image_path = self.upload()
+            self.user.save()
+            self.user.save(update_fields=['last_login'])
+        generate.assert_called_once_with(self.user.image_path.name)
+
+    def test_renderer_survives_errors(self):
+        done = threading.Event()
+
+        def generate(name):
+            if name == 'broken.png':
+                raise OSError('cannot identify image file')
+            done.set()
+
+        renderer = images.Renderer()
+        with mock.patch.object(images, 'generate_and_refresh', side_effect=generate), self.assertLogs(images.logger, 'ERROR'):
+            renderer.submit('broken.png')
+            renderer.submit('cake.png')
+            self.assertTrue(done.wait(5))
+        self.assertTrue(renderer.thread.is_alive())
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email='uploader@example.com', username='uploader', password='secret')
+
+    def create_image(self, name, data):
+        return Image.objects.create(image_path=SimpleUploadedFile(name, data))
+
+    def test_same_bytes_stored_once(self):
+        first = self.create_image('step.png', b'same bytes')
+        second = self.create_image('other.png', b'same bytes')
+        third = self.create_image('step.png', b'other bytes')
+        self.assertEqual(first.image_path.name, second.image_path.name)
+        self.assertNotEqual(first.image_path.name, third.image_path.name)
+        self.assertTrue(first.image_path.name.startswith('blobs/'))
+        self.assertEqual(StoredBlob.objects.get(name=first.image_path.name).refcount, 2)
+
+        first.image_path.delete(save=False)
+        self.assertTrue(default_storage.exists(second.image_path.name))
+        self.assertEqual(StoredBlob.objects.get(name=second.image_path.name).refcount, 1)
+
+    def test_collect_blobs(self):
+        kept = self.create_image('kept.png', b'kept')
+        dropped = self.create_image('dropped.png', b'dropped')
+        # Deleting the row doesn't release the blob, collect_blobs finds out
+        dropped.delete()
+        call_command('collect_blobs', grace_hours=0, stdout=io.StringIO())
+        self.assertEqual(list(StoredBlob.objects.values_list('name', 'refcount')), [(kept.image_path.name, 1)])
+        self.assertFalse(default_storage.exists(dropped.image_path.name))
+        self.assertTrue(default_storage.exists(kept.image_path.name))
+
+    def test_files_without_rows(self):
+        image = self.create_image('rolled_back.png', b'rolled back')
+        # The upload's transaction rolled back after the file was placed
+        StoredBlob.objects.all().delete()
+        call_command('collect_blobs', stdout=io.StringIO())
+        self.assertTrue(default_storage.exists(image.image_path.name))
+        call_command('collect_blobs', grace_hours=0, stdout=io.StringIO())
+        self.assertFalse(default_storage.exists(image.image_path.name))
+
+    def test_upload_during_collect(self):
+        dropped = self.create_image('dropped.png', b'bytes')
+        dropped.delete()
+        delete_unused = CollectBlobs.delete_unused
+
+        def upload_first(blob):
+            # The same bytes are uploaded between the count and the delete
+            self.again = self.create_image('again.png', b'bytes')
+            return delete_unused(blob)
+
+        with mock.patch.object(CollectBlobs, 'delete_unused', staticmethod(upload_first)):
+            call_command('collect_blobs', grace_hours=0, stdout=io.StringIO())
+        self.assertEqual(StoredBlob.objects.get(name=self.again.image_path.name).refcount, 1)
+        self.assertTrue(default_storage.exists(self.again.image_path.name))
+
+    def test_upload_after_collect_puts_file_back(self):
+        dropped = self.create_image('dropped.png', b'bytes')
+        dropped.delete()
+        add_reference = ContentAddressedStorage._add_reference
+
+        def collect_first(name, size):
+            # The blob is collected after the upload found its file, before it took a reference
+            call_command('collect_blobs', grace_hours=0, stdout=io.StringIO())
+            add_reference(name, size)
+
+        with mock.patch.object(ContentAddressedStorage, '_add_reference', staticmethod(collect_first)):
+            again = self.create_image('again.png', b'bytes')
+        self.assertEqual(StoredBlob.objects.get(name=again.image_path.name).refcount, 1)
+        with default_storage.open(again.image_path.name) as file:
+            self.assertEqual(file.read(), b'bytes')
+
+    def test_immutable_media_headers(self):
+        image = self.create_image('step.png', b'bytes')
+        request = RequestFactory().get('/')
+        response = serve_media(request, image.image_path.name, document_root=default_storage.location)
+        self.assertIn('immutable', response['Cache-Control'])
@@ -0,0 +1,58 @@
+import os
+import re
+import unicodedata
+from functools import lru_cache
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+STOP_WORDS_FILE = os.path.join(os.path.dirname(__file__), 'stopwords.txt')
+
+# Letters and digits of any script, the underscore separates words like in FTS5's unicode61
+token_pattern = re.compile(r'[^\W_]+')
+
+
+def fold_diacritics(text):
+    """
+    The text without accents, like unicode61's remove_diacritics: 'crème brûlée' is 'creme brulee'.
+    """
+    return ''.join(char for char in unicodedata.normalize('NFKD', text) if not unicodedata.combining(char))
+
+
+def load_stop_words(path=STOP_WORDS_FILE):
+    with open(path, encoding='utf-8') as file:
+        return frozenset(line.strip() for line in file if line.strip() and not line.startswith('#'))
+
+
+class Analyzer:
+    """
+    Turns text into search terms: lowercase words without the stop words, stemmed
+    if a stemmer is given.
+    """
+
+    def __init__(self, stop_words, stem=None):
+        self.stop_words = stop_words
+        self.stem = stem
+
+    def tokenize(self, text):
+        if not text:
+            return []
+        terms = [token for token in token_pattern.findall(fold_diacritics(text.lower())) if token not in self.stop_words]
+        if self.stem is not None:
+            terms = [self.stem(term) for term in terms]
+        return terms
+
+
+@lru_cache(maxsize=None)
+def get_analyzer():
+    """
+    The analyzer of the search terms, set up on the first search rather than at import.
+    """
+    stemmer = getattr(settings, 'SEARCH_STEMMER', None)
+    return Analyzer(load_stop_words(), stem=import_string(stemmer)().stem if stemmer else None)
+
+
+def tokenize(text):
+    """
+    Split text into lowercase terms with the stop words removed.
+    """
+    return get_analyzer().tokenize(text)
@@ -0,0 +1,101 @@
+import math
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from .models import Recipe, RecipePopularity, Search, TrendingRecipe
+
+# Weight of one search hit, one open of a search result and one new review
+HIT_WEIGHT = 1
+OPEN_WEIGHT = 3
+REVIEW_WEIGHT = 5
+
+# Recipes with few reviews are rated close to this, so one 5 star review doesn't win
+PRIOR_RATING = 3
+PRIOR_COUNT = 5
+
+# The scores are stored as log2(score * 2 ** half lives since EPOCH). Activity then only
+# adds to the score of its own recipe, the decay of every other one is implicit, and
+# sorting by it sorts by the decayed scores at any time.
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def get_options():
+    options = getattr(settings, 'TRENDING', {})
+    return options.get('SIZE', 50), options.get('HALF_LIFE_HOURS', 24)
+
+
+def half_lives(now, half_life_hours):
+    return (now - EPOCH).total_seconds() / (half_life_hours * 3600)
+
+
+def log_add(a, b):
+    # log2(2 ** a + 2 ** b) without leaving the log scale
+    high, low = max(a, b), min(a, b)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def rating_factor(rating_sum, rating_count):
+    return (float(rating_sum) + PRIOR_RATING * PRIOR_COUNT) / (rating_count + PRIOR_COUNT) / 5
+
+
+def refresh(now=None):
+    """
+    Add the search hits, opens and reviews since the last refresh to the decayed
+    popularity of their recipes and rewrite the TrendingRecipe leaderboard.
+    Returns the number of recipes whose popularity changed.
+    """
+    now = now or timezone.now()
+    size, half_life_hours = get_options()
+    elapsed = half_lives(now, half_life_hours)
+
+    # {recipe_id: [hits, opens, reviews, rating_sum]}
+    counters = {}
+    searches = Search.objects.order_by().values('recipe').annotate(hits=Sum('count'), opens=Sum('opens'))
+    for row in searches.values_list('recipe', 'hits', 'opens'):
+        counters[row[0]] = [row[1], row[2], 0, 0]
+    for recipe_id, rating_count, rating_sum in Recipe.objects.filter(rating_count__gt=0).values_list('id', 'rating_count', 'rating_sum'):
+        counters.setdefault(recipe_id, [0, 0, 0, 0])[2:] = [rating_count, rating_sum]
+
+    with transaction.atomic():
+        popularity = RecipePopularity.objects.in_bulk(list(counters))
+        created = []
+        changed = []
+        for recipe_id, (hits, opens, reviews, rating_sum) in counters.items():
+            row = popularity.get(recipe_id)
+            if row is None:
+                row = RecipePopularity(recipe_id=recipe_id)
+            activity = (
+                HIT_WEIGHT * max(hits - row.hits_seen, 0)
+                + OPEN_WEIGHT * max(opens - row.opens_seen, 0)
+                + REVIEW_WEIGHT * max(reviews - row.reviews_seen, 0)
+            )
+            if not activity and reviews == row.reviews_seen:
+                continue
+            if activity:
+                log_activity = math.log2(activity) + elapsed
+                row.log_score = log_activity if row.log_score is None else log_add(row.log_score, log_activity)
+            elif row.log_score is None:
+                continue
+            row.rank_key = row.log_score + math.log2(rating_factor(rating_sum, reviews))
+            row.hits_seen, row.opens_seen, row.reviews_seen = hits, opens, reviews
+            (changed if recipe_id in popularity else created).append(row)
+
+        RecipePopularity.objects.bulk_create(created, batch_size=500)
+        RecipePopularity.objects.bulk_update(
+            changed, ['log_score', 'rank_key', 'hits_seen', 'opens_seen', 'reviews_seen'], batch_size=500,
+        )
+
+        top = (
+            RecipePopularity.objects.filter(recipe__is_valid=True)
+            .order_by('-rank_key', '-recipe_id')
+            .values_list('recipe_id', 'rank_key')[:size]
+        )
+        leaderboard = [
+            TrendingRecipe(rank=rank, recipe_id=recipe_id, score=2 ** (rank_key - elapsed))
+            for rank, (recipe_id, rank_key) in enumerate(top, start=1)
+        ]
+        TrendingRecipe.objects.all().delete()
+        TrendingRecipe.objects.bulk_create(leaderboard)
+    return len(created) + len(changed)
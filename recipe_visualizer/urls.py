@@ -1,27 +1,36 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 from django.conf import settings
 from django.conf.urls.static import static
 
+# The async views hold no thread while they wait, under ASGI they serve the hot read paths
+read_views = async_views if settings.ASYNC_VIEWS else views
+
 urlpatterns = [
-    path('', views.HomePageView.as_view(), name='home_page'),
+    path('', read_views.HomePageView.as_view(), name='home_page'),
     path('signup/', views.SignupView.as_view(), name='signup'),
     path('login/', views.LoginView.as_view(), name='login'),
     path('profile/<int:pk>/', views.UserProfileView.as_view(), name='user_profile'),
     path('profile/update/', views.UpdateProfileView.as_view(), name='update_profile'),
     path('profile/update_password/', views.UpdatePasswordView.as_view(), name='update_password'),
-    path('recipes/', views.RecipeListView.as_view(), name='recipe_list'),
-    path('recipes/<int:pk>/', views.RecipeDetailsView.as_view(), name='recipe_details'),
+    path('recipes/', read_views.RecipeListView.as_view(), name='recipe_list'),
+    path('recipes/trending/', read_views.TrendingRecipesView.as_view(), name='trending_recipes'),
+    path('recipes/<int:pk>/', read_views.RecipeDetailsView.as_view(), name='recipe_details'),
+    path('recipes/<int:pk>/similar/', views.SimilarRecipesView.as_view(), name='similar_recipes'),
     path('recipes/add/', views.AddRecipeView.as_view(), name='add_recipe'),
-    path('recipes/search_by_ingredients/', views.SearchByIngredientsView.as_view(), name='search_by_ingredients'),
-    path('recipes/search_by_description/', views.SearchByDescriptionView.as_view(), name='search_by_description'),
+    path('recipes/search_by_ingredients/', read_views.SearchByIngredientsView.as_view(), name='search_by_ingredients'),
+    path('recipes/search_by_description/', read_views.SearchByDescriptionView.as_view(), name='search_by_description'),
+    path('recipes/pantry/', views.PantrySearchView.as_view(), name='pantry_search'),
+    path('recipes/search/cache_stats/', views.SearchCacheStatsView.as_view(), name='search_cache_stats'),
     path('recipes/<int:recipe_id>/feedback/', views.GiveFeedbackView.as_view(), name='give_feedback'),
     path('logout/', views.logout, name='logout'),
     path('recipes/<int:pk>/update/', views.UpdateRecipeView.as_view(), name='recipe-update'),
     path('recipes/<int:pk>/delete/', views.RecipeDeleteView.as_view(), name='recipe-delete'),
     path('ingredients/', views.IngredientListView.as_view(), name='ingredient-list'),
+    path('ingredients/autocomplete/', views.IngredientAutocompleteView.as_view(), name='ingredient_autocomplete'),
+    path('tags/autocomplete/', views.TagAutocompleteView.as_view(), name='tag_autocomplete'),
 
 ]
 
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    urlpatterns += static(settings.MEDIA_URL, view=views.serve_media, document_root=settings.MEDIA_ROOT)
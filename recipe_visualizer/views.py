@@ -8,10 +8,7 @@ from django.contrib.auth.hashers import make_password,check_password
 from django.contrib.auth import authenticate
 from django.contrib.auth import login as django_login, logout as django_logout
 from django.shortcuts import get_object_or_404
-from django.db.models import Q
-from fuzzywuzzy import fuzz
-from django.utils import timezone
-from decimal import Decimal
+from django.views.static import serve
 from rest_framework.exceptions import ValidationError
 from drf_spectacular.utils import extend_schema
 from .models import (
@@ -57,23 +54,34 @@ from .serializers import (
     UserProfilesSerializer,
     SearchByDescriptionSerializer,
     SearchByIngredientsSerializer,
+    PantrySerializer,
 )
-import nltk
-from nltk.corpus import stopwords
+from . import autocomplete, images, ingredient_index, pantry, recipe_cache, recipe_writes, search, search_cache, search_stats, storage, streaming
+from .ingredient_names import canonical_name
+from .pagination import KeysetPagination
 
-nltk.download('stopwords')
+class HomePageView(generics.ListAPIView):
+    queryset = Recipe.objects.for_list().filter(is_feature=True)
+    serializer_class = RecipeListSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-rating', '-id')
 
-# Define a list of stop words
-stop_words = set(stopwords.words('english'))
+    def list(self, request):
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
-class HomePageView(generics.ListAPIView):
-    queryset = Recipe.objects.filter(is_feature=True)
+
+class TrendingRecipesView(generics.ListAPIView):
+    queryset = Recipe.objects.for_list()
     serializer_class = RecipeListSerializer
+    pagination_class = None
 
     def list(self, request):
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        # The leaderboard kept by refresh_trending, in rank order with one query
+        recipes = self.get_queryset().filter(trending__isnull=False).order_by('trending__rank')
+        serializer = self.get_serializer(recipes, many=True)
+        return Response({'results': serializer.data}, status=status.HTTP_200_OK)
 
 
 class SignupView(generics.CreateAPIView):
@@ -131,45 +139,20 @@ class UserProfileView(generics.RetrieveAPIView):
     queryset = CustomUser.objects.all()
     serializer_class = CustomUserSerializer
     permission_classes = [IsAuthenticated]
+    keyset_ordering = ('-id',)
 
     def retrieve(self, request, *args, **kwargs):
-        # Get the user by their ID
+        # Get the user by their ID, points are kept up to date by the signals and refresh_points
         user = self.get_object()
-
-        # Get recipes added by the user
-        user_recipes = Recipe.objects.filter(user=user)
-
-        # Calculate user's points based on the weighted sum
-        user_points = Decimal(len(user_recipes) *2)
-        if len(user_recipes)>0:
-            total_recipe_rating = Decimal(0)
-            # Calculate the weighted sum of recipe ratings
-            for recipe in user_recipes:
-                total_recipe_rating += Decimal(recipe.rating)
-                
-            user_points += (total_recipe_rating/len(user_recipes)) * Decimal(3)
-
-        # Calculate the weighted sum based on user registration date
-        current_date = timezone.now()
-        registration_date = user.registration_date
-        days_since_registration = (current_date - registration_date).days
-
-        user_points += days_since_registration * Decimal(0.1)
-
-        # Update the user's points and save
-        user.points = user_points
-        user.save()
-
-        # Serialize user data
         serializer = self.get_serializer(user)
 
-        # Serialize user's added recipes
-        recipe_serializer = RecipeListSerializer(user_recipes, many=True, context={'request': request})	
-
+        # Serialize a page of the user's added recipes
+        user_recipes = self.paginate_queryset(Recipe.objects.for_list().filter(user=user))
+        recipe_serializer = RecipeListSerializer(user_recipes, many=True, context={'request': request})
 
         # Create a response with both user data and user's added recipes
         response_data = serializer.data
-        response_data['added_recipes'] = recipe_serializer.data
+        response_data['added_recipes'] = self.paginator.get_paginated_response(recipe_serializer.data).data
 
         return Response(response_data, status=status.HTTP_200_OK)
 
@@ -222,28 +205,65 @@ class UpdateProfileView(generics.UpdateAPIView):
     
 
 class RecipeListView(generics.ListAPIView):
-    queryset = Recipe.objects.all()
+    queryset = Recipe.objects.for_list()
     serializer_class = RecipeListSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-id',)
 
-    
     def list(self, request):
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        # ?stream=1 or ?stream=ndjson sends the whole catalogue instead of a page
+        fmt = streaming.stream_format(request)
+        if fmt:
+            queryset = self.get_queryset().order_by(*self.keyset_ordering)
+            return streaming.stream_response(queryset, self.get_serializer_class(), self.get_serializer_context(), fmt)
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
 
 class RecipeDetailsView(generics.RetrieveAPIView):
-    queryset = Recipe.objects.all()
+    queryset = Recipe.objects.for_detail()
     serializer_class = RecipeSerializer
     
 
     def retrieve(self, request, *args, **kwargs):
-        # Get the recipe by its ID
-        recipe = self.get_object()
+        recipe_id = kwargs['pk']
+        version = recipe_cache.get_version(recipe_id)
+        if version is None:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        headers = recipe_cache.headers(recipe_id, version)
+
+        search_stats.counters.record_open(request.user.pk, recipe_id)
+
+        # The client's copy is current, answer from the version alone
+        if recipe_cache.not_modified(request, recipe_id, version):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        base_url = request.build_absolute_uri('/')
+        data = recipe_cache.get_payload(recipe_id, version, base_url)
+        if data is None:
+            # Get the recipe by its ID
+            recipe = self.get_object()
+
+            # Serialize recipe data
+            serializer = self.get_serializer(recipe)
+            data = serializer.data
+            recipe_cache.set_payload(recipe_id, version, base_url, data)
+        return Response(data, status=status.HTTP_200_OK, headers=headers)
+
+
+class SimilarRecipesView(generics.ListAPIView):
+    queryset = Recipe.objects.for_list()
+    serializer_class = RecipeListSerializer
+    pagination_class = None
 
-        # Serialize recipe data
-        serializer = self.get_serializer(recipe)
-        return Response(serializer.data, status=status.HTTP_200_OK) 
+    def list(self, request, pk):
+        # The neighbours stored by build_similar_recipes, best first with one query
+        recipes = self.get_queryset().filter(is_valid=True, similar_to__recipe_id=pk).order_by('similar_to__rank')
+        serializer = self.get_serializer(recipes, many=True)
+        if not serializer.data and not Recipe.objects.filter(pk=pk).exists():
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'results': serializer.data}, status=status.HTTP_200_OK)
 
 
 class AddRecipeView(generics.CreateAPIView):
@@ -254,112 +274,226 @@ class AddRecipeView(generics.CreateAPIView):
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
-            # Create a new recipe instance
-            recipe_image = serializer.validated_data.get('recipe_image')
-            if recipe_image:
-                recipe = Recipe.objects.create(
-                    title=serializer.validated_data['title'],
-                    description=serializer.validated_data['description'],
-                    making_time=serializer.validated_data['making_time'],
-                    recipe_image=recipe_image,
-                    user=request.user  # Set the user to the authenticated user
-                )
-            else:
-                recipe = Recipe.objects.create(
-                    title=serializer.validated_data['title'],
-                    description=serializer.validated_data['description'],
-                    making_time=serializer.validated_data['making_time'],
-                    user=request.user  # Set the user to the authenticated user
-                )
+            # The recipe and all its parts are written together or not at all
+            recipe = recipe_writes.create_recipe(request.user, serializer.validated_data)
             print(recipe)
-            # Process and save ingredients
-            ingredients_data = serializer.validated_data.get('ingredients', [])
-            print(ingredients_data)
-            for ingredient_data in ingredients_data:
-                ingredient_name = ingredient_data.get('ingredient', {}).get('name')
-                ingredient, created = Ingredient.objects.get_or_create(name=ingredient_name)
-                quantity = ingredient_data.get('quantity')
-                RecipeIngredient.objects.create(recipe=recipe, ingredient=ingredient, quantity=quantity+" "+ingredient_name)
-
-            # Process and save tags
-            tags_data = serializer.validated_data.get('tags', [])
-            print(tags_data)
-            for tag_data in tags_data:
-                tag_name = tag_data.get('tag', {}).get('name')
-                tag, created = Tag.objects.get_or_create(name=tag_name)
-                RecipeTag.objects.create(recipe=recipe, tag=tag)
-
-            # Process and save steps along with images
-            steps_data = serializer.validated_data.get('steps', [])
-            print(steps_data)
-            for step_data in steps_data:
-                step = RecipeStep.objects.create(
-                    recipe=recipe,
-                    step_no=step_data.get('step_no'),
-                    descriptions=step_data.get('descriptions')
-                )
-                if step_data.get('step_images'):
-                    step_images_data = step_data.get('step_images', [])
-                    for image_data in step_images_data:
-                        image = Image.objects.create(
-                            image_path=image_data.get('image', {}).get('image_path'),
-                            descriptions=image_data.get('image', {}).get('descriptions')
-                        )
-                        StepImage.objects.create(step=step, image=image)
-
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def ingredient_search_key(request, ingredient_names, match):
+    # The names as resolve_ingredients looks them up, a repeated name still counts towards the coverage
+    return (
+        'ingredients', match, request.build_absolute_uri(),
+        tuple(sorted(canonical_name(name) for name in ingredient_names if name.strip())),
+    )
+
+
+def load_recipes(recipes_by_id, recipe_id):
+    """
+    A keep function for paginate_sequence: loads the valid recipes of a batch of
+    ranked items, recipe_id(item) is the id of an item, into recipes_by_id and
+    drops the items of the others.
+    """
+    def keep(items):
+        recipes_by_id.update(Recipe.objects.for_list().filter(is_valid=True).in_bulk([recipe_id(item) for item in items]))
+        return [item for item in items if recipe_id(item) in recipes_by_id]
+    return keep
+
+
+def rank_by_ingredients(paginator, request, ingredient_names, match):
+    """
+    The ingredient groups of the query, a page of (recipe_id, covered, missing)
+    and its recipes by id.
+    """
+    groups = ingredient_index.resolve_ingredients(ingredient_names)
+    index = ingredient_index.get_index()
+
+    recipes_by_id = {}
+    keep = load_recipes(recipes_by_id, lambda item: item[0])
+    if match == 'coverage':
+        ranking = paginator.paginate_sequence(
+            index.rank_by_coverage(groups),
+            lambda item: (-item[1], item[2], -item[0]),
+            request,
+            keep,
+        )
+    else:
+        ranking = paginator.paginate_sequence(
+            [(recipe_id, len(groups), None) for recipe_id in sorted(index.recipes_with_all(groups), reverse=True)],
+            lambda item: (-item[0],),
+            request,
+            keep,
+        )
+    return groups, ranking, recipes_by_id
+
+
+def ingredient_search_response(paginator, request, recipes_by_id, groups, ranking, match):
+    """
+    The response data and cache tags of an ingredient search, from the page of
+    ranking and its recipes loaded by id.
+    """
+    recipes = [recipes_by_id[recipe_id] for recipe_id, covered, missing in ranking if recipe_id in recipes_by_id]
+    recipe_serializer = RecipeListSerializer(recipes, many=True, context={'request': request})
+
+    results = recipe_serializer.data
+    if match == 'coverage':
+        coverage = {recipe_id: (covered, missing) for recipe_id, covered, missing in ranking}
+        for representation in results:
+            covered, missing = coverage[representation['id']]
+            representation['coverage'] = covered / len(groups)
+            representation['missing_count'] = missing
+    data = paginator.get_paginated_response(list(results)).data
+
+    tags = {search_cache.VOCABULARY}
+    for group in groups:
+        tags.update(f'ingredient:{ingredient_id}' for ingredient_id in group)
+    for recipe in recipes:
+        tags.update(search_cache.recipe_tags(recipe))
+    return data, tags
+
+
+def description_search_key(request, description):
+    return ('description', request.build_absolute_uri(), search_cache.normalize_query(description))
+
+
+def page_snippets(description, hits):
+    """
+    Snippets of the page of search hits by recipe id, none when the query listed everything.
+    """
+    if hits is None:
+        return {}
+    return search.get_backend().snippets(description, [hit.recipe_id for hit in hits])
+
+
+def description_search_response(paginator, request, description, hits, recipes, snippets):
+    """
+    The response data and cache tags of a description search. hits is the page of
+    search hits, or None when the query was only stop words and recipes lists everything.
+    """
+    recipe_serializer = RecipeListSerializer(recipes, many=True, context={'request': request})
+    results = recipe_serializer.data
+    for representation in results:
+        representation['snippet'] = snippets.get(representation['id'])
+    data = paginator.get_paginated_response(list(results)).data
+
+    if hits is None:
+        tags = {search_cache.ALL_RECIPES}
+    else:
+        tags = search_cache.term_tags(search.get_backend().query_terms(description))
+    for recipe in recipes:
+        tags.update(search_cache.recipe_tags(recipe))
+    return data, tags
+
+
+def record_search_hits(user_id, data):
+    # Counted for signed in users only, Search rows belong to a user
+    search_stats.counters.record_hits(user_id, [result['id'] for result in data['results']])
+
+
 class SearchByIngredientsView(generics.GenericAPIView):
     serializer_class = SearchByIngredientsSerializer
     queryset = Recipe.objects.all()   
+    pagination_class = KeysetPagination
+
     def post(self, request, *args, **kwargs):
         serializer = SearchByIngredientsSerializer(data=request.data)
         if serializer.is_valid():
             print(self.request.data)
             ingredient_names = serializer.validated_data["ingredients"]
             print(ingredient_names)
-            queryset = Recipe.objects.filter(is_valid=True)
-
-            for ingredient in ingredient_names:
-                queryset = queryset.filter(
-                    Q(ingredients__ingredient__name__icontains=ingredient) |
-                    Q(ingredients__ingredient__description__icontains=ingredient)
-                )
-            queryset = queryset.order_by('-id').distinct()
-            recipe_serializer = RecipeListSerializer(queryset, many=True, context={'request': request})
-            return Response(recipe_serializer.data, status=status.HTTP_200_OK)
+            match = serializer.validated_data['match']
+
+            # Repeated searches are answered from the cache until a write affects them
+            cache_key = ingredient_search_key(request, ingredient_names, match)
+            data = search_cache.results.get(cache_key)
+            if data is not None:
+                record_search_hits(request.user.pk, data)
+                return Response(data, status=status.HTTP_200_OK)
+            generation = search_cache.results.generation()
+
+            groups, ranking, recipes_by_id = rank_by_ingredients(self.paginator, request, ingredient_names, match)
+            data, tags = ingredient_search_response(self.paginator, request, recipes_by_id, groups, ranking, match)
+            search_cache.results.set(cache_key, data, tags, generation)
+            record_search_hits(request.user.pk, data)
+            return Response(data, status=status.HTTP_200_OK)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class PantrySearchView(generics.GenericAPIView):
+    serializer_class = PantrySerializer
+    queryset = Recipe.objects.all()
+    pagination_class = KeysetPagination
+
+    def post(self, request, *args, **kwargs):
+        serializer = PantrySerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        # Exact names, a pantry with salt doesn't have unsalted butter
+        pantry_ids = set().union(*ingredient_index.resolve_exact(serializer.validated_data['ingredients']))
+        have_ids = pantry_ids | pantry.staple_ids() if serializer.validated_data['ignore_staples'] else pantry_ids
+
+        # Every recipe is ranked in memory, fewest missing ingredients first
+        index, source = pantry.get_index()
+        recipes_by_id = {}
+        ranking = self.paginator.paginate_sequence(
+            index.rank(pantry_ids, have_ids, source, serializer.validated_data.get('max_missing')),
+            lambda item: (item[2], -item[1], -item[0]),
+            request,
+            load_recipes(recipes_by_id, lambda item: item[0]),
+        )
+        with source.lock:
+            missing_ids = {
+                recipe_id: source.ingredients_by_recipe.get(recipe_id, set()) - have_ids
+                for recipe_id, used, missing in ranking
+            }
+        names = dict(Ingredient.objects.filter(id__in=set().union(*missing_ids.values())).values_list('id', 'name'))
+
+        recipes = [recipes_by_id[recipe_id] for recipe_id, used, missing in ranking if recipe_id in recipes_by_id]
+        results = RecipeListSerializer(recipes, many=True, context={'request': request}).data
+        counts = {recipe_id: (used, missing) for recipe_id, used, missing in ranking}
+        for representation in results:
+            representation['used_count'], representation['missing_count'] = counts[representation['id']]
+            representation['missing'] = sorted(names[ingredient_id] for ingredient_id in missing_ids[representation['id']] if ingredient_id in names)
+        return self.get_paginated_response(list(results))
+
+
 class SearchByDescriptionView(generics.GenericAPIView):
     serializer_class = SearchByDescriptionSerializer
     queryset = Recipe.objects.all()   
+    pagination_class = KeysetPagination
+
     def post(self, request, *args, **kwargs):
         serializer = SearchByDescriptionSerializer(data=request.data)
         if serializer.is_valid():
             description = serializer.validated_data['description']
             print(description)
-            
-            # Tokenize the search query and remove stop words
-            keywords = [word for word in description.split() if word.lower() not in stop_words]
-            
-            queryset = Recipe.objects.filter(
-                is_valid=True,
-                description__isnull=False,
-            )
-            for keyword in keywords:
-                queryset = queryset.filter(
-                    Q(title__icontains=keyword) |
-                    Q(description__icontains=keyword) |
-                    Q(tags__tag__name__icontains=keyword) |
-                    Q(steps__descriptions__icontains=keyword)
+
+            # Repeated searches are answered from the cache until a write affects them
+            cache_key = description_search_key(request, description)
+            data = search_cache.results.get(cache_key)
+            if data is not None:
+                record_search_hits(request.user.pk, data)
+                return Response(data, status=status.HTTP_200_OK)
+            generation = search_cache.results.generation()
+
+            # Rank the recipes containing every keyword with the search backend
+            hits = search.get_backend().search(description)
+            if hits is None:
+                # Nothing but stop words, list every recipe
+                recipes = self.paginator.paginate_queryset(Recipe.objects.for_list().filter(is_valid=True), request, self)
+            else:
+                recipes_by_id = {}
+                hits = self.paginator.paginate_sequence(
+                    hits, lambda hit: (-hit.score, -hit.recipe_id), request, load_recipes(recipes_by_id, lambda hit: hit.recipe_id),
                 )
-            queryset = queryset.order_by('-id').distinct()
-        
-            recipe_serializer = RecipeListSerializer(queryset, many=True, context={'request': request})
-            return Response(recipe_serializer.data, status=status.HTTP_200_OK)
+                recipes = [recipes_by_id[hit.recipe_id] for hit in hits]
+
+            snippets = page_snippets(description, hits)
+            data, tags = description_search_response(self.paginator, request, description, hits, recipes, snippets)
+            search_cache.results.set(cache_key, data, tags, generation)
+            record_search_hits(request.user.pk, data)
+            return Response(data, status=status.HTTP_200_OK)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -373,28 +507,16 @@ class GiveFeedbackView(generics.CreateAPIView):
 
         user = request.user
         recipe_id = kwargs.get('recipe_id')
-        rating = serializer.validated_data.get('rating')
 
+        # Saving the feedback counts its rating in the same transaction, see signals.py
         try:
-            recipe = Recipe.objects.get(pk=recipe_id)
+            serializer.save(user=user, recipe_id=recipe_id)
         except Recipe.DoesNotExist:
             return Response(
                 {'detail': 'Recipe not found.'},
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        # Calculate the new average rating
-        feedbacks = Feedback.objects.filter(recipe=recipe)
-        total_rating = sum(feedback.rating for feedback in feedbacks) + rating
-        new_rating = total_rating / (len(feedbacks) + 1)
-
-        # Update the recipe's rating
-        recipe.rating = new_rating
-        recipe.save()
-
-        # Create the feedback
-        serializer.save(user=user, recipe=recipe)
-
         return Response(
             {'detail': 'Feedback submitted successfully.'},
             status=status.HTTP_201_CREATED
@@ -412,53 +534,8 @@ class UpdateRecipeView(generics.UpdateAPIView):
         serializer = self.get_serializer(recipe, data=request.data, partial=True)
 
         if serializer.is_valid():
-            # Update the recipe instance
-            recipe.title = serializer.validated_data.get('title', recipe.title)
-            recipe.description = serializer.validated_data.get('description', recipe.description)
-            recipe.making_time = serializer.validated_data.get('making_time', recipe.making_time)
-            
-            # Update the recipe image if provided
-            recipe_image = serializer.validated_data.get('recipe_image')
-            if recipe_image:
-                recipe.recipe_image = recipe_image
-            
-            recipe.save()
-
-            # Process and update ingredients
-            ingredients_data = serializer.validated_data.get('ingredients', [])
-            RecipeIngredient.objects.filter(recipe=recipe).delete()  # Remove existing steps
-            for ingredient_data in ingredients_data:
-                ingredient_name = ingredient_data.get('ingredient', {}).get('name')
-                ingredient, created = Ingredient.objects.get_or_create(name=ingredient_name)
-                quantity = ingredient_data.get('quantity')
-                RecipeIngredient.objects.create(recipe=recipe, ingredient=ingredient, quantity=quantity)
-
-            # Process and update tags
-            tags_data = serializer.validated_data.get('tags', [])
-            RecipeTag.objects.filter(recipe=recipe).delete()  # Remove existing tags
-
-            for tag_data in tags_data:
-                tag_name = tag_data.get('tag', {}).get('name')
-                tag, created = Tag.objects.get_or_create(name=tag_name)
-                RecipeTag.objects.create(recipe=recipe, tag=tag)
-
-            # Process and update steps along with images
-            steps_data = serializer.validated_data.get('steps', [])
-            RecipeStep.objects.filter(recipe=recipe).delete()  # Remove existing steps
-            for step_data in steps_data:
-                step = RecipeStep.objects.create(
-                    recipe=recipe,
-                    step_no=step_data.get('step_no'),
-                    descriptions=step_data.get('descriptions')
-                )
-                if step_data.get('step_images'):
-                    step_images_data = step_data.get('step_images', [])
-                    for image_data in step_images_data:
-                        image = Image.objects.create(
-                            image_path=image_data.get('image', {}).get('image_path'),
-                            descriptions=image_data.get('image', {}).get('descriptions')
-                        )
-                        StepImage.objects.create(step=step, image=image)
+            # Only the parts that changed are written, unchanged rows keep their ids
+            recipe_writes.update_recipe(recipe, serializer.validated_data)
 
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -490,7 +567,47 @@ class RecipeDeleteView(generics.DestroyAPIView):
 class IngredientListView(generics.ListAPIView):	
     queryset = Ingredient.objects.all()	
     serializer_class = IngredientSerializer	
+    pagination_class = KeysetPagination
+    keyset_ordering = ('id',)
+
     def list(self, request, *args, **kwargs):	
-        queryset = self.get_queryset()	
-        serializer = self.get_serializer(queryset, many=True)	
-        return Response(serializer.data)
+        fmt = streaming.stream_format(request)
+        if fmt:
+            queryset = self.get_queryset().order_by(*self.keyset_ordering)
+            return streaming.stream_response(queryset, self.get_serializer_class(), self.get_serializer_context(), fmt)
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+class IngredientAutocompleteView(generics.GenericAPIView):
+    kind = 'ingredients'
+    # Public, and called on every keystroke, skip the session lookup
+    authentication_classes = []
+
+    def get(self, request, *args, **kwargs):
+        # Answered from memory, no query once the completer is built
+        completions = autocomplete.get_completer(self.kind).complete(request.query_params.get('q', ''))
+        return Response({'results': [{'id': pk, 'name': name} for pk, name in completions]}, status=status.HTTP_200_OK)
+
+
+class TagAutocompleteView(IngredientAutocompleteView):
+    kind = 'tags'
+
+
+class SearchCacheStatsView(generics.GenericAPIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(search_cache.results.stats(), status=status.HTTP_200_OK)
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """
+    django.views.static.serve for MEDIA_URL in development. Blobs and their variants
+    are named after their content, so browsers may keep them forever.
+    """
+    response = serve(request, path, document_root=document_root, show_indexes=show_indexes)
+    if storage.is_blob(path) or storage.is_blob(path.removeprefix(f'{images.VARIANTS_DIR}/')):
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response